@@ -1,7 +1,19 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 import os
 import re
+import sys
+import threading
+
+# Shared text parsing, run instrumentation and rate limiting live in the TaxonGPT package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from TaxonGPT.dtom_parsing import (apply_validation_corrections, check_matrix_locally, expected_matrix_cell,
+                                   merge_character_lists, parse_matrix, parse_structured_state, parse_structured_tile,
+                                   parse_tile_lines, parse_to_matrix, parse_validation_response,
+                                   plan_extraction_tiles)
+from TaxonGPT.request_scheduler import RequestScheduler, count_tokens
+from TaxonGPT.run_trace import RunTrace
 
 # Initialize the OpenAI client with the API key
 # Retrieve the API key from the environment variables
@@ -10,9 +22,144 @@ if not api_key:
     # Raise an error if the API key is not found
     raise ValueError("API key not found. Set the OPENAI_API_KEY environment variable.")
 
-# Create an OpenAI client instance
+# Create an OpenAI client instance (set OPENAI_BASE_URL to run against TaxonGPT/mock_openai_server.py offline)
 client = OpenAI(api_key=api_key)
 
+# Optional JSONL performance and cost trace (one record per API call plus per-stage wall-clock totals)
+trace_path = os.getenv("DTOM_TRACE_PATH")
+trace = RunTrace(trace_path) if trace_path else None
+
+# Shared rate-limit scheduler (limits from OPENAI_RPM / OPENAI_TPM); retries throttled requests with backoff
+scheduler = RequestScheduler.from_env()
+
+# Extraction tile sent per request: "cell" (one character of one species, the original behaviour), "species" (all
+# characters of one species), "character" (one character across all species) or "block" (as many species and
+# characters as fit in DTOM_TILE_TOKEN_BUDGET tokens)
+extraction_tile = os.getenv("DTOM_EXTRACTION_TILE", "cell")
+tile_token_budget = int(os.getenv("DTOM_TILE_TOKEN_BUDGET", "8000"))
+if extraction_tile not in ("cell", "species", "character", "block"):
+    raise ValueError(f"Unknown DTOM_EXTRACTION_TILE '{extraction_tile}'. Use cell, species, character or block.")
+
+# Number of species (or extraction tiles) processed at once; the scheduler still caps the requests in flight
+max_workers = max(1, int(os.getenv("DTOM_MAX_WORKERS", "1")))
+
+# Request extraction and validation results as JSON following strict schemas instead of free text
+structured_output = os.getenv("DTOM_STRUCTURED_OUTPUT", "").lower() in ("1", "true", "yes")
+
+# Matrix validation: "incremental" checks the cells locally, validates the whole matrix once and then re-validates
+# only the characters corrected in the previous round; "full" (the original behaviour) re-validates the whole matrix
+# every round and twice more once it passes
+validation_mode = os.getenv("DTOM_VALIDATION", "incremental")
+if validation_mode not in ("incremental", "full"):
+    raise ValueError(f"Unknown DTOM_VALIDATION value: {validation_mode}")
+
+# Character list generation: "single" (the whole description file in one request, the original behaviour) or
+# "map_reduce" (candidate characters extracted from chunks of species of at most DTOM_CHARACTER_CHUNK_TOKENS tokens,
+# up to max_workers chunks at once, then merged locally into one numbered list)
+character_list_mode = os.getenv("DTOM_CHARACTER_LIST", "single")
+character_chunk_tokens = int(os.getenv("DTOM_CHARACTER_CHUNK_TOKENS", "8000"))
+if character_list_mode not in ("single", "map_reduce"):
+    raise ValueError(f"Unknown DTOM_CHARACTER_LIST value: {character_list_mode}")
+
+# JSON schemas of the structured extraction and validation responses
+character_state_properties = {
+    "character_id": {"type": "string"},
+    "states": {"type": "array", "items": {"type": "string"}},
+    "missing": {"type": "boolean"}
+}
+character_state_schema = {
+    "name": "character_state",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": character_state_properties,
+        "required": ["character_id", "states", "missing"],
+        "additionalProperties": False
+    }
+}
+character_state_tile_schema = {
+    "name": "character_state_tile",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "cells": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"species": {"type": "integer"}, **character_state_properties},
+                    "required": ["species", "character_id", "states", "missing"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["cells"],
+        "additionalProperties": False
+    }
+}
+matrix_validation_schema = {
+    "name": "matrix_validation",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "species": {"type": "string"},
+            "characters": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "character_id": {"type": "string"},
+                        "matrix_state": {"type": "string"},
+                        "expected_states": {"type": "array", "items": {"type": "string"}},
+                        "result": {"type": "string", "enum": ["Correct", "Error", "Missing", "Not Applicable"]}
+                    },
+                    "required": ["character_id", "matrix_state", "expected_states", "result"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["species", "characters"],
+        "additionalProperties": False
+    }
+}
+
+
+def map_concurrently(function, items, workers=1):
+    """
+    Apply a function to every item, running up to workers calls at once, and return the results in item order.
+    """
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def create_chat_completion(stage, **request):
+    """
+    Send a chat completion request through the rate-limit scheduler, recording it in the trace when tracing
+    is enabled.
+
+    Args:
+        stage (str): The pipeline stage of the call ("character_list", "extract" or "validate").
+        **request: The request parameters (model, messages, ...).
+
+    Returns:
+        The chat completion response.
+    """
+    if trace is None:
+        return scheduler.create(client, **request)
+    return trace.create(client, stage=stage, scheduler=scheduler, **request)
+
+
+def trace_stage(stage):
+    """
+    Start timing a pipeline stage in the trace, ending the previous one.
+    """
+    if trace is not None:
+        trace.begin_stage(stage)
+
+
 # Define the path to the file containing species descriptions
 file_path = "species_descriptions.txt"
 
@@ -77,23 +224,6 @@ messages_character_list = [
      """}
 ]
 
-# Generate the initial character list using OpenAI API
-try:
-    response = client.chat.completions.create(
-        model="gpt-4o-2024-08-06",
-        messages=messages_character_list,
-        stop=None,
-        temperature=0,
-        n=1
-    )
-except Exception as e:
-    print(f"API call failed: {e}")
-    exit()
-
-# Capture the character list as string
-character_list = response.choices[0].message.content
-
-
 # Function to parse the character list string
 def parse_character_list(character_list_str):
     """
@@ -122,8 +252,124 @@ def parse_character_list(character_list_str):
         return None
 
 
-# Parse the character list
-character_dict = parse_character_list(character_list)
+# Split the description file into chunks of whole species of at most token_budget tokens
+def plan_character_chunks(description_text, token_budget=8000):
+    """
+    Split the description file into chunks of consecutive species descriptions for map-reduce character list
+    generation. A species longer than the budget gets a chunk of its own.
+
+    Args:
+        description_text (str): The combined taxonomic description of all species.
+        token_budget (int): Maximum tokens of descriptions per chunk.
+
+    Returns:
+        list: The chunk texts, covering the whole description file.
+    """
+    # Split before each "<number> <Genus> <species>" heading, keeping any text before the first species
+    sections = [section for section in re.split(r"(?=^\d+ [A-Z][a-z]+ [A-Z][a-z]+)", description_text,
+                                                flags=re.MULTILINE) if section.strip()]
+
+    chunks, chunk, chunk_tokens = [], [], 0
+    for section in sections:
+        section_tokens = count_tokens(section)
+        if chunk and chunk_tokens + section_tokens > token_budget:
+            chunks.append("".join(chunk).strip())
+            chunk, chunk_tokens = [], 0
+        chunk.append(section)
+        chunk_tokens += section_tokens
+    if chunk:
+        chunks.append("".join(chunk).strip())
+    return chunks
+
+
+# Generate a character list for part of the description file
+def api_generate_character_list(description_text):
+    """
+    Generate the character list of some species descriptions.
+
+    Args:
+        description_text (str): Taxonomic descriptions of one or more species.
+
+    Returns:
+        dict: The parsed character list, or None if the call or the parsing failed.
+    """
+    messages = messages_character_list[:-1] + [
+        {"role": "user",
+         "content": f"""
+         Please generate the character list as per the requirements above.
+         Here is the combined taxonomic description of the species in this part of the dataset:
+         {description_text}
+         """}
+    ]
+    try:
+        response = create_chat_completion(
+            "character_list",
+            model="gpt-4o-2024-08-06",
+            messages=messages,
+            stop=None,
+            temperature=0,
+            n=1
+        )
+    except Exception as e:
+        print(f"API call failed: {e}")
+        return None
+    return parse_character_list(response.choices[0].message.content)
+
+
+def generate_character_list_map_reduce(description_text, token_budget=8000, workers=1):
+    """
+    Generate the character list chunk by chunk (map, up to workers chunks at once) and merge the chunk lists
+    locally (reduce).
+
+    Args:
+        description_text (str): The combined taxonomic description of all species.
+        token_budget (int): Maximum tokens of descriptions per chunk.
+        workers (int): Number of chunks processed at once.
+
+    Returns:
+        dict: The merged character list, or None if no chunk produced a character list.
+    """
+    chunks = plan_character_chunks(description_text, token_budget)
+    print(f"Generating the character list from {len(chunks)} chunks...")
+    character_lists = map_concurrently(api_generate_character_list, chunks, workers)
+
+    failed_chunks = [number for number, character_list in enumerate(character_lists, 1) if not character_list]
+    if failed_chunks:
+        print(f"Warning: no character list for chunks {', '.join(map(str, failed_chunks))}.")
+    character_lists = [character_list for character_list in character_lists if character_list]
+    if not character_lists:
+        return None
+
+    character_dict = merge_character_lists(character_lists)
+    print(f"Merged {sum(len(character_list) for character_list in character_lists)} candidate characters into "
+          f"{len(character_dict)} characters.")
+    return character_dict
+
+
+# Generate the initial character list using OpenAI API
+trace_stage("character_list")
+if character_list_mode == "map_reduce":
+    character_dict = generate_character_list_map_reduce(the_original_description, character_chunk_tokens,
+                                                        max_workers)
+else:
+    try:
+        response = create_chat_completion(
+            "character_list",
+            model="gpt-4o-2024-08-06",
+            messages=messages_character_list,
+            stop=None,
+            temperature=0,
+            n=1
+        )
+    except Exception as e:
+        print(f"API call failed: {e}")
+        exit()
+
+    # Capture the character list as string
+    character_list = response.choices[0].message.content
+
+    # Parse the character list
+    character_dict = parse_character_list(character_list)
 
 if character_dict:
     print("Parsed character list dictionary:\n", character_dict)
@@ -131,32 +377,53 @@ else:
     print("Error: Failed to parse the character list.")
 
 
+# Instructions shared by the per-cell and tiled character extraction requests
+extraction_instructions = [
+    {"role": "system",
+     "content": """
+             You are a taxonomy expert skilled in extracting morphological character information from taxonomic descriptions.
+             Based on the provided description and possible states, you will extract the specific state(s) for the given character. 
+             Additionally, if the description indicates more than one state for a character, list all relevant states (e.g., state1 and state2). 
+             If no information about the character is found in the description, mark the state as 'Missing (?)'.
+             """},
+    {"role": "system",
+     "content": f"""
+            To extract character information, follow these steps:
+            1. **Strictly ensure that the final generated matrix contains exactly the characters listed in the character list, in the specified order. You must strictly adhere to this character list, neither adding nor omitting any traits.**
+            2. For each character, check if the species description includes any mention of the character's states. If it does, accurately record the corresponding state number.
+            3. If the description does not mention any character states, use your language reasoning skills to strictly check for words indicating the absence of the characteristic (e.g., "non", "no", "not"). If such terms are present, use the corresponding state number based on your reasoning.
+            4. If there is no mention of the character's states in the species description and your reasoning confirms the absence of relevant content, use "Gap" to represent this.
+            5. For trait states that do not exist (called "Missing"), use the symbol "-".
+            """},
+    {"role": "system",
+     "content": f"""
+            After generating the extraction results in list format, please sort the traits and their corresponding states for each species **in the exact order they appear in the character list**, from left to right.
+            In the example, the first '1' indicates that character 1 has state number 1 for the species.
+            Arrange the list format results accurately as shown in the example.
+            For content where a character may have multiple possible states, use (12) to indicate that the character has either state 1 or state 2.
+            """},
+]
+
+
 # Extract corresponding character state from the description and format the output
-def api_extract_state(description, character_info, character_id):
-    messages_extract_information = [
-        {"role": "system",
-         "content": """
-                 You are a taxonomy expert skilled in extracting morphological character information from taxonomic descriptions.
-                 Based on the provided description and possible states, you will extract the specific state(s) for the given character. 
-                 Additionally, if the description indicates more than one state for a character, list all relevant states (e.g., state1 and state2). 
-                 If no information about the character is found in the description, mark the state as 'Missing (?)'.
-                 """},
-        {"role": "system",
-         "content": f"""
-                To extract character information, follow these steps:
-                1. **Strictly ensure that the final generated matrix contains exactly the characters listed in the character list, in the specified order. You must strictly adhere to this character list, neither adding nor omitting any traits.**
-                2. For each character, check if the species description includes any mention of the character's states. If it does, accurately record the corresponding state number.
-                3. If the description does not mention any character states, use your language reasoning skills to strictly check for words indicating the absence of the characteristic (e.g., "non", "no", "not"). If such terms are present, use the corresponding state number based on your reasoning.
-                4. If there is no mention of the character's states in the species description and your reasoning confirms the absence of relevant content, use "Gap" to represent this.
-                5. For trait states that do not exist (called "Missing"), use the symbol "-".
-                """},
-        {"role": "system",
-         "content": f"""
-                After generating the extraction results in list format, please sort the traits and their corresponding states for each species **in the exact order they appear in the character list**, from left to right.
-                In the example, the first '1' indicates that character 1 has state number 1 for the species.
-                Arrange the list format results accurately as shown in the example.
-                For content where a character may have multiple possible states, use (12) to indicate that the character has either state 1 or state 2.
-                """},
+def api_extract_state(description, character_info, character_id, structured=None):
+    """
+    Extract the state(s) of one character from one species description.
+
+    Args:
+        description (str): The species description.
+        character_info (dict): The description and states of the character.
+        character_id (str): The character ID.
+        structured (bool): Request a JSON result following character_state_schema (structured_output if None).
+
+    Returns:
+        The state as text ("character{character_id}: stateX (state description)"), or as a
+        {"character_id", "states", "missing"} dictionary for structured requests; None if the call failed.
+    """
+    if structured is None:
+        structured = structured_output
+
+    messages_extract_information = extraction_instructions + [
         {"role": "system",
          "content": """
                 Please output the result using the following format:
@@ -177,22 +444,42 @@ def api_extract_state(description, character_info, character_id):
           }
     ]
 
+    request = {}
+    if structured:
+        # The JSON schema replaces the text output format
+        messages_extract_information[-2] = {
+            "role": "system",
+            "content": f"Return the result as JSON: 'character_id' is {character_id}, 'states' lists the state "
+                       f"numbers found in the description (several for a polymorphic character), and 'missing' is "
+                       f"true when the description gives no information about the character."
+        }
+        request["response_format"] = {"type": "json_schema", "json_schema": character_state_schema}
+
     try:
-        response = client.chat.completions.create(
+        response = create_chat_completion(
+            "extract",
             model="gpt-4o-2024-08-06",
             messages=messages_extract_information,
             stop=None,
-            max_tokens=1000,
+            max_tokens=200 if structured else 1000,
             temperature=0,
-            n=1
+            n=1,
+            **request
         )
         # Retrieve and return the formatted character state information
         state_information = response.choices[0].message.content
-        return state_information.strip()
     except Exception as e:
         print(f"API call failed: {e}")
         return None
 
+    if not structured:
+        return state_information.strip()
+    try:
+        return parse_structured_state(json.loads(state_information))
+    except ValueError as e:
+        print(f"Invalid structured result for character {character_id} ({e}), extracting it as text.")
+        return api_extract_state(description, character_info, character_id, structured=False)
+
 
 # Function to iteratively extract each character and its state
 def extract_character_for_species(character_dict, species_description):
@@ -228,55 +515,138 @@ def extract_character_for_species(character_dict, species_description):
     return species_character_states
 
 
-# Parse the matrix information to the dictionary format
-def parse_to_matrix(character_dict):
+def api_extract_tile(species_descriptions, character_items):
     """
-    Parses the extracted result in dictionary format and converts it into a matrix format.
-    Adds exception handling to ensure robustness.
-    """
-    # Initialize an empty matrix row to represent the character states for the species
-    matrix_row = []
+    Extract the states of several characters for several species with one API call.
 
-    # Iterate through the dictionary of extracted results
-    for character_id, character_state in character_dict.items():
-        # Handle potential None or non-string values
-        if not isinstance(character_state, str):
-            matrix_row.append('-')  # If character_state is invalid, mark it as missing
-            continue
+    Args:
+        species_descriptions (list): (species index, description) pairs.
+        character_items (list): (character ID, character information) pairs.
 
-        # Prioritize matching 'stateX' and extract X
-        states = re.findall(r'state(\d)', character_state)  # Extract the number following 'stateX'
+    Returns:
+        dict: (species index, character ID) mapped to the extracted state, in the per-cell format
+              "character{character_id}: stateX (state description)". Cells missing from the response are left out.
+    """
+    character_text = "\n".join(
+        f"Character {character_id}: {character_info['description']}\n"
+        f"Possible states: {json.dumps(character_info['states'], ensure_ascii=False)}"
+        for character_id, character_info in character_items)
+    species_text = "\n\n".join(f"Species {index + 1}:\n{description}" for index, description in species_descriptions)
+
+    if structured_output:
+        output_format = {
+            "role": "system",
+            "content": "Return the result as JSON with one entry in 'cells' for every species and every character: "
+                       "'species' is the species number, 'character_id' the character number, 'states' lists the "
+                       "state numbers found in the description (several for a polymorphic character), and 'missing' "
+                       "is true when the description gives no information about the character."
+        }
+    else:
+        output_format = {
+            "role": "system",
+            "content": """
+                Please output one line for every species and every character, using the species numbers and character
+                numbers given, in the following format:
+                species{species_number} character{character_id}: stateX (state description)
+                If the character has multiple states, output them as:
+                species{species_number} character{character_id}: stateX (state description) and stateY (state description)
+                If the character information is missing from the description, output:
+                species{species_number} character{character_id}: Missing (?)
+                """}
+
+    messages_extract_tile = extraction_instructions + [
+        output_format,
+        {"role": "user",
+         "content": f"""
+             Here are the characters and states to extract:
+             {character_text}
+             Here are the taxonomic descriptions of the species:
+             {species_text}
+             """
+         }
+    ]
 
-        # If no 'stateX' is found, attempt to match other valid individual state numbers
-        if not states:
-            states = re.findall(r'(?<![A-Z])\b\d\b(?![A-Z])', character_state)  # Match other state numbers, excluding those surrounded by letters
+    cells = len(species_descriptions) * len(character_items)
+    request = {}
+    if structured_output:
+        request["response_format"] = {"type": "json_schema", "json_schema": character_state_tile_schema}
+    try:
+        response = create_chat_completion(
+            "extract",
+            model="gpt-4o-2024-08-06",
+            messages=messages_extract_tile,
+            stop=None,
+            max_tokens=min(16000, max(1000, 40 * cells)),
+            temperature=0,
+            n=1,
+            **request
+        )
+        tile_response = response.choices[0].message.content
+    except Exception as e:
+        print(f"API call failed: {e}")
+        return {}
 
-        # If multiple states are found, sort them and add parentheses
-        if len(states) > 1:
-            sorted_states = sorted(map(int, states))  # Sort the numbers
-            combined_state = f"({' '.join(map(str, sorted_states))})"
-            matrix_row.append(combined_state)
-        elif len(states) == 1:
-            # If there is only one state, do not add parentheses
-            matrix_row.append(states[0])
-        else:
-            # If no state is found, mark as missing with '-'
-            matrix_row.append('-')
+    species_indexes = {index for index, _ in species_descriptions}
+    character_ids = {str(character_id) for character_id, _ in character_items}
+    if structured_output:
+        return parse_structured_tile(tile_response, species_indexes, character_ids)
+    return parse_tile_lines(tile_response, species_indexes, character_ids)
 
-    # Format the matrix row into a string similar to "species: 1 (12) 1 1"
-    matrix_str = " ".join(matrix_row)
 
-    return matrix_str
+def extract_character_states(descriptions, character_dict, tile="cell", token_budget=8000, workers=1):
+    """
+    Extract the character states of all species, sending one tile of cells per API call. Cells missing from a
+    tile response are extracted again one by one.
 
+    Args:
+        descriptions (list): The species descriptions.
+        character_dict (dict): The character list.
+        tile (str): "cell", "species", "character" or "block" (see plan_extraction_tiles).
+        token_budget (int): Token budget of "block" tiles.
+        workers (int): Number of species ("cell" tiles) or tiles extracted at once.
 
-# Parse the matrix information
-def parse_matrix(matrix):
-    """
-    Parse the matrix string into a list of individual elements or groups of elements.
-    Groups are identified by parentheses, while other elements are separated by spaces.
+    Returns:
+        list: For each species, a dictionary mapping character IDs to their extracted states.
     """
-    matrix = re.findall(r'\([^\)]+\)|\S+', matrix)  # Match groups in parentheses or standalone elements
-    return matrix
+    if tile == "cell":
+        def extract_species(i):
+            if trace is not None:
+                with trace.context(species=i + 1, group_size=1):
+                    return extract_character_for_species(character_dict, descriptions[i])
+            return extract_character_for_species(character_dict, descriptions[i])
+
+        return map_concurrently(extract_species, list(range(len(descriptions))), workers)
+
+    tiles = plan_extraction_tiles(descriptions, character_dict, tile, token_budget)
+    print(f"Extracting {len(descriptions) * len(character_dict)} cells in {len(tiles)} {tile} tiles.")
+
+    def extract_tile(tile_cells):
+        species_indexes, character_ids = tile_cells
+        species_descriptions = [(index, descriptions[index]) for index in species_indexes]
+        character_items = [(character_id, character_dict[character_id]) for character_id in character_ids]
+        if trace is not None:
+            with trace.context(species=[index + 1 for index in species_indexes], group_size=len(species_indexes),
+                               characters=len(character_ids)):
+                return api_extract_tile(species_descriptions, character_items)
+        return api_extract_tile(species_descriptions, character_items)
+
+    cell_states = {}
+    for tile_states in map_concurrently(extract_tile, tiles, workers):
+        cell_states.update(tile_states)
+
+    all_states = []
+    for index, description in enumerate(descriptions):
+        species_character_states = {}
+        for character_id, character_info in character_dict.items():
+            state = cell_states.get((index, str(character_id)))
+            if state is None:
+                print(f"Character {character_id} of species {index + 1} missing from the tile response, "
+                      f"extracting it on its own.")
+                state = api_extract_state(description, character_info, character_id)
+            if state:
+                species_character_states[character_id] = state
+        all_states.append(species_character_states)
+    return all_states
 
 
 # Verify the matrix is accurate based on the ChatGPT-4o API model
@@ -321,102 +691,29 @@ def validate_matrix(description, matrix, character_list, repetitions=3):
             Matrix: {matrix}
         """}
     ]
-    response = client.chat.completions.create(
+    request = {}
+    if structured_output:
+        # The JSON schema replaces the text report format
+        messages.insert(1, {
+            "role": "system",
+            "content": "Return the validation report as JSON instead of the text format: the species name in "
+                       "'species' and, in 'characters', one entry per character with its 'character_id', the "
+                       "'matrix_state', the 'expected_states' numbers from the description and the 'result'."
+        })
+        request["response_format"] = {"type": "json_schema", "json_schema": matrix_validation_schema}
+
+    response = create_chat_completion(
+        "validate",
         model="gpt-4o-2024-08-06",
         messages=messages,
         temperature=0,
-        max_tokens=1000,
+        max_tokens=max(1000, 60 * len(character_list)) if structured_output else 1000,
+        **request
     )
 
     return response.choices[0].message.content
 
 
-# Parse the API response to extract species name and character validation reports
-def parse_api_response(api_response: str):
-    """
-    Parse the API response to extract species name and character validation reports.
-
-    Args:
-        api_response (str): The raw response string from the API.
-
-    Returns:
-        dict: A dictionary containing the species name and a list of character validation reports.
-    """
-    # Clean the response by removing surrounding code markers and whitespace
-    api_response = api_response.strip("```").strip()
-
-    # Initialize variables to store species name and character reports
-    species_name = None
-    character_reports = []
-    current_report = {}
-
-    # Split the response into lines for processing
-    lines = api_response.split('\n')
-
-    # Iterate through each line to extract relevant information
-    for line in lines:
-        line = line.strip()
-
-        # Extract the species name
-        if line.startswith("Species:"):
-            species_name = line.split(":", 1)[1].strip()
-
-        # Handle character validation report blocks
-        elif re.match(r"^- Character \d+:", line):
-            # Save the current report if it exists and start a new one
-            if current_report:
-                character_reports.append(current_report)
-                current_report = {}
-
-            # Extract character ID and description
-            match = re.match(r"^- Character (\d+): (.+)", line)
-            if match:
-                current_report["Character ID"] = int(match.group(1))
-                current_report["Character Description"] = match.group(2).strip()
-
-        # Extract matrix state
-        elif line.startswith("Matrix State:"):
-            current_report["Matrix State"] = line.split(":", 1)[1].strip()
-
-        # Extract expected state
-        elif line.startswith("Expected State:"):
-            current_report["Expected State"] = line.split(":", 1)[1].strip()
-
-        # Extract validation result
-        elif line.startswith("Result:"):
-            current_report["Result"] = line.split(":", 1)[1].strip()
-
-        # Extract suggestions for corrections
-        elif line.startswith("Suggestion:"):
-            current_report["Suggestion"] = line.split(":", 1)[1].strip()
-
-    # Append the last report if it exists
-    if current_report:
-        character_reports.append(current_report)
-
-    # Return the parsed results as a dictionary
-    return {
-        "Species": species_name,
-        "Character Validation Report": character_reports,
-    }
-
-
-# Extract the numeric state from an expected state string
-def extract_state(expected_state):
-    """
-    Extract the numeric state from an expected state string.
-
-    Args:
-        expected_state (str): The expected state string, possibly containing a number.
-
-    Returns:
-        str: The extracted numeric state, or the original state if no number is found.
-    """
-    # Search for a numeric value in the expected state string
-    match = re.search(r'\d+', expected_state.strip())
-    return match.group(0) if match else expected_state
-
-
 # Update the matrix with the expected state for a specific character ID
 def update_matrix(matrix, character_id, expected_state):
     """
@@ -461,17 +758,67 @@ def validate_and_correct_matrix(matrix, api_results):
     for report in api_results["Character Validation Report"]:
         if report["Result"] == "Error":  # Check if there is an error in the validation
             character_id = report["Character ID"]  # Extract the character ID
-            expected_states = report["Expected State"].split(" or ")  # Split expected states
-            expected_state = extract_state(expected_states[0])  # Use the first expected state
 
             # Update the matrix with the corrected state
-            matrix = update_matrix(matrix, character_id, expected_state)
+            matrix = update_matrix(matrix, character_id, expected_matrix_cell(report))
 
     return matrix
 
 
-# Iteratively validates and updates a feature matrix, ensuring all errors are resolved with additional checks for robustness before finalizing the result
+# Validates a feature matrix, then re-validates only the characters corrected in the previous round
 def validate_matrix_with_iterations(description, matrix, character_list, max_iterations=10):
+    """
+    Check the matrix cells locally, validate the whole matrix once with the API, and then re-validate only the
+    characters corrected in the previous round until a round confirms every correction. A correction that is not a
+    valid state of its character, or that the validator already rejected, is not applied, so an oscillating
+    character stops being re-validated. With DTOM_VALIDATION=full, the original full-matrix loop is used instead.
+    :param description: taxonomic description of the species
+    :param matrix: current feature matrix
+    :param character_list: feature list
+    :param max_iterations: maximum number of validation rounds
+    :return: final matrix
+    """
+    if validation_mode == "full":
+        return validate_full_matrix_with_iterations(description, matrix, character_list, max_iterations)
+
+    cells, problems = check_matrix_locally(matrix, character_list)
+    for character_id, problem in problems.items():
+        print(f"Local check, character {character_id}: {problem}")
+
+    character_ids = list(character_list)
+    tried_cells = {character_id: {cell} for character_id, cell in zip(character_ids, cells)}
+    characters_to_check = character_ids
+
+    for iteration in range(max_iterations):
+        if not characters_to_check:
+            print("Validation confirmed every correction.")
+            return " ".join(cells)
+        print(f"Iteration {iteration + 1}: Validating {len(characters_to_check)} of {len(character_ids)} "
+              f"characters...")
+
+        if len(characters_to_check) == len(character_ids):
+            matrix_text = " ".join(cells)
+        else:
+            # Only the characters to re-validate are sent, labelled with their IDs
+            matrix_text = "; ".join(f"Character {character_id}: {cells[character_ids.index(character_id)]}"
+                                    for character_id in characters_to_check)
+        checked_list = {character_id: character_list[character_id] for character_id in characters_to_check}
+        parsed_result = parse_validation_response(validate_matrix(description, matrix_text, checked_list),
+                                                  structured_output)
+
+        corrected_characters = apply_validation_corrections(parsed_result["Character Validation Report"], cells,
+                                                            character_list, characters_to_check, tried_cells)
+        if corrected_characters:
+            print(f"Corrected characters {', '.join(corrected_characters)}.")
+        characters_to_check = corrected_characters
+
+    if characters_to_check:
+        print("Maximum iterations reached. Returning the latest matrix.")
+    return " ".join(cells)
+
+
+# Iteratively validates and updates a feature matrix, ensuring all errors are resolved with additional checks for robustness before finalizing the result
+def validate_full_matrix_with_iterations(description, matrix, character_list, max_iterations=10):
     """
     Loop through the validation matrix and update when errors are found until there are no errors in the validation results.
     After the initial validation is error-free, perform two additional API validations to ensure that there are no errors before outputting the final results.
@@ -486,7 +833,7 @@ def validate_matrix_with_iterations(description, matrix, character_list, max_ite
         print(f"Iteration {iteration + 1}: Validating matrix...")
 
         validation_result = validate_matrix(description, matrix, character_list)
-        parsed_result = parse_api_response(validation_result)
+        parsed_result = parse_validation_response(validation_result, structured_output)
 
         errors_exist = any(
             report["Result"] == "Error" for report in parsed_result["Character Validation Report"]
@@ -504,7 +851,7 @@ def validate_matrix_with_iterations(description, matrix, character_list, max_ite
             for i in range(2):
                 print(f"Additional check {i + 1}...")
                 additional_result = validate_matrix(description, matrix, character_list)
-                additional_parsed = parse_api_response(additional_result)
+                additional_parsed = parse_validation_response(additional_result, structured_output)
 
                 additional_errors_exist = any(
                     report["Result"] == "Error" for report in additional_parsed["Character Validation Report"]
@@ -526,19 +873,23 @@ def validate_matrix_with_iterations(description, matrix, character_list, max_ite
 
 
 # Generate a character matrix for a single species description, validate it, and apply updates
-def process_single_species(description, character_dict):
+def process_single_species(description, character_dict, species_character_states=None):
     """
     Generate a character matrix for a single species description, validate it, and apply updates.
 
     Args:
         description (str): The description of the species.
         character_dict (dict): A dictionary containing the list of characters and their details.
+        species_character_states (dict): Character states already extracted by extract_character_states, if any.
 
     Returns:
         list: The final validated and updated matrix for the species.
     """
     # Extract character states from the species description
-    species_character_states = extract_character_for_species(character_dict, description)
+    if species_character_states is None:
+        trace_stage("extract")
+        species_character_states = extract_character_for_species(character_dict, description)
+        trace_stage("validate")
 
     # Convert the extracted character states into a matrix format
     species_matrix = parse_to_matrix(species_character_states)
@@ -577,19 +928,43 @@ for i, description in enumerate(descriptions):
 print(descriptions)
 
 
-# List to store matrices for all species
-all_species_matrices = []
+if trace is not None:
+    trace.run_info(tool="DtoM", process="matrix", dataset=file_path, species=len(descriptions),
+                   characters=len(character_dict) if character_dict else 0)
 
-# Iterate through each species description
-for i, description in enumerate(descriptions):
+# Extract the character states of all species, one tile of cells per API call
+trace_stage("extract")
+all_character_states = extract_character_states(descriptions, character_dict, extraction_tile, tile_token_budget,
+                                                 max_workers)
+
+# Validate the species, up to max_workers at once
+trace_stage("validate")
+progress_lock = threading.Lock()
+finished_species = []
+
+
+def process_species(i):
+    """
+    Validate the matrix of one species and report the progress of the run.
+    """
     print(f"\nProcessing species {i + 1}...")
 
     # Process the description to generate the final matrix
-    final_matrix = process_single_species(description, character_dict)
+    if trace is not None:
+        with trace.context(species=i + 1, group_size=1):
+            final_matrix = process_single_species(descriptions[i], character_dict, all_character_states[i])
+    else:
+        final_matrix = process_single_species(descriptions[i], character_dict, all_character_states[i])
+
+    with progress_lock:
+        finished_species.append(i + 1)
+        print(f"Species {i + 1} Matrix: {final_matrix} ({len(finished_species)}/{len(descriptions)} species done)")
+    return final_matrix
 
-    # Append the resulting matrix to the list
-    all_species_matrices.append(final_matrix)
-    print(f"Species {i + 1} Matrix: {final_matrix}")
+
+# List to store matrices for all species, in the order of the descriptions
+all_species_matrices = map_concurrently(process_species, list(range(len(descriptions))), max_workers)
+final_matrix = all_species_matrices[-1] if all_species_matrices else None
 
 # Print all matrices after processing all species
 print("\nAll Species Matrices:")
@@ -653,9 +1028,14 @@ CHARLABELS
 
 
 # Generate the NEXUS content
+trace_stage("nexus")
 nexus_content = generate_nexus_with_labels(all_species_matrices, character_dict)
 print(nexus_content)
 
 # Write the NEXUS content to a file
 with open("phylogenetic_matrix_with_labels.nex", "w") as f:
     f.write(nexus_content)
+
+if trace is not None:
+    print(f"Trace totals: {trace.write_summary()['total']}")
+    trace.close()
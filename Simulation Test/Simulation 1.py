@@ -3,11 +3,19 @@ from openai import OpenAI
 import os
 import random
 import re
+import sys
 from typing import Dict, Set
 
+# The shared rate-limit scheduler lives in the TaxonGPT package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from TaxonGPT.request_scheduler import RequestScheduler
+
 # Initialize the OpenAI client using the API key from the environment variable
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Pace requests to OPENAI_RPM / OPENAI_TPM and retry throttled requests with backoff
+scheduler = RequestScheduler.from_env()
+
 # Define the number of characters and species to generate in the character list and Matrix
 number_about_the_character = 10
 num_species = 5
@@ -54,7 +62,8 @@ messages_character_list = [
 ]
 
 # Generate the initial character list using the OpenAI API
-response = client.chat.completions.create(
+response = scheduler.create(
+    client,
     model="gpt-4o-2024-08-06",
     messages=messages_character_list,
     stop=None,
@@ -294,7 +303,8 @@ def call_api_for_description(knowledge_graph, character_list):
     ]
 
     # Call the OpenAI API to generate the descriptions
-    response = client.chat.completions.create(
+    response = scheduler.create(
+        client,
             model="gpt-4o-2024-08-06",
             messages=messages,
             stop=None,
@@ -400,7 +410,8 @@ messages_character_list = [
 ]
 
 # Generate the universal character list using the OpenAI API
-response = client.chat.completions.create(
+response = scheduler.create(
+    client,
     model="gpt-4o-2024-08-06",
     messages=messages_character_list,
     stop=None,
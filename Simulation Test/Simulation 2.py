@@ -3,10 +3,18 @@ from openai import OpenAI  # OpenAI client for API interactions
 import os  # OS module for environment variable access
 import random  # Random module for generating random values
 import re  # Regular expressions module for pattern matching
+import sys  # System module for extending the import path
+
+# The shared rate-limit scheduler lives in the TaxonGPT package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from TaxonGPT.request_scheduler import RequestScheduler
 
 # Initialize the OpenAI client using the API key from environment variables
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Pace requests to OPENAI_RPM / OPENAI_TPM and retry throttled requests with backoff
+scheduler = RequestScheduler.from_env()
+
 # Generate a random character list and store the result
 number_about_the_character = 15  # Define the number of characters to be generated
 num_species = 5  # Define the number of species to generate
@@ -53,7 +61,8 @@ messages_character_list = [
 ]
 
 # Generate the initial character list using OpenAI API
-response = client.chat.completions.create(
+response = scheduler.create(
+    client,
     model="gpt-4o-2024-08-06",
     messages=messages_character_list,
     stop=None,
@@ -282,7 +291,8 @@ def call_api_for_description(knowledge_graph, character_list):
         """}
     ]
 
-    response = client.chat.completions.create(
+    response = scheduler.create(
+        client,
             model="gpt-4o-2024-08-06",
             messages=messages,
             stop=None,
@@ -385,7 +395,8 @@ def extract_matrix_from_description(species_name, description, character_list):
          """},
 
     ]
-    response = client.chat.completions.create(
+    response = scheduler.create(
+        client,
         model="gpt-4o-2024-08-06",
         messages=messages_extract_information,
         stop=None,
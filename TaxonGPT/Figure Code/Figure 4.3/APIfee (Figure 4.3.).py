@@ -1,14 +1,31 @@
+import glob
+import os
+import sys
 import matplotlib.pyplot as plt
 import pandas as pd
 import statsmodels.api as sm
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from TaxonGPT.run_trace import summarize_traces
+
+# Run traces written with the "trace" configuration (leave empty to use the recorded CSV)
+trace_files = glob.glob("<Full path to the trace directory>/*.jsonl")
+
 # Set font to Arial
 plt.rcParams['font.family'] = 'Arial'
 
 # Load the user-uploaded file
-file_path = "E:/Evaluate_results_for_all_datasets/Evaluate_table/Description/API fee/API fee.csv"
-data_fee = pd.read_csv(file_path)
+if trace_files:
+    # Sum the fee of the traced description runs of each dataset, in the format of the recorded CSV
+    runs = summarize_traces(trace_files)
+    runs = runs[(runs["tool"] == "TaxonGPT") & (runs["process"] == "description")]
+    data_fee = runs.groupby("dataset").agg({"species number": "first", "character number": "first",
+                                            "API fee ($)": "sum"}).reset_index()
+    data_fee['5 times money'] = data_fee["API fee ($)"].map(lambda fee: f"${fee:.4f}")
+else:
+    file_path = "E:/Evaluate_results_for_all_datasets/Evaluate_table/Description/API fee/API fee.csv"
+    data_fee = pd.read_csv(file_path)
 
 # Clean the data by converting the price column to float
 data_fee['5 times money'] = data_fee['5 times money'].str.replace('$', '').astype(float)
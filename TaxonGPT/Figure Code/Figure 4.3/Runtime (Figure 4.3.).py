@@ -1,10 +1,26 @@
+import glob
+import os
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from TaxonGPT.run_trace import summarize_traces
+
+# Run traces written with the "trace" configuration (leave empty to use the recorded spreadsheet)
+trace_files = glob.glob("<Full path to the trace directory>/*.jsonl")
+
 # Load the data
-data_file_path = "D:/桌面/Processed_Test_Extract_Matrix.xlsx"
-data = pd.read_excel(data_file_path)
+if trace_files:
+    # One row per character number, one column per traced DtoM matrix extraction run
+    runs = summarize_traces(trace_files)
+    runs = runs[(runs["tool"] == "DtoM") & (runs["process"] == "matrix")]
+    runtimes = runs.groupby("character number")["runtime (s)"].apply(list)
+    data = pd.DataFrame(runtimes.tolist(), index=runtimes.index).reset_index()
+else:
+    data_file_path = "D:/桌面/Processed_Test_Extract_Matrix.xlsx"
+    data = pd.read_excel(data_file_path)
 
 # Extract character numbers and accuracy values for each trial
 character_numbers = data.iloc[:, 0]  # X-axis: Character numbers
@@ -1,8 +1,72 @@
+import contextlib
+import hashlib
 import json
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 import os
 import re
-import pandas as pd
+import sys
+import threading
+import time
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script ("python TaxonGPT/TaxonGPT.py"): import the TaxonGPT package from the repository root
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "TaxonGPT"
+
+from .checkpoint import CheckpointStore
+from .dataset_cache import DatasetCache
+from .nexus_parser import extract_matrix, read_nexus, tokenize_matrix
+from .request_scheduler import RequestScheduler, count_message_tokens, count_tokens
+from .response_cache import ResponseCache
+from .run_trace import RunTrace
+from .split_engine import SplitEngine
+from .taxon_matrix import TaxonMatrix, parse_state
+
+# JSON schema for single-call structured classification. Strict schemas cannot have free-form keys,
+# so the states are returned as a list and converted back to the {"State": [species]} mapping.
+CLASSIFICATION_SCHEMA = {
+    "name": "classification",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "Character": {"type": "string"},
+            "States": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "State": {"type": "string"},
+                        "Species": {"type": "array", "items": {"type": "string"}}
+                    },
+                    "required": ["State", "Species"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["Character", "States"],
+        "additionalProperties": False
+    }
+}
+
+# Output contract of packed description requests: every species' description is wrapped in these delimiter lines,
+# so the response can be split back into per-species descriptions.
+PACKED_DESCRIPTION_INSTRUCTIONS = (
+    "The data above covers {count} species: {species_list}. Write a separate taxonomic description for each of them, "
+    "in the format requested above. Start each description with the line \"=== SPECIES: <species name> ===\" and "
+    "end it with the line \"=== END SPECIES ===\", using the species names exactly as given, and write nothing "
+    "outside these sections."
+)
+PACKED_SECTION_PATTERN = re.compile(r"^=== SPECIES: (.+?) ===[ \t]*\n(.*?)^=== END SPECIES ===[ \t]*$",
+                                    re.MULTILINE | re.DOTALL)
+
+# Follow-up prompt of the description repair loop, listing the character states that disagree with the matrix
+DESCRIPTION_REPAIR_INSTRUCTIONS = (
+    "The description of {species_name} above disagrees with the matrix for the following characters:\n"
+    "{mismatch_list}\n"
+    "Rewrite the complete description of {species_name} in the same format, correcting these characters and keeping "
+    "every other character unchanged. In the List Form, give each state with its state number in parentheses."
+)
 
 
 class TaxonGPT:
@@ -11,12 +75,20 @@ class TaxonGPT:
 
     Attributes:
         config (dict): Configuration settings loaded from a JSON file.
-        client (OpenAI): OpenAI client initialized with API key from the config.
+        client (OpenAI): OpenAI client initialized with API key (and optional base URL) from the config on first use.
         paths (dict): Paths for input and output files.
         knowledge_graph (dict): Knowledge graph generated from the dataset.
+        matrix (TaxonMatrix): Bitmask-encoded matrix of the dataset, used for state checks.
+        dataset_hash (str): SHA-256 of the NEXUS file the knowledge graph was built from.
+        dataset_cache (DatasetCache): Disk cache of parsed datasets, or None if disabled.
         character_info (dict): Information about character states.
         prompt_messages (dict): Prompt messages for OpenAI API calls.
         step_counter (int): Counter to keep track of steps in the process.
+        response_cache (ResponseCache): Disk-backed cache of chat completions, or None if disabled.
+        split_engine (SplitEngine): Local information-gain split engine, or None if disabled.
+        checkpoints (CheckpointStore): Per-node checkpoints of the current process_key run, or None if disabled.
+        trace (RunTrace): JSONL performance and cost trace of the run, or None if disabled.
+        scheduler (RequestScheduler): Shared rate-limit scheduler for API requests, or None if disabled.
     """
 
     def __init__(self, config_file):
@@ -27,12 +99,37 @@ class TaxonGPT:
             config_file (str): Path to the configuration file.
         """
         self.config = self.load_config(config_file)  # Load configuration from file
-        self.client = OpenAI(api_key=self.config["api_key"])  # Initialize OpenAI client
+        self._client = None  # The OpenAI client is created on first use
+        self._client_lock = threading.Lock()
         self.paths = self.config["paths"]  # Set paths for input and output files
         self.knowledge_graph = None  # Initialize knowledge graph as None
+        self.matrix = None  # Initialize bitmask matrix as None
+        self.dataset_hash = None  # Initialize dataset hash as None
+        self.dataset_cache = DatasetCache.from_config(self.config.get("dataset_cache"))  # Initialize dataset cache
         self.character_info = None  # Initialize character info as None
         self.prompt_messages = None  # Initialize prompt messages as None
         self.step_counter = 1  # Initialize step counter
+        self.response_cache = ResponseCache.from_config(self.config.get("cache"))  # Initialize response cache
+        self.split_engine = None  # Initialize split engine as None
+        self.checkpoints = None  # Initialize checkpoint store as None
+        self.trace = RunTrace.from_config(self.config.get("trace"))  # Initialize performance trace
+        self.scheduler = RequestScheduler.from_config(self.config.get("rate_limit"))  # Initialize rate limiting
+
+    @property
+    def client(self):
+        """
+        The OpenAI client, created on first use so that stages making no API call never import openai.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=self.config["api_key"], base_url=self.config.get("base_url"))
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
 
     def load_config(self, config_path):
         """
@@ -60,48 +157,21 @@ class TaxonGPT:
         """
         return str(ord(letter) - ord('A') + 10)  # Convert letter to number
 
-    def parse_matrix(self, matrix_content):
+    def parse_matrix(self, matrix_content, nchar=None, interleave=False):
         """
         Parses the matrix content and converts it into a pandas DataFrame.
 
         Args:
             matrix_content (str): The content of the matrix to parse.
+            nchar (int): Number of characters per taxon, if known from the DIMENSIONS block.
+            interleave (bool): Whether the matrix is interleaved.
 
         Returns:
             pd.DataFrame: DataFrame containing the parsed matrix.
         """
-        data = []
-        headers = []
-        lines = matrix_content.strip().split('\n')
-
-        for i in range(0, len(lines), 2):
-            taxa = lines[i].strip().strip("'")  # Get taxa name
-            traits = lines[i + 1].strip()  # Get traits
-            species_traits = []
-            j = 0
-
-            while j < len(traits):
-                if traits[j] == '(':
-                    j += 1
-                    states = ''
-                    while traits[j] != ')':
-                        if traits[j].isalpha():
-                            states += self.letter_to_number(traits[j])  # Convert letter to number
-                        else:
-                            states += traits[j]
-                        j += 1
-                    species_traits.append(','.join(states))
-                elif traits[j] == '?':
-                    species_traits.append('Missing')
-                elif traits[j] == '-':
-                    species_traits.append('Not Applicable')
-                elif traits[j].isalpha():
-                    species_traits.append(self.letter_to_number(traits[j]))  # Convert letter to number
-                else:
-                    species_traits.append(traits[j])
-                j += 1
+        import pandas as pd  # Only needed when a NEXUS file is actually parsed
 
-            data.append([taxa] + species_traits)  # Append parsed data
+        data = tokenize_matrix(matrix_content, nchar=nchar, interleave=interleave)  # Single-pass tokenizer
 
         max_traits = max(len(row) - 1 for row in data)
         headers = ['taxa'] + [f'Character{i + 1}' for i in range(max_traits)]
@@ -125,22 +195,11 @@ class TaxonGPT:
             pd.DataFrame: DataFrame containing the converted data.
         """
         try:
-            encodings = ['utf-8', 'gbk', 'latin1']
-
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as file:
-                        content = file.read()  # Read file content
-                    print(f"Successfully read file with encoding: {encoding}")
-                    break
-                except UnicodeDecodeError:
-                    print(f"Failed to read file with encoding: {encoding}")
-                    continue
-            else:
-                raise ValueError("Failed to read file with all attempted encodings.")
+            content, encoding = read_nexus(file_path)  # Read the file once and detect its encoding
+            print(f"Successfully read file with encoding: {encoding}")
 
-            matrix_content = re.search(r'MATRIX\s*(.*?)\s*;', content, re.DOTALL).group(1).strip()
-            df = self.parse_matrix(matrix_content)  # Parse matrix content
+            matrix_content, nchar, interleave = extract_matrix(content)
+            df = self.parse_matrix(matrix_content, nchar=nchar, interleave=interleave)  # Parse matrix content
             df.to_csv(output_path, index=False)  # Save DataFrame to CSV
             return df
         except FileNotFoundError:
@@ -158,23 +217,12 @@ class TaxonGPT:
         Returns:
             dict: Knowledge graph.
         """
-        knowledge_graph = {}
+        columns = list(matrix.columns[1:])
+        # Convert whole columns at once instead of cell by cell
+        states = matrix[columns].astype(str).apply(lambda column: column.str.replace(',', ' and ', regex=False))
 
-        for _, row in matrix.iterrows():
-            taxa = row.iloc[0]  # Get taxa name
-            characteristics = {}
-
-            for col in matrix.columns[1:]:
-                state = row[col]
-
-                if isinstance(state, str) and ',' in state:
-                    state = state.replace(',', ' and ')
-
-                characteristics[col] = str(state)  # Assign state to characteristic
-
-            knowledge_graph[taxa] = {'Characteristics': characteristics}  # Append to knowledge graph
-
-        return knowledge_graph
+        return {taxa: {'Characteristics': dict(zip(columns, row))}
+                for taxa, row in zip(matrix.iloc[:, 0].tolist(), states.values.tolist())}
 
     def save_knowledge_graph_as_json(self, knowledge_graph, file_path):
         """
@@ -189,7 +237,8 @@ class TaxonGPT:
 
     def nexus_to_knowledge_graph(self):
         """
-        Converts a NEXUS file to a knowledge graph and saves it as a JSON file.
+        Converts a NEXUS file to a knowledge graph and saves it as a JSON file. The result is reused when the
+        file content has not changed: within this instance always, and across runs through the dataset cache.
 
         Returns:
             dict: The generated knowledge graph.
@@ -197,17 +246,69 @@ class TaxonGPT:
         nexus_file_path = self.paths["nexus_file_path"]
         csv_output_path = self.paths["csv_output_path"]
         json_output_path = self.paths["json_output_path"]
+        output_paths = (csv_output_path, json_output_path)
+
+        try:
+            dataset_hash = DatasetCache.file_hash(nexus_file_path)
+        except FileNotFoundError:
+            dataset_hash = None  # Reported by convert_nexus_to_csv below
+
+        if dataset_hash is not None and dataset_hash == self.dataset_hash and self.knowledge_graph is not None:
+            print("Reusing the knowledge graph already built from the NEXUS file.")
+            return self.knowledge_graph
+
+        cached = self.dataset_cache.load(dataset_hash, output_paths) if self.dataset_cache and dataset_hash else None
+        if cached is not None:
+            self.knowledge_graph, self.matrix = cached
+            self.dataset_hash = dataset_hash
+            print(f"Loaded the parsed dataset from the cache ({dataset_hash[:12]}).")
+            return self.knowledge_graph
 
         df = self.convert_nexus_to_csv(nexus_file_path, csv_output_path)  # Convert NEXUS to CSV
 
         if df is not None:
             self.knowledge_graph = self.build_knowledge_graph(df)  # Build knowledge graph
+            self.matrix = TaxonMatrix.from_dataframe(df)  # Encode states as bitmasks
             self.save_knowledge_graph_as_json(self.knowledge_graph, json_output_path)  # Save knowledge graph to JSON
+            self.dataset_hash = dataset_hash
+            if self.dataset_cache and dataset_hash:
+                self.dataset_cache.save(dataset_hash, self.knowledge_graph, self.matrix, output_paths)
             return self.knowledge_graph
         else:
             print("Failed to create the DataFrame from NEXUS file.")
             return None
 
+    def compact_knowledge_graph(self, species=None):
+        """
+        Serializes (part of) the knowledge graph as a compact table for prompts: a header row of characters
+        and one row per taxon, with short codes for Missing and Not Applicable states. Unlike the JSON form,
+        character names are not repeated for every taxon.
+
+        Args:
+            species (list): The species to include (all species if None).
+
+        Returns:
+            str: The compact matrix.
+        """
+        if species is None:
+            species = list(self.knowledge_graph.keys())
+
+        characters = list(self.knowledge_graph[species[0]]["Characteristics"].keys()) if species else []
+        short_codes = {"Missing": "?", "Not Applicable": "-"}
+
+        lines = [
+            "Matrix legend: one row per taxon, columns separated by '|'; ? = Missing, - = Not Applicable, "
+            "'1 and 2' = polymorphic.",
+            "|".join(["taxon"] + characters)
+        ]
+        for name in species:
+            characteristics = self.knowledge_graph[name]["Characteristics"]
+            states = [short_codes.get(characteristics.get(c, "Missing"), characteristics.get(c, "Missing"))
+                      for c in characters]
+            lines.append("|".join([name] + states))
+
+        return "\n".join(lines)
+
     def load_prompt_messages(self):
         """
         Loads prompt messages from a file.
@@ -236,6 +337,199 @@ class TaxonGPT:
 
         return self.character_info
 
+    def chat_completion(self, messages, model="gpt-4o", use_cache=True, **params):
+        """
+        Sends a chat completion request, serving it from the response cache when an identical
+        request (same model, messages and sampling parameters) has been answered before. Requests go
+        through the rate-limit scheduler when one is configured.
+
+        Args:
+            messages (list): The chat messages to send.
+            model (str): The model to use.
+            use_cache (bool): Serve the request from the cache if possible. Corrections and retries, which can
+                repeat a request whose cached answer was rejected, pass False: the API is always called and the
+                cache is refreshed with the new answer.
+            **params: Sampling parameters passed to the API (temperature, max_tokens, ...).
+
+        Returns:
+            str: The content of the first choice of the response.
+        """
+        cache_key = None
+
+        if self.response_cache is not None:
+            cache_key = ResponseCache.make_key(model, messages, params)
+            cached_response = self.response_cache.get(cache_key) if use_cache else None
+            if cached_response is not None:
+                if self.trace is not None:
+                    self.trace.record_call(model, cache_hit=True)
+                return cached_response
+
+        start = time.perf_counter()
+        retries = 0
+        if self.scheduler is not None:
+            # Paced by the shared RPM/TPM buckets and retried on throttling
+            completions = RequestScheduler.completions(self.client)
+            response, retries = self.scheduler.execute(
+                lambda: completions.create(model=model, messages=messages, **params),
+                self.scheduler.estimate_tokens(messages, model, params.get("max_tokens")))
+        else:
+            response = self.client.chat.completions.create(model=model, messages=messages, **params)
+        content = response.choices[0].message.content
+
+        if self.trace is not None:
+            self.trace.record_call(model, getattr(response, "usage", None), time.perf_counter() - start,
+                                   retries=retries)
+
+        if cache_key is not None and content is not None:
+            self.response_cache.put(cache_key, model, content)
+
+        return content
+
+    def trace_context(self, **fields):
+        """
+        Returns a context attaching fields (stage, depth, group_size, ...) to the traced calls made inside it.
+
+        Args:
+            **fields: The fields to attach.
+
+        Returns:
+            A context manager (a no-op when tracing is disabled).
+        """
+        if self.trace is None:
+            return contextlib.nullcontext()
+        return self.trace.context(**fields)
+
+    def trace_stage(self, stage):
+        """
+        Starts timing a pipeline stage in the trace, ending the previous one.
+
+        Args:
+            stage (str): The stage name.
+        """
+        if self.trace is not None:
+            self.trace.begin_stage(stage)
+
+    def trace_start_run(self):
+        """
+        Starts a new run in the trace, so that each process_key or process_description call (including re-runs
+        appending to the same trace file) is summarized separately.
+        """
+        if self.trace is not None:
+            self.trace.start_run()
+
+    def trace_run_info(self, process):
+        """
+        Writes the dataset information of the run to the trace.
+
+        Args:
+            process (str): The process being run ("key" or "description").
+        """
+        if self.trace is not None and self.matrix is not None:
+            self.trace.run_info(tool="TaxonGPT", process=process, dataset=self.paths["nexus_file_path"],
+                                species=self.matrix.shape[0], characters=self.matrix.shape[1])
+
+    def split_engine_mode(self):
+        """
+        Returns the configured split engine mode: "off", "seed" (rank candidate characters locally and offer them
+        to the prompts as {split_candidates}) or "local" (choose the characters locally without API calls).
+
+        Returns:
+            str: The split engine mode.
+        """
+        return self.config.get("split_engine", {}).get("mode", "off")
+
+    def format_split_candidates(self, group_species):
+        """
+        Formats the locally ranked split candidates of a group for inclusion in a prompt.
+
+        Args:
+            group_species (list): The species in the group.
+
+        Returns:
+            str: JSON list of the best candidate characters with their information gain and resulting groups.
+        """
+        if self.split_engine is None:
+            return "[]"
+
+        top_n = self.config.get("split_engine", {}).get("top_n", 5)
+        return json.dumps(self.split_engine.rank_characters(group_species, top_n=top_n), ensure_ascii=False)
+
+    def local_classification(self, group_species, nested=True):
+        """
+        Classifies a group with the local split engine, in the same format as the API classification result.
+
+        Args:
+            group_species (list): The species in the group.
+            nested (bool): Return the complete nested classification of the group (as classify_group does)
+                rather than only the first split (as initial_api_call does).
+
+        Returns:
+            str: JSON formatted classification result.
+        """
+        if nested:
+            split = self.split_engine.build_classification(group_species)
+        else:
+            split = self.split_engine.best_split(group_species)
+
+        if not isinstance(split, dict):
+            # No character separates the group; keep it together so the recursion stops at max_depth
+            character = self.split_engine.characters[0]
+            split = {"Character": character, "States": self.split_engine.partition(group_species, character)}
+
+        return json.dumps(split, ensure_ascii=False)
+
+    def checkpoint_fingerprint(self):
+        """
+        Returns the fingerprint of everything besides the matrix that classification results depend on: the prompt
+        and character messages, and the settings that change the requests or how their results are produced.
+
+        Returns:
+            dict: SHA-256 digests of the loaded messages and the classification settings.
+        """
+        def digest(value):
+            return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+        split_config = self.config.get("split_engine", {})
+        return {
+            "prompt_messages": digest(self.prompt_messages),
+            "character_info": digest(self.character_info),
+            "structured_output": self.config.get("structured_output", False),
+            "prompt_matrix_format": self.config.get("prompt_matrix_format", "json"),
+            "split_engine": {"mode": self.split_engine_mode(), "top_n": split_config.get("top_n", 5)},
+        }
+
+    def checkpointed(self, stage, state, species, compute, *args, extra=None, depth=None):
+        """
+        Returns the checkpointed result of a classification node, or computes and checkpoints it.
+        The API calls made by compute are traced under the node's stage, depth and group size.
+
+        Args:
+            stage (str): The pipeline stage ("initial", "classify" or "correct").
+            state (str): The state key of the group.
+            species (list): The species in the group.
+            compute (callable): Function producing the result when no checkpoint exists.
+            *args: Arguments passed to compute.
+            extra: Any additional data the result depends on.
+            depth (int): The depth of the node in the classification tree.
+
+        Returns:
+            str: The node result.
+        """
+        with self.trace_context(stage=stage, depth=depth, group_size=len(species)):
+            if self.checkpoints is None:
+                return compute(*args)
+
+            key = CheckpointStore.node_key(stage, state, species, self.knowledge_graph, extra)
+            result = self.checkpoints.load(key)
+
+            if result is not None:
+                print(f"Loaded checkpoint for {stage} group with state: {state}, species: {species}")
+                return result
+
+            result = compute(*args)
+            self.checkpoints.save(key, stage, state, species, result)
+            return result
+
     def initial_api_call(self):
         """
         Makes an initial API call to OpenAI with the loaded prompt messages.
@@ -243,8 +537,19 @@ class TaxonGPT:
         Returns:
             str: Initial response from the API.
         """
+        if self.split_engine_mode() == "local":
+            return self.local_classification(list(self.knowledge_graph.keys()), nested=False)
+
+        knowledge_graph_compact = self.compact_knowledge_graph()
+        if self.config.get("prompt_matrix_format", "json") == "compact":
+            knowledge_graph_str = knowledge_graph_compact
+        else:
+            knowledge_graph_str = json.dumps(self.knowledge_graph)
+
         content_with_data = self.prompt_messages["initial_character_messages"][3]["content_template"].format(
-            knowledge_graph=json.dumps(self.knowledge_graph)  # Insert knowledge graph into template
+            knowledge_graph=knowledge_graph_str,  # Insert knowledge graph into template
+            knowledge_graph_compact=knowledge_graph_compact,
+            split_candidates=self.format_split_candidates(list(self.knowledge_graph.keys()))
         )
 
         messages_initial = [
@@ -254,16 +559,14 @@ class TaxonGPT:
             {"role": "user", "content": content_with_data},
         ]
 
-        initial_character_info = self.client.chat.completions.create(
+        initial_response = self.chat_completion(
+            messages_initial,
             model="gpt-4o",
-            messages=messages_initial,
             stop=None,
             max_tokens=1000,
             temperature=0,
             n=1
         )
-
-        initial_response = initial_character_info.choices[0].message.content
         return initial_response
 
     def parse_classification_result(self, result_text):
@@ -362,7 +665,8 @@ class TaxonGPT:
 
     def classify_group(self, group_species):
         """
-        Classifies a group of species using the API.
+        Classifies a group of species using the API. With "structured_output" enabled, the result is requested
+        in one structured output call and the two-step path is only used if that response cannot be parsed.
 
         Args:
             group_species (list): List of species to classify.
@@ -370,11 +674,22 @@ class TaxonGPT:
         Returns:
             str: JSON formatted classification result from the API.
         """
-        group_matrix = {species: self.knowledge_graph[species] for species in group_species}
-        group_matrix_str = json.dumps(group_matrix, ensure_ascii=False)
+        if self.split_engine_mode() == "local":
+            json_result = self.local_classification(group_species)
+            print(json_result)
+            return json_result
+
+        group_matrix_compact = self.compact_knowledge_graph(group_species)
+        if self.config.get("prompt_matrix_format", "json") == "compact":
+            group_matrix_str = group_matrix_compact
+        else:
+            group_matrix = {species: self.knowledge_graph[species] for species in group_species}
+            group_matrix_str = json.dumps(group_matrix, ensure_ascii=False)
 
         content_with_data = self.prompt_messages["secondary_character_messages"][3]["content_template"].format(
-            group_matrix_str=group_matrix_str
+            group_matrix_str=group_matrix_str,
+            group_matrix_compact=group_matrix_compact,
+            split_candidates=self.format_split_candidates(group_species)
         )
 
         messages_secondary = [
@@ -384,16 +699,22 @@ class TaxonGPT:
             {"role": "user", "content": content_with_data},
         ]
 
-        response = self.client.chat.completions.create(
+        if self.config.get("structured_output", False):
+            json_result = self.structured_classification(messages_secondary)
+            if json_result is not None:
+                print(json_result)
+                return json_result
+            print("Structured classification failed, falling back to the two-step classification.")
+
+        result_secondary = self.chat_completion(
+            messages_secondary,
             model="gpt-4o",
-            messages=messages_secondary,
             stop=None,
             temperature=0,
             max_tokens=1000,
             n=1
         )
 
-        result_secondary = response.choices[0].message.content
         content_with_data = self.prompt_messages["JSON_format_messages"][3]["content_template"].format(
             result_secondary=result_secondary
         )
@@ -405,18 +726,64 @@ class TaxonGPT:
             {"role": "user", "content": content_with_data}
         ]
 
-        response = self.client.chat.completions.create(
+        with self.trace_context(stage="format"):
+            json_result = self.chat_completion(
+                messages_JSON1,
+                model="gpt-4o",
+                stop=None,
+                temperature=0,
+                max_tokens=1500,
+                n=1
+            )
+        print(json_result)
+        return json_result
+
+    def structured_classification(self, messages, use_cache=True):
+        """
+        Requests a classification directly in the {"Character": ..., "States": {...}} format with a single
+        structured output call, replacing the free-text call plus JSON reformatting call.
+
+        Args:
+            messages (list): The classification (or correction) messages.
+            use_cache (bool): Serve the request from the response cache if possible (False for corrections).
+
+        Returns:
+            str: The classification result as a JSON string, or None if the response could not be parsed.
+        """
+        messages_structured = messages + [{
+            "role": "system",
+            "content": "Return the final classification directly as JSON: the selected character in 'Character' "
+                       "and, in 'States', one entry per state with the state number in 'State' and the species "
+                       "in that state in 'Species'."
+        }]
+
+        response_text = self.chat_completion(
+            messages_structured,
             model="gpt-4o",
-            messages=messages_JSON1,
-            stop=None,
+            use_cache=use_cache,
             temperature=0,
             max_tokens=1500,
-            n=1
+            n=1,
+            response_format={"type": "json_schema", "json_schema": CLASSIFICATION_SCHEMA}
         )
 
-        json_result = response.choices[0].message.content
-        print(json_result)
-        return json_result
+        try:
+            result = json.loads(response_text)
+            character = result["Character"]
+            states = {}
+            for entry in result["States"]:
+                species_list = entry["Species"]
+                if not isinstance(species_list, list) or not all(isinstance(s, str) for s in species_list):
+                    raise ValueError(f"Invalid species list for state {entry['State']}")
+                states.setdefault(str(entry["State"]), []).extend(species_list)
+
+            if not isinstance(character, str) or not character or not states:
+                raise ValueError("Empty character or states")
+        except (TypeError, ValueError, KeyError) as e:
+            print(f"Error parsing structured classification result: {e}")
+            return None
+
+        return json.dumps({"Character": character, "States": states}, ensure_ascii=False)
 
     def extract_json_string(self, json_string):
         """
@@ -475,7 +842,8 @@ class TaxonGPT:
                     self.recursive_classification(new_groups, final_classification, classification_results, depth + 1,
                                                   max_depth)
                 else:
-                    classification_result = self.classify_group(current_group)
+                    classification_result = self.checkpointed("classify", state, current_group,
+                                                              self.classify_group, current_group, depth=depth)
                     cleaned_classification_result = self.extract_json_string(classification_result)
                     # Check if the extracted JSON is valid
                     if not cleaned_classification_result or cleaned_classification_result == "":
@@ -494,6 +862,93 @@ class TaxonGPT:
                 raise e
         return final_classification
 
+    def concurrent_recursive_classification(self, groups, final_classification, classification_results, depth=0,
+                                            max_depth=10, max_workers=4):
+        """
+        Classifies groups level by level, sending the API calls for all sibling groups of a level concurrently.
+        Once the tree is complete, the results are written in the same depth-first order as
+        recursive_classification, so both paths produce identical final_classification and
+        classification_results structures.
+
+        Args:
+            groups (list): List of species groups.
+            final_classification (dict): The final classification result being built.
+            classification_results (dict): Stores intermediate classification results.
+            depth (int): The depth of the given groups.
+            max_depth (int): The maximum allowed depth for classification.
+            max_workers (int): The maximum number of concurrent API requests.
+
+        Returns:
+            dict: The final classification result.
+        """
+        root_nodes = [{"state": state, "group": group, "depth": depth, "children": []} for state, group in groups]
+        level = root_nodes
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while level:
+                # Submit one classification request per group that still has to be split
+                futures = {}
+                for node in level:
+                    current_group = node["group"]
+                    is_leaf = isinstance(current_group, list) and len(current_group) == 1
+                    if not is_leaf and node["depth"] < max_depth and not isinstance(current_group, dict):
+                        print(f"Processing group with state: {node['state']}, species: {current_group}, "
+                              f"at depth: {node['depth']}")
+                        futures[id(node)] = executor.submit(self.checkpointed, "classify", node["state"],
+                                                            current_group, self.classify_group, current_group,
+                                                            depth=node["depth"])
+
+                next_level = []
+                for node in level:
+                    state, current_group = node["state"], node["group"]
+
+                    if isinstance(current_group, dict) and node["depth"] < max_depth:
+                        next_states = current_group.get("States", {})
+                        print(f"Found nested group, next Character: {current_group.get('Character')}, "
+                              f"States: {next_states}")
+                        new_groups = list(next_states.items())
+                    elif id(node) in futures:
+                        try:
+                            classification_result = futures[id(node)].result()
+                            cleaned_classification_result = self.extract_json_string(classification_result)
+                            if not cleaned_classification_result:
+                                raise ValueError(f"Extracted JSON string is invalid: {classification_result}")
+
+                            print(f"Extracted JSON: {cleaned_classification_result}")
+                            node["result"] = cleaned_classification_result
+                            parsed_result = self.parse_classification_result(classification_result)
+                            new_groups = self.generate_groups_from_classification(parsed_result)
+                        except Exception as e:
+                            print(f"Error processing group with state: {state}, species: {current_group}, "
+                                  f"at depth: {node['depth']}")
+                            print(f"Exception: {e}")
+                            raise e
+                    else:
+                        continue
+
+                    node["children"] = [{"state": s, "group": g, "depth": node["depth"] + 1, "children": []}
+                                        for s, g in new_groups]
+                    next_level.extend(node["children"])
+
+                level = next_level
+
+        # Replay the tree depth-first so the output dictionaries match the serial path
+        def collect(nodes):
+            for node in nodes:
+                current_group = node["group"]
+                if isinstance(current_group, list) and len(current_group) == 1:
+                    final_classification[current_group[0]] = current_group
+                elif node["depth"] >= max_depth:
+                    print(f"Reached max depth {max_depth}. Stopping further classification for group: {current_group}")
+                    final_classification[node["state"]] = current_group
+                else:
+                    if "result" in node:
+                        classification_results[node["state"]] = node["result"]
+                    collect(node["children"])
+
+        collect(root_nodes)
+        return final_classification
+
     def extract_paths(self, node, path=None):
         """
         Extracts paths from the classification node.
@@ -535,11 +990,9 @@ class TaxonGPT:
         if correct_state is None:
             return False
 
-        if " and " in correct_state:
-            correct_states = correct_state.split(" and ")
-            return all(sub_state in correct_states for sub_state in state.split(" and "))
-
-        return state == correct_state
+        # Every state given must be one of the correct states (bitwise subset test)
+        submitted, correct = parse_state(state), parse_state(correct_state)
+        return bool(submitted and correct and submitted & ~correct == 0)
 
     def validate_results(self, final_results, groups):
         """
@@ -567,8 +1020,12 @@ class TaxonGPT:
                     for character, state in data["Characteristics"].items():
                         character = character.replace(" ", "").strip()
                         correct_state = self.knowledge_graph[species]["Characteristics"].get(character)
+                        if self.matrix is not None:
+                            matched = self.matrix.state_matches(species, character, state)  # Bitwise check
+                        else:
+                            matched = self.check_state_match(state, correct_state)
 
-                        if correct_state is None or not self.check_state_match(state, correct_state):
+                        if correct_state is None or not matched:
                             mismatch = True
                             incorrect_character_states[character] = {"error_state": state,
                                                                      "correct_state": correct_state}
@@ -642,78 +1099,126 @@ class TaxonGPT:
 
         return species_list
 
-    def correct_classification(self, errors, classification_results, groups):
+    def correct_group(self, key, group_errors, species_list):
         """
-        Corrects the classification based on errors.
+        Requests a corrected classification for one group, covering all of its errors in a single request.
 
         Args:
-            errors (list): List of errors to correct.
-            classification_results (dict): Current classification results.
-            groups (list): List of species groups.
+            key (str): State key of the group.
+            group_errors (list): The errors found for this group.
+            species_list (list): The species in the group.
 
         Returns:
-            dict: Updated classification results.
+            str: The corrected classification result as a JSON string.
         """
-        for error in errors:
-            key = error['key']
-
-            if key is None:
-                continue
-
-            species_list = self.get_species_list_for_state(groups, key)
+        if self.split_engine_mode() == "local":
+            return self.local_classification(species_list)
 
-            if not species_list:
-                continue
+        # A single error is passed as before; several errors of the same group are sent together
+        error = group_errors[0] if len(group_errors) == 1 else group_errors
 
+        group_matrix_compact = self.compact_knowledge_graph(species_list)
+        if self.config.get("prompt_matrix_format", "json") == "compact":
+            group_matrix_str = group_matrix_compact
+        else:
             group_matrix = {s: self.knowledge_graph[s] for s in species_list}
             group_matrix_str = json.dumps(group_matrix, ensure_ascii=False)
-            content_error = self.prompt_messages["correct_messages"][2]["content_template"].format(error=error)
-            content_group_matrix = self.prompt_messages["correct_messages"][4]["content_template"].format(
-                group_matrix_str=group_matrix_str)
-
-            messages_correct = [
-                self.prompt_messages["correct_messages"][0],
-                self.prompt_messages["correct_messages"][1],
-                {"role": "user", "content": content_error},
-                self.prompt_messages["correct_messages"][3],
-                {"role": "user", "content": content_group_matrix}
-            ]
+        content_error = self.prompt_messages["correct_messages"][2]["content_template"].format(error=error)
+        content_group_matrix = self.prompt_messages["correct_messages"][4]["content_template"].format(
+            group_matrix_str=group_matrix_str, group_matrix_compact=group_matrix_compact)
+
+        messages_correct = [
+            self.prompt_messages["correct_messages"][0],
+            self.prompt_messages["correct_messages"][1],
+            {"role": "user", "content": content_error},
+            self.prompt_messages["correct_messages"][3],
+            {"role": "user", "content": content_group_matrix}
+        ]
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages_correct,
-                stop=None,
-                temperature=0,
-                max_tokens=1000,
-                n=1
-            )
+        # The same errors can come back with the same messages, so the cached (rejected) answer is never reused
+        if self.config.get("structured_output", False):
+            json_result = self.structured_classification(messages_correct, use_cache=False)
+            if json_result is not None:
+                return json_result
+            print("Structured correction failed, falling back to the two-step correction.")
 
-            corrected_result = response.choices[0].message.content
+        corrected_result = self.chat_completion(
+            messages_correct,
+            model="gpt-4o",
+            use_cache=False,
+            stop=None,
+            temperature=0,
+            max_tokens=1000,
+            n=1
+        )
 
-            content_with_data = self.prompt_messages["JSON_format_messages"][3]["content_template"].format(
-                result_secondary=corrected_result
-            )
+        content_with_data = self.prompt_messages["JSON_format_messages"][3]["content_template"].format(
+            result_secondary=corrected_result
+        )
 
-            messages_JSON2 = [
-                self.prompt_messages["JSON_format_messages"][0],
-                self.prompt_messages["JSON_format_messages"][1],
-                self.prompt_messages["JSON_format_messages"][2],
-                {"role": "user", "content": content_with_data}
-            ]
+        messages_JSON2 = [
+            self.prompt_messages["JSON_format_messages"][0],
+            self.prompt_messages["JSON_format_messages"][1],
+            self.prompt_messages["JSON_format_messages"][2],
+            {"role": "user", "content": content_with_data}
+        ]
 
-            response = self.client.chat.completions.create(
+        with self.trace_context(stage="format"):
+            json_result = self.chat_completion(
+                messages_JSON2,
                 model="gpt-4o",
-                messages=messages_JSON2,
                 stop=None,
                 temperature=0,
                 max_tokens=1500,
                 n=1
             )
+        return self.extract_json_string(json_result)
+
+    def correct_classification(self, errors, classification_results, groups, attempt=1):
+        """
+        Corrects the classification based on errors. Errors are grouped by their state key and every affected
+        group is corrected with one request, so a single round fixes all groups; with concurrency enabled the
+        requests are sent in parallel.
+
+        Args:
+            errors (list): List of errors to correct.
+            classification_results (dict): Current classification results.
+            groups (list): List of species groups.
+            attempt (int): The correction attempt. It is part of the checkpoint key, so a correction that failed
+                validation is requested again in the next attempt instead of being reloaded from its checkpoint.
+
+        Returns:
+            dict: Updated classification results.
+        """
+        errors_by_key = {}
+        for error in errors:
+            key = error['key']
+
+            if key is None:
+                continue
+
+            errors_by_key.setdefault(key, []).append(error)
+
+        species_by_key = {}
+        for key in errors_by_key:
+            species_list = self.get_species_list_for_state(groups, key)
 
-            json_result = response.choices[0].message.content
-            json_cleaned_result = self.extract_json_string(json_result)
-            classification_results[key] = json_cleaned_result
-            return classification_results
+            if species_list:
+                species_by_key[key] = species_list
+
+        concurrency_config = self.config.get("concurrency", {})
+        max_workers = concurrency_config.get("max_workers", 4) if concurrency_config.get("enabled", False) else 1
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {key: executor.submit(self.checkpointed, "correct", key, species_list, self.correct_group,
+                                            key, errors_by_key[key], species_list,
+                                            extra={"attempt": attempt, "errors": errors_by_key[key]})
+                       for key, species_list in species_by_key.items()}
+
+            for key, future in futures.items():
+                classification_results[key] = future.result()
+
+        return classification_results
 
     def convert_structure(self, node):
         """
@@ -882,17 +1387,36 @@ class TaxonGPT:
         else:
             return
 
-    def process_key(self):
+    def process_key(self, resume=False):
         """
         Processes the key by converting NEXUS to a knowledge graph, loading messages,
         making initial API calls, parsing classification results, recursively classifying groups,
         and finally generating the classification key.
+
+        Args:
+            resume (bool): Reuse the checkpoints of a previous run instead of starting afresh.
         """
         # Convert NEXUS to knowledge graph and load messages
+        self.trace_start_run()
+        self.trace_stage("parse")
         self.nexus_to_knowledge_graph()  # Convert NEXUS file to a knowledge graph
+        self.trace_run_info("key")
         self.load_character_messages()  # Load messages related to species characteristics
         self.load_prompt_messages()  # Load messages related to prompts
-        initial_response_result = self.initial_api_call()  # Make an initial API call and retrieve results
+        if self.split_engine_mode() != "off":
+            self.split_engine = SplitEngine(self.matrix.taxa, self.matrix.characters,
+                                            self.matrix.masks)  # Build local split engine from the matrix
+
+        checkpoint_config = self.config.get("checkpoint", {})
+        if checkpoint_config.get("enabled", False):
+            self.checkpoints = CheckpointStore(checkpoint_config.get("run_dir", "taxongpt_run"))
+            self.checkpoints.start(self.checkpoint_fingerprint(), resume=resume)
+        elif resume:
+            raise ValueError("Resuming requires the \"checkpoint\" section to be enabled in the configuration.")
+
+        self.trace_stage("initial")
+        initial_response_result = self.checkpointed("initial", None, list(self.knowledge_graph.keys()),
+                                                    self.initial_api_call)  # Make an initial API call
         print(initial_response_result)  # Output the initial result returned by the API
 
         # Parse API output, correct species names, and generate classification groups
@@ -904,11 +1428,20 @@ class TaxonGPT:
         print(groups)  # Output the generated groups
 
         # Recursively classify the groups with a set maximum depth
+        self.trace_stage("classify")
         max_depth = 5  # Set the maximum depth for recursive classification
         final_classification = {}
         classification_results = {}
-        final_classification = self.recursive_classification(groups, final_classification, classification_results,
-                                                             depth=0, max_depth=max_depth)
+        concurrency_config = self.config.get("concurrency", {})
+        if concurrency_config.get("enabled", False):
+            # Classify sibling groups concurrently, capped at max_workers in-flight requests
+            final_classification = self.concurrent_recursive_classification(
+                groups, final_classification, classification_results, depth=0, max_depth=max_depth,
+                max_workers=concurrency_config.get("max_workers", 4))
+        else:
+            final_classification = self.recursive_classification(groups, final_classification,
+                                                                 classification_results, depth=0,
+                                                                 max_depth=max_depth)
         groups = self.generate_groups_from_classification(corrected_api_output)  # Regenerate groups
 
         # Extract paths and format the classification results
@@ -925,6 +1458,7 @@ class TaxonGPT:
             final_results[key] = formatted_results  # Save the formatted results in the final results
 
         # Validate the classification results and correct any errors
+        self.trace_stage("correct")
         errors = self.validate_results(final_results, groups)  # Validate if there are errors in the final results
         print(errors)  # Output the found errors
         correction_attempts = 0  # Initialize a counter for the number of correction attempts
@@ -932,8 +1466,8 @@ class TaxonGPT:
 
         while errors and correction_attempts < max_correction_attempts:
             correction_attempts += 1  # Increment the correction attempt counter
-            classification_results = self.correct_classification(errors, classification_results,
-                                                                 groups)  # Attempt to correct classification errors
+            classification_results = self.correct_classification(errors, classification_results, groups,
+                                                                 correction_attempts)  # Attempt to correct errors
             final_results = {}  # Reinitialize the final results
 
             for key, json_str in classification_results.items():
@@ -966,6 +1500,7 @@ class TaxonGPT:
             )  # Output warning if max correction attempts are reached
 
         # Save the final classification results as a JSON file
+        self.trace_stage("key")
         with open('final_classification.json', 'w') as f:
             json.dump(final_results, f, indent=4)
         print("Final classification results have been saved to 'final_classification.json'.")
@@ -1007,6 +1542,89 @@ class TaxonGPT:
             f.write(classification_key)
         print(f"Taxonomic key has been saved to '{taxonomic_key_path}'.")  # Output the save path
 
+        if self.response_cache is not None:
+            print(f"Response cache statistics: {self.response_cache.stats()}")  # Output cache hits and misses
+
+        if self.checkpoints is not None:
+            print(f"Checkpoints: {self.checkpoints.loaded} nodes resumed, {self.checkpoints.saved} nodes saved.")
+
+        if self.scheduler is not None:
+            print(f"Request scheduler statistics: {self.scheduler.stats}")  # Output retries and throttling
+
+        if self.trace is not None:
+            print(f"Trace totals: {self.trace.write_summary()['total']}")  # Output per-run totals
+            self.trace.close()
+
+    def resume(self, run_dir=None):
+        """
+        Resumes an interrupted process_key run: finished nodes are reloaded from the run directory and only
+        the missing groups are classified.
+
+        Args:
+            run_dir (str): The run directory (defaults to the "checkpoint" configuration).
+
+        Raises:
+            ValueError: If the run directory was created with other prompts or classification settings.
+        """
+        checkpoint_config = self.config.setdefault("checkpoint", {})
+        checkpoint_config["enabled"] = True
+
+        if run_dir is not None:
+            checkpoint_config["run_dir"] = run_dir
+
+        self.process_key(resume=True)
+
+    def build_description_messages(self, species_name, species_data):
+        """
+        Builds the chat messages requesting the taxonomic description of one species.
+
+        With "description_layout" set to "prefix", the character information referenced by the user message template
+        is sent as a system message ahead of the species data instead of inside the user message, so every
+        description request starts with the same messages and the provider's prompt cache can serve that prefix.
+
+        Args:
+            species_name (str): Name of the species.
+            species_data (dict): Data of the species.
+
+        Returns:
+            list: The chat messages.
+        """
+        description_messages = self.prompt_messages["description_messages"]
+        character_info_str = json.dumps(self.character_info)
+
+        content_template = description_messages[4]["content_template"]
+        if self.config.get("description_layout", "inline") == "prefix" and "{character_info}" in content_template:
+            content_with_data = content_template.format(
+                species_name=species_name,
+                species_data=json.dumps(species_data),
+                character_info="(see the character information above)"
+            )
+            return [
+                description_messages[0],
+                description_messages[1],
+                description_messages[2],
+                description_messages[3],
+                {"role": "system", "content": f"Character information: {character_info_str}"},
+                {"role": "user", "content": content_with_data},
+                description_messages[5]
+            ]
+
+        content_with_data = content_template.format(
+            species_name=species_name,
+            species_data=json.dumps(species_data),
+            character_info=character_info_str
+        )
+
+        messages = [
+            description_messages[0],
+            description_messages[1],
+            description_messages[2],
+            description_messages[3],
+            {"role": "user", "content": content_with_data},
+            description_messages[5]
+        ]
+        return messages
+
     def generate_taxonomic_description(self, species_name, species_data):
         """
         Generate taxonomic description.
@@ -1014,8 +1632,6 @@ class TaxonGPT:
         Parameters:
         species_name (str): Name of the species.
         species_data (dict): Data of the species.
-        character_info (dict): Character information.
-        prompt_messages (dict): Prompt messages.
 
         Returns:
         str: Generated taxonomic description.
@@ -1024,30 +1640,16 @@ class TaxonGPT:
         Exception: Any error that occurs during description generation.
         """
         try:
-            content_with_data = self.prompt_messages["description_messages"][4]["content_template"].format(
-                species_name=species_name,
-                species_data=json.dumps(species_data),
-                character_info=json.dumps(self.character_info)
-            )
-
-            messages = [
-                self.prompt_messages["description_messages"][0],
-                self.prompt_messages["description_messages"][1],
-                self.prompt_messages["description_messages"][2],
-                self.prompt_messages["description_messages"][3],
-                {"role": "user", "content": content_with_data},
-                self.prompt_messages["description_messages"][5]
-            ]
-
-            response = self.client.chat.completions.create(
-                model="gpt-4o-2024-08-06",
-                messages=messages,
-                stop=None,
-                temperature=0,
-                n=1
-            )
-
-            result = response.choices[0].message.content
+            messages = self.build_description_messages(species_name, species_data)
+
+            with self.trace_context(stage="description", group_size=1, species=species_name):
+                result = self.chat_completion(
+                    messages,
+                    model="gpt-4o-2024-08-06",
+                    stop=None,
+                    temperature=0,
+                    n=1
+                )
             print(result)
             return result
 
@@ -1055,6 +1657,279 @@ class TaxonGPT:
             print(f"Error generating taxonomic description: {e}")
             raise
 
+    def concurrent_generate_taxonomic_descriptions(self, max_workers=4):
+        """
+        Generates the taxonomic descriptions of all species in the knowledge graph concurrently.
+
+        Args:
+            max_workers (int): The maximum number of concurrent API requests.
+
+        Returns:
+            dict: Species names mapped to their descriptions, in knowledge graph order. Species whose
+                description failed are left out, as in the sequential loop.
+        """
+        taxonomic_descriptions = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(species_name, executor.submit(self.generate_taxonomic_description, species_name, species_data))
+                       for species_name, species_data in self.knowledge_graph.items()]
+
+            # Collect in submission order so the output file is deterministic
+            for species_name, future in futures:
+                try:
+                    taxonomic_descriptions[species_name] = future.result()
+                except Exception as e:
+                    print(f"Error generating description for species {species_name}: {e}")
+                    continue
+
+        return taxonomic_descriptions
+
+    def description_pack_size(self, species_names=None):
+        """
+        Chooses how many species to pack into one description request from the "description_packing" token budget:
+        the budget left after the shared prompt, divided by the tokens of the largest species row plus the
+        completion tokens expected per species.
+
+        Args:
+            species_names (list): The species to describe (all species in the knowledge graph if None).
+
+        Returns:
+            int: The number of species per request, at least 1 and at most "max_species".
+        """
+        packing_config = self.config.get("description_packing", {})
+        token_budget = packing_config.get("token_budget", 16000)
+        completion_tokens = packing_config.get("completion_tokens_per_species", 800)
+        max_species = packing_config.get("max_species", 8)
+        model = "gpt-4o-2024-08-06"
+
+        if species_names is None:
+            species_names = list(self.knowledge_graph)
+        if not species_names:
+            return 1
+
+        shared_tokens = count_message_tokens(self.build_description_messages("", {}), model)
+        shared_tokens += count_tokens(PACKED_DESCRIPTION_INSTRUCTIONS, model)
+        species_tokens = max(count_tokens(f"{name}, {json.dumps({name: self.knowledge_graph[name]})}", model)
+                             for name in species_names)
+
+        pack_size = (token_budget - shared_tokens) // (species_tokens + completion_tokens)
+        return max(1, min(max_species, pack_size))
+
+    def build_packed_description_messages(self, species_names):
+        """
+        Builds the chat messages requesting the taxonomic descriptions of several species in one response,
+        each wrapped in the PACKED_DESCRIPTION_INSTRUCTIONS delimiters.
+
+        Args:
+            species_names (list): Names of the species.
+
+        Returns:
+            list: The chat messages.
+        """
+        species_data = {name: self.knowledge_graph[name] for name in species_names}
+        messages = self.build_description_messages(", ".join(species_names), species_data)
+        instructions = PACKED_DESCRIPTION_INSTRUCTIONS.format(count=len(species_names),
+                                                              species_list=", ".join(species_names))
+        return messages + [{"role": "user", "content": instructions}]
+
+    def split_packed_descriptions(self, response_text, species_names):
+        """
+        Splits a packed description response into per-species descriptions.
+
+        Args:
+            response_text (str): The response of a packed description request.
+            species_names (list): Names of the species in the request.
+
+        Returns:
+            dict: Species names mapped to their descriptions. Species whose section is missing, empty or repeated
+                are left out.
+        """
+        sections = {}
+        repeated = set()
+        for match in PACKED_SECTION_PATTERN.finditer(response_text or ""):
+            name = match.group(1).strip()
+            if name in sections:
+                repeated.add(name)
+            sections[name] = match.group(2).strip()
+
+        return {name: sections[name] for name in species_names
+                if sections.get(name) and name not in repeated}
+
+    def generate_packed_taxonomic_descriptions(self, species_names):
+        """
+        Generates the taxonomic descriptions of several species with one request. Species whose section of the
+        response is malformed are retried individually.
+
+        Args:
+            species_names (list): Names of the species.
+
+        Returns:
+            dict: Species names mapped to their descriptions. Species whose description failed are left out.
+        """
+        descriptions = {}
+        try:
+            messages = self.build_packed_description_messages(species_names)
+            with self.trace_context(stage="description", group_size=len(species_names), species=species_names):
+                result = self.chat_completion(
+                    messages,
+                    model="gpt-4o-2024-08-06",
+                    stop=None,
+                    temperature=0,
+                    n=1
+                )
+            descriptions = self.split_packed_descriptions(result, species_names)
+        except Exception as e:
+            print(f"Error generating packed taxonomic descriptions: {e}")
+
+        taxonomic_descriptions = {}
+        for species_name in species_names:
+            if species_name in descriptions:
+                print(descriptions[species_name])
+                taxonomic_descriptions[species_name] = descriptions[species_name]
+                continue
+
+            print(f"Malformed packed description for species {species_name}, retrying individually.")
+            try:
+                taxonomic_descriptions[species_name] = self.generate_taxonomic_description(
+                    species_name, self.knowledge_graph[species_name])
+            except Exception as e:
+                print(f"Error generating description for species {species_name}: {e}")
+
+        return taxonomic_descriptions
+
+    def packed_generate_taxonomic_descriptions(self, max_workers=1):
+        """
+        Generates the taxonomic descriptions of all species in packs of description_pack_size() species per request,
+        sending up to max_workers requests at once.
+
+        Args:
+            max_workers (int): The maximum number of concurrent API requests.
+
+        Returns:
+            dict: Species names mapped to their descriptions, in knowledge graph order. Species whose
+                description failed are left out.
+        """
+        species_names = list(self.knowledge_graph)
+        pack_size = self.description_pack_size(species_names)
+        packs = [species_names[i:i + pack_size] for i in range(0, len(species_names), pack_size)]
+        print(f"Describing {len(species_names)} species in {len(packs)} requests of up to {pack_size} species.")
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(self.generate_packed_taxonomic_descriptions, packs))
+        else:
+            results = [self.generate_packed_taxonomic_descriptions(pack) for pack in packs]
+
+        descriptions = {}
+        for result in results:
+            descriptions.update(result)
+        return {name: descriptions[name] for name in species_names if name in descriptions}
+
+    def write_description_batch_file(self, batch_file_path):
+        """
+        Writes one Batch API request per species to a JSONL file.
+
+        Args:
+            batch_file_path (str): Path of the JSONL file to write.
+
+        Returns:
+            dict: Batch request custom ids mapped to species names.
+        """
+        species_by_request = {}
+
+        with open(batch_file_path, 'w', encoding='utf-8') as f:
+            for index, (species_name, species_data) in enumerate(self.knowledge_graph.items()):
+                custom_id = f"species-{index}"
+                species_by_request[custom_id] = species_name
+                request = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": "gpt-4o-2024-08-06",
+                        "messages": self.build_description_messages(species_name, species_data),
+                        "stop": None,
+                        "temperature": 0,
+                        "n": 1
+                    }
+                }
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+        return species_by_request
+
+    def batch_generate_taxonomic_descriptions(self, batch_file_path, poll_interval=30, timeout_hours=24):
+        """
+        Generates all taxonomic descriptions through the Batch API: writes the requests to a JSONL file,
+        submits it, polls until the batch finishes and merges the results back in knowledge graph order.
+
+        Args:
+            batch_file_path (str): Path of the JSONL request file to write.
+            poll_interval (float): Seconds to wait between status checks.
+            timeout_hours (float): Give up waiting after this many hours.
+
+        Returns:
+            dict: Species names mapped to their descriptions. Failed requests are left out.
+        """
+        species_by_request = self.write_description_batch_file(batch_file_path)
+
+        with open(batch_file_path, 'rb') as f:
+            batch_input_file = self.client.files.create(file=f, purpose="batch")
+
+        batch = self.client.batches.create(
+            input_file_id=batch_input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"description": "TaxonGPT taxonomic descriptions"}
+        )
+        print(f"Submitted batch {batch.id} with {len(species_by_request)} description requests.")
+
+        deadline = time.time() + timeout_hours * 3600
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.time() > deadline:
+                raise TimeoutError(f"Batch {batch.id} did not finish within {timeout_hours} hours.")
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+            print(f"Batch {batch.id} status: {batch.status}")
+
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'.")
+
+        results = {}
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("error") or record["response"]["status_code"] != 200:
+                print(f"Batch request {record['custom_id']} failed: {record.get('error')}")
+                continue
+            results[record["custom_id"]] = record["response"]["body"]["choices"][0]["message"]["content"]
+            if self.trace is not None:
+                self.trace.record_call(record["response"]["body"].get("model", "gpt-4o-2024-08-06"),
+                                       record["response"]["body"].get("usage"), batch=True, stage="description",
+                                       group_size=1, species=species_by_request.get(record["custom_id"]))
+
+        if batch.error_file_id:
+            for line in self.client.files.content(batch.error_file_id).text.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    print(f"Batch request {record.get('custom_id')} failed: {record.get('error')}")
+
+        taxonomic_descriptions = {}
+        for custom_id, species_name in species_by_request.items():
+            if custom_id not in results:
+                print(f"Error generating description for species {species_name}: no batch result")
+                continue
+            taxonomic_descriptions[species_name] = results[custom_id]
+
+            # Store the result so later interactive runs of the same request are served from the cache
+            if self.response_cache is not None:
+                messages = self.build_description_messages(species_name, self.knowledge_graph[species_name])
+                cache_key = ResponseCache.make_key("gpt-4o-2024-08-06", messages,
+                                                   {"stop": None, "temperature": 0, "n": 1})
+                self.response_cache.put(cache_key, "gpt-4o-2024-08-06", results[custom_id])
+
+        return taxonomic_descriptions
+
     def load_json_file(self, file_path):
         """
         Loads a JSON file from the specified file path.
@@ -1136,6 +2011,10 @@ class TaxonGPT:
             print(f"Error: {species_name} not found in the knowledge graph.")
             return {}
 
+        if self.matrix is not None and species_name in self.matrix.taxon_index:
+            # Read the individual states straight from the bitmask matrix
+            return {char: self.matrix.state_list(species_name, char) for char in self.matrix.characters}
+
         characteristics = self.knowledge_graph[species_name]["Characteristics"]
         character_states = {}
 
@@ -1182,7 +2061,7 @@ class TaxonGPT:
             species_name (str): The name of the species whose data needs to be compared.
 
         Returns:
-            None: Prints the mismatches found, if any, or confirms that all character states match.
+            list: The mismatches found (empty if all character states match), which are also printed.
         """
         extracted_states = self.parse_list_form(description_text)
         original_states = self.parse_original_data(species_name)
@@ -1194,6 +2073,124 @@ class TaxonGPT:
                     f"{m['Character']}: Original states {m['OriginalStates']}, Extracted states {m['ExtractedStates']}")
         else:
             print(f"All character states match for {species_name}.")
+        return mismatches
+
+    def describe_state(self, character, state):
+        """
+        Returns a state as "number (text)" using the character information, e.g. "2 (widely separated)".
+        """
+        info = self.character_info.get(character[len("Character"):], {}) if character.startswith("Character") else {}
+        text = info.get("states", {}).get(state) if isinstance(info, dict) else None
+        return f"{state} ({text})" if text else state
+
+    def build_description_repair_messages(self, species_name, description_text, mismatches):
+        """
+        Builds the chat messages asking for a corrected description: the original description request, the previous
+        description and the list of mismatched characters.
+
+        Args:
+            species_name (str): Name of the species.
+            description_text (str): The previous description.
+            mismatches (list): The mismatches found by compare_character_states.
+
+        Returns:
+            list: The chat messages.
+        """
+        mismatch_lines = []
+        for m in mismatches:
+            info = self.character_info.get(m["Character"][len("Character"):], {})
+            character_description = info.get("description", "") if isinstance(info, dict) else ""
+            expected = " and ".join(self.describe_state(m["Character"], s) for s in m["OriginalStates"]) or "Missing"
+            given = " and ".join(self.describe_state(m["Character"], s) for s in m["ExtractedStates"]) or "nothing"
+            mismatch_lines.append(f"- {m['Character']} {character_description}: the matrix records {expected}, "
+                                  f"the description gives {given}.")
+
+        instructions = DESCRIPTION_REPAIR_INSTRUCTIONS.format(species_name=species_name,
+                                                              mismatch_list="\n".join(mismatch_lines))
+        messages = self.build_description_messages(species_name, self.knowledge_graph[species_name])
+        return messages + [{"role": "assistant", "content": description_text},
+                           {"role": "user", "content": instructions}]
+
+    def repair_taxonomic_description(self, species_name, description_text, mismatches, round_number=1):
+        """
+        Requests a corrected description of one species and keeps it if it has fewer mismatches.
+
+        Args:
+            species_name (str): Name of the species.
+            description_text (str): The current description.
+            mismatches (list): The mismatches of the current description.
+            round_number (int): The repair round, recorded in the trace.
+
+        Returns:
+            tuple: (description, mismatches) of the better of the current and the corrected description.
+        """
+        messages = self.build_description_repair_messages(species_name, description_text, mismatches)
+        # A rejected repair leaves the messages of the next round unchanged, so the cache is not read
+        with self.trace_context(stage="repair", group_size=1, species=species_name, round=round_number):
+            result = self.chat_completion(
+                messages,
+                model="gpt-4o-2024-08-06",
+                use_cache=False,
+                stop=None,
+                temperature=0,
+                n=1
+            )
+
+        new_mismatches = self.compare_character_states(self.parse_list_form(result),
+                                                       self.parse_original_data(species_name))
+        if len(new_mismatches) < len(mismatches):
+            return result, new_mismatches
+        return description_text, mismatches
+
+    def repair_taxonomic_descriptions(self, taxonomic_descriptions, max_rounds=2, max_workers=1):
+        """
+        Verifies every description's List Form against the matrix and re-requests only the species with mismatches,
+        passing the mismatches in the prompt, for up to max_rounds rounds.
+
+        Args:
+            taxonomic_descriptions (dict): Species names mapped to their descriptions.
+            max_rounds (int): The maximum number of repair rounds.
+            max_workers (int): The maximum number of concurrent API requests.
+
+        Returns:
+            dict: The descriptions, with the repaired ones replaced, in the same order.
+        """
+        descriptions = dict(taxonomic_descriptions)
+        pending = {}
+        for species_name, description_text in descriptions.items():
+            mismatches = self.compare_character_states(self.parse_list_form(description_text),
+                                                       self.parse_original_data(species_name))
+            if mismatches:
+                pending[species_name] = mismatches
+
+        for round_number in range(1, max_rounds + 1):
+            if not pending:
+                break
+            print(f"Repair round {round_number}: {len(pending)} descriptions with mismatches.")
+
+            def repair(species_name):
+                try:
+                    return self.repair_taxonomic_description(species_name, descriptions[species_name],
+                                                             pending[species_name], round_number)
+                except Exception as e:
+                    print(f"Error repairing description for species {species_name}: {e}")
+                    return descriptions[species_name], pending[species_name]
+
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = dict(zip(pending, executor.map(repair, list(pending))))
+            else:
+                results = {species_name: repair(species_name) for species_name in pending}
+
+            pending = {}
+            for species_name, (description_text, mismatches) in results.items():
+                descriptions[species_name] = description_text
+                if mismatches:
+                    pending[species_name] = mismatches
+
+        if pending:
+            print(f"Descriptions still mismatched after {max_rounds} repair rounds: {', '.join(pending)}")
+        return descriptions
 
     def compare_files(self, description_file_path, knowledge_graph_file_path):
         """
@@ -1254,20 +2251,49 @@ class TaxonGPT:
         JSONDecodeError: If there is an error decoding the JSON file.
         Exception: Any other error that occurs during processing.
         """
+        self.trace_start_run()
+        self.trace_stage("parse")
         self.nexus_to_knowledge_graph()
+        self.trace_run_info("description")
         self.load_character_messages()
         self.load_prompt_messages()
 
-        taxonomic_descriptions = {}
+        self.trace_stage("description")
+        batch_config = self.config.get("batch", {})
+        concurrency_config = self.config.get("concurrency", {})
+        if batch_config.get("enabled", False):
+            # Submit all description requests as one offline batch
+            taxonomic_descriptions = self.batch_generate_taxonomic_descriptions(
+                batch_config.get("batch_file_path", "description_batch.jsonl"),
+                poll_interval=batch_config.get("poll_interval", 30),
+                timeout_hours=batch_config.get("timeout_hours", 24))
+        elif self.config.get("description_packing", {}).get("enabled", False):
+            # Describe several species per request, sized from the token budget
+            max_workers = concurrency_config.get("max_workers", 4) if concurrency_config.get("enabled", False) else 1
+            taxonomic_descriptions = self.packed_generate_taxonomic_descriptions(max_workers=max_workers)
+        elif concurrency_config.get("enabled", False):
+            # Generate descriptions with a bounded pool of concurrent API requests
+            taxonomic_descriptions = self.concurrent_generate_taxonomic_descriptions(
+                max_workers=concurrency_config.get("max_workers", 4))
+        else:
+            taxonomic_descriptions = {}
 
-        # Loop through species and generate descriptions
-        for species_name, species_data in self.knowledge_graph.items():
-            try:
-                description = self.generate_taxonomic_description(species_name, species_data)
-                taxonomic_descriptions[species_name] = description
-            except Exception as e:
-                print(f"Error generating description for species {species_name}: {e}")
-                continue
+            # Loop through species and generate descriptions
+            for species_name, species_data in self.knowledge_graph.items():
+                try:
+                    description = self.generate_taxonomic_description(species_name, species_data)
+                    taxonomic_descriptions[species_name] = description
+                except Exception as e:
+                    print(f"Error generating description for species {species_name}: {e}")
+                    continue
+
+        repair_config = self.config.get("description_repair", {})
+        if repair_config.get("enabled", False):
+            # Re-request only the descriptions whose List Form disagrees with the matrix
+            self.trace_stage("repair")
+            max_workers = concurrency_config.get("max_workers", 4) if concurrency_config.get("enabled", False) else 1
+            taxonomic_descriptions = self.repair_taxonomic_descriptions(
+                taxonomic_descriptions, max_rounds=repair_config.get("max_rounds", 2), max_workers=max_workers)
 
         try:
             # Get the output file path from the configuration
@@ -1276,23 +2302,54 @@ class TaxonGPT:
             # Save the taxonomic descriptions to the specified file
             with open(output_file_path, 'w') as f:
                 json.dump(taxonomic_descriptions, f, indent=4)
-            print(f"Taxonomic descriptions have been saved to '{taxonomic_description_path}'.")
+            print(f"Taxonomic descriptions have been saved to '{output_file_path}'.")
         except Exception as e:
             print(f"Error saving taxonomic descriptions to file: {e}")
 
         # Optional: Check function control, not implemented by default
+        self.trace_stage("check")
         if self.config.get("enable_description_check", True):
-            description_file_path = self.config["paths"]["taxonomic_description_path"]
-            knowledge_graph_file_path = self.config["paths"]["json_output_path"]
-            self.compare_files(description_file_path, knowledge_graph_file_path)  # Call the check function
+            self.process_check()  # Call the check function
         else:
             print("Description check is disabled by configuration.")
 
+        if self.response_cache is not None:
+            print(f"Response cache statistics: {self.response_cache.stats()}")
+
+        if self.scheduler is not None:
+            print(f"Request scheduler statistics: {self.scheduler.stats}")  # Output retries and throttling
+
+        if self.trace is not None:
+            print(f"Trace totals: {self.trace.write_summary()['total']}")  # Output per-run totals
+            self.trace.close()
+
+    def process_check(self):
+        """
+        Checks the saved taxonomic descriptions against the matrix, without any API call. When no knowledge graph
+        has been built in this process, it is read from the JSON output of the earlier run, and the NEXUS file is
+        only parsed if that output is missing.
+        """
+        description_file_path = self.paths["taxonomic_description_path"]
+        knowledge_graph_file_path = self.paths["json_output_path"]
+
+        if self.knowledge_graph is None:
+            if os.path.exists(knowledge_graph_file_path):
+                self.knowledge_graph = self.load_json_file(knowledge_graph_file_path)
+                self.matrix = TaxonMatrix.from_knowledge_graph(self.knowledge_graph)
+            else:
+                self.nexus_to_knowledge_graph()
+
+        self.compare_files(description_file_path, knowledge_graph_file_path)
+
 
 # The config.json file template
 """
 {
     "api_key": "YOUR API KEY HERE",
+    # Optional: add "base_url": "http://127.0.0.1:8000/v1" to point the client at another OpenAI-compatible endpoint,
+    # e.g. the local mock_openai_server.py. Leave it out to use the OpenAI API.
+    # "python -m TaxonGPT.mock_openai_server --nexus <Nexus file> --characters <character info file>" answers every prompt
+    # deterministically from the dataset, with optional --latency and --error-rate, for offline end-to-end runs.
     "nexus_file_path": "<Full path to the input Nexus file>",
     "prompt_file_path": "<Full path to the input Prompt file>",
     "character_file_path": "<Full path to the input character info file>",
@@ -1305,31 +2362,77 @@ class TaxonGPT:
 
     "comparison_output_path": "<Full path to output taxonomic key file>",
     # By default, the description check feature is disabled to prevent generating excessive redundant results. If you need to check the execution steps, please set "enable_description_check": false to true in the configuration file.
-    "enable_description_check": false
-
+    "enable_description_check": false,
+
+    # Optional disk-backed cache of API responses. Re-running a dataset with unchanged prompts is then served from disk.
+    # "policy" is one of "read_write", "read_only", "write_only" (always call the API and refresh) or "off".
+    "cache": {"enabled": false, "path": "<Full path to the cache database>", "policy": "read_write",
+              "max_entries": 100000, "max_size_mb": 500, "max_age_days": 30},
+
+    # Matrix encoding inserted into the {knowledge_graph} and {group_matrix_str} prompt placeholders: "json" (default)
+    # or "compact" (header row of characters, one row per taxon). Templates can also use {knowledge_graph_compact}
+    # and {group_matrix_compact} directly.
+    "prompt_matrix_format": "json",
+
+    # Layout of the description requests: "inline" (default) puts the character information in the user message next
+    # to the species data; "prefix" sends it as a system message ahead of the species data, so all description
+    # requests share an identical prefix that the provider's prompt cache can serve (see "cached_tokens" in the trace).
+    "description_layout": "inline",
+
+    # Describe several species per request instead of one. The number of species per request is chosen so that the
+    # shared prompt, the species rows and "completion_tokens_per_species" per species fit in "token_budget" (counted
+    # with tiktoken), up to "max_species". Species whose section of a packed response is malformed are retried alone.
+    "description_packing": {
+        "enabled": false,
+        "token_budget": 16000,
+        "completion_tokens_per_species": 800,
+        "max_species": 8
+    },
+
+    # Check every description's List Form against the matrix after generation and re-request only the species with
+    # mismatches, giving the mismatched characters in the prompt, for up to "max_rounds" rounds.
+    "description_repair": {"enabled": false, "max_rounds": 2},
+
+    # Request classifications as structured JSON in a single call instead of free text plus a JSON formatting call.
+    "structured_output": false,
+
+    # Local information-gain split engine. "seed" ranks candidate characters locally and passes the best "top_n"
+    # to prompt templates that contain {split_candidates}; "local" builds the whole key without API calls.
+    "split_engine": {"mode": "off", "top_n": 5},
+
+    # Optional disk cache of parsed datasets, keyed on the NEXUS file content. A second run on an unchanged matrix
+    # skips parsing and does not rewrite the CSV and JSON outputs.
+    "dataset_cache": {"enabled": false, "dir": "<Full path to the dataset cache directory>"},
+
+    # Per-node checkpoints of process_key runs. An interrupted run can be continued with TaxonGPT.resume(), which
+    # refuses a run directory created with other prompts, character info, "structured_output", "prompt_matrix_format"
+    # or "split_engine" settings.
+    "checkpoint": {"enabled": false, "run_dir": "<Full path to the run directory>"},
+
+    # Optional JSONL trace with one record per API call (stage, tree depth, group size, tokens, latency, retries, cost)
+    # and per-stage wall-clock totals. Every process_key / process_description call is a separate run (records carry
+    # its "run_id"), so re-runs can append to one file. Read it with run_trace.summarize_traces (one row per run),
+    # e.g. in the Figure 4.3 scripts.
+    # "pricing" optionally overrides the USD per million tokens: {"gpt-4o": [input, cached input, output]}.
+    "trace": {"enabled": false, "path": "<Full path to the trace file>"},
+
+    # Optional client-side rate limiting shared by all requests of the process: requests are paced to the "rpm" and
+    # "tpm" limits of your account, throttled or failed requests are retried with exponential backoff (honouring
+    # Retry-After), and the number of requests in flight adapts between 1 and "max_concurrency".
+    "rate_limit": {"enabled": false, "rpm": 500, "tpm": 30000, "max_concurrency": 8, "max_retries": 6},
+
+    # Optional concurrent execution. "max_workers" caps the number of API requests in flight at once.
+    "concurrency": {"enabled": false, "max_workers": 4},
+
+    # Optional offline Batch API mode for process_description (cheaper, not subject to interactive rate limits).
+    "batch": {"enabled": false, "batch_file_path": "<Full path to the JSONL request file>", "poll_interval": 30,
+              "timeout_hours": 24}
 }
 """
 
-# Get the path to the directory where the current script is located
-script_directory = os.getcwd()
-
-# Path to build configuration file (current directory)
-config_file_path = os.path.join(script_directory, 'config.json')
-
-# Check if the configuration file exists
-if not os.path.exists(config_file_path):
-    raise FileNotFoundError(f"Configuration file not found: {config_file_path}")
-
-# Open and read the contents of the configuration file
-with open(config_file_path, 'r') as config_file:
-    config_data = json.load(config_file)
-
-# Print the read configuration data
-print(f"Read the profile data: {config_data}")
+if __name__ == "__main__":
+    # Running the script directly generates the key and the descriptions with the config.json of the current
+    # directory, as before; the command line offers the individual stages ("python -m TaxonGPT --help").
+    from .cli import main
 
-# Through TaxonGPT() to generate the related result
-TaxonGPT = TaxonGPT(config_file_path)
-# Generate the Taxonomic Key
-TaxonGPT.process_key()
-# Generate the Taxonomic Description
-TaxonGPT.process_description()
+    main(["all"])
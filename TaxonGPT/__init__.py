@@ -0,0 +1,12 @@
+# TaxonGPT package: "from TaxonGPT import TaxonGPT" imports the class (openai and pandas are loaded on first use)
+__all__ = ["TaxonGPT"]
+
+
+def __getattr__(name):
+    # The class is imported on first access, so "python -m TaxonGPT", the dtom subcommand and the scripts importing
+    # single modules (request_scheduler, run_trace, ...) do not load TaxonGPT.py and numpy
+    if name == "TaxonGPT":
+        from .TaxonGPT import TaxonGPT
+        globals()["TaxonGPT"] = TaxonGPT  # Replaces the submodule the import has bound to the same name
+        return TaxonGPT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
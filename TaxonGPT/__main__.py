@@ -0,0 +1,4 @@
+from .cli import main
+
+# Allows "python -m TaxonGPT <command>" from the repository root
+main()
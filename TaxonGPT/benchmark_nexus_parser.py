@@ -0,0 +1,120 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script ("python TaxonGPT/benchmark_nexus_parser.py"): import the TaxonGPT package from the repository root
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "TaxonGPT"
+
+from .nexus_parser import tokenize_matrix
+
+
+def legacy_parse_rows(matrix_content):
+    """
+    The character-by-character parser previously used by TaxonGPT.parse_matrix, kept as the benchmark
+    baseline. Assumes strictly alternating name/trait lines.
+
+    Args:
+        matrix_content (str): The content of the MATRIX block.
+
+    Returns:
+        list: Rows as [taxon, state, state, ...].
+    """
+    data = []
+    lines = matrix_content.strip().split('\n')
+
+    for i in range(0, len(lines), 2):
+        taxa = lines[i].strip().strip("'")
+        traits = lines[i + 1].strip()
+        species_traits = []
+        j = 0
+
+        while j < len(traits):
+            if traits[j] == '(':
+                j += 1
+                states = ''
+                while traits[j] != ')':
+                    if traits[j].isalpha():
+                        states += str(ord(traits[j]) - ord('A') + 10)
+                    else:
+                        states += traits[j]
+                    j += 1
+                species_traits.append(','.join(states))
+            elif traits[j] == '?':
+                species_traits.append('Missing')
+            elif traits[j] == '-':
+                species_traits.append('Not Applicable')
+            elif traits[j].isalpha():
+                species_traits.append(str(ord(traits[j]) - ord('A') + 10))
+            else:
+                species_traits.append(traits[j])
+            j += 1
+
+        data.append([taxa] + species_traits)
+
+    return data
+
+
+def generate_matrix(n_taxa, n_characters, seed=0):
+    """
+    Generates a synthetic MATRIX block in the layout of the Trial Datasets (quoted names and trait rows on
+    alternating lines), with missing, inapplicable and polymorphic cells.
+
+    Args:
+        n_taxa (int): Number of taxa.
+        n_characters (int): Number of characters.
+        seed (int): Random seed.
+
+    Returns:
+        str: The MATRIX block content.
+    """
+    rng = random.Random(seed)
+    lines = []
+
+    for taxon in range(n_taxa):
+        cells = []
+        for _ in range(n_characters):
+            roll = rng.random()
+            if roll < 0.05:
+                cells.append('?')
+            elif roll < 0.08:
+                cells.append('-')
+            elif roll < 0.15:
+                cells.append('(' + ''.join(sorted(rng.sample('1234', 2))) + ')')
+            else:
+                cells.append(rng.choice('1234'))
+        lines.append(f"'Taxon {taxon}'")
+        lines.append(''.join(cells))
+
+    return '\n'.join(lines)
+
+
+def time_parser(parser, matrix_content, repeats):
+    """
+    Returns the best wall-clock time of several runs of a parser.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser(matrix_content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NEXUS MATRIX tokenizer against the legacy parser.")
+    parser.add_argument("--taxa", type=int, nargs="+", default=[10, 100, 1000, 10000, 50000])
+    parser.add_argument("--characters", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'taxa':>8} {'legacy (s)':>12} {'tokenizer (s)':>14} {'speed-up':>9}")
+    for n_taxa in args.taxa:
+        content = generate_matrix(n_taxa, args.characters)
+        assert tokenize_matrix(content) == legacy_parse_rows(content)
+        legacy_time = time_parser(legacy_parse_rows, content, args.repeats)
+        tokenizer_time = time_parser(tokenize_matrix, content, args.repeats)
+        print(f"{n_taxa:>8} {legacy_time:>12.4f} {tokenizer_time:>14.4f} {legacy_time / tokenizer_time:>8.1f}x")
@@ -0,0 +1,369 @@
+import argparse
+import contextlib
+import copy
+import glob
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script ("python TaxonGPT/benchmark_suite.py"): import the TaxonGPT package from the repository root
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "TaxonGPT"
+
+from .benchmark_nexus_parser import generate_matrix
+from .mock_openai_server import TaxonomyResponder
+from .nexus_parser import extract_matrix, read_nexus
+from .TaxonGPT import TaxonGPT
+from .taxon_matrix import TaxonMatrix, bit_to_state, mask_to_bits
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TRIAL_DATASETS_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, "..", "Taxonomic Material", "Trial Datasets")
+
+
+def create_taxongpt(work_dir):
+    """
+    Creates a TaxonGPT instance whose output paths point into a scratch directory. No API call is made.
+    """
+    config_path = os.path.join(work_dir, "config.json")
+    paths = {name: os.path.join(work_dir, name) for name in
+             ("csv_output_path", "json_output_path", "taxonomic_description_path", "taxonomic_key_path")}
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({"api_key": "benchmark", "paths": paths}, f)
+    return TaxonGPT(config_path)
+
+
+def generate_character_info(n_characters, n_states=4):
+    """
+    Generates a character_info.json-style dictionary for a synthetic matrix.
+    """
+    return {str(j + 1): {"description": f"Synthetic character {j + 1}, shape of the structure.",
+                         "states": {str(s + 1): f"form {s + 1} of character {j + 1}" for s in range(n_states)}}
+            for j in range(n_characters)}
+
+
+def trial_datasets(directory=TRIAL_DATASETS_DIRECTORY):
+    """
+    Lists the Trial Datasets.
+
+    Returns:
+        list: (name, NEXUS file path, character information path or None) per dataset, in directory order.
+    """
+    datasets = []
+    dataset_dirs = sorted(glob.glob(os.path.join(directory, "*")), key=lambda p: int(os.path.basename(p).split()[0]))
+    for dataset_dir in dataset_dirs:
+        files = glob.glob(os.path.join(dataset_dir, "*"))
+        nexus = [p for p in files if not p.endswith((".json", ".txt", ".docx"))]
+        character_files = sorted(p for p in files if os.path.basename(p).startswith("character_info"))
+        if nexus:
+            character_path = character_files[0] if character_files else None
+            datasets.append((os.path.basename(dataset_dir), nexus[0], character_path))
+    return datasets
+
+
+def build_classification(matrix, max_depth=5):
+    """
+    Builds a deterministic classification in the layout process_key works with: an initial split of all taxa and one
+    nested classification per state group. Each node splits on the next character, in matrix order, that divides
+    its group, so even very large matrices are classified in a few seconds.
+
+    Args:
+        matrix (TaxonMatrix): The matrix.
+        max_depth (int): Maximum depth of the nested classifications, as in process_key.
+
+    Returns:
+        tuple: (initial classification, {state: JSON classification of the group}).
+    """
+    def split(rows, start):
+        for j in range(start, len(matrix.characters)):
+            column = matrix.masks[rows, j]
+            branches = {bit_to_state(bit): rows[(column >> np.uint64(bit)) & np.uint64(1) == 1]
+                        for bit in mask_to_bits(np.bitwise_or.reduce(column))}
+            if len(branches) >= 2 and all(len(members) < len(rows) for members in branches.values()):
+                return j, branches
+        return None, None
+
+    def classify(rows, start, depth):
+        j, branches = split(rows, start)
+        if j is None:
+            return None
+        node = {"Character": matrix.characters[j], "States": {}}
+        for state, members in branches.items():
+            subtree = classify(members, j + 1, depth + 1) if len(members) > 1 and depth < max_depth else None
+            node["States"][state] = subtree if subtree is not None else [matrix.taxa[i] for i in members]
+        return node
+
+    j, branches = split(np.arange(len(matrix.taxa)), 0)
+    initial = {"Character": matrix.characters[j],
+               "States": {state: [matrix.taxa[i] for i in members] for state, members in branches.items()}}
+
+    classification_results = {}
+    for state, members in branches.items():
+        if len(members) > 1:
+            subtree = classify(members, j + 1, 1)
+            if subtree is not None:
+                classification_results[state] = json.dumps(subtree, ensure_ascii=False)
+    return initial, classification_results
+
+
+def prepare_dataset(tg, matrix_content, nchar, interleave, character_info, description_limit):
+    """
+    Parses a dataset and prepares the inputs of every benchmarked function, as process_key and
+    process_description would produce them.
+
+    Returns:
+        dict: The benchmark inputs.
+    """
+    df = tg.parse_matrix(matrix_content, nchar=nchar, interleave=interleave)
+    tg.knowledge_graph = tg.build_knowledge_graph(df)
+    tg.matrix = TaxonMatrix.from_dataframe(df)
+    tg.character_info = character_info
+
+    initial, classification_results = build_classification(tg.matrix)
+    classification_data = {key: json.loads(value) for key, value in classification_results.items()}
+    final_results = {key: {species: {"Characteristics": path} for species, path in tg.extract_paths(data)}
+                     for key, data in classification_data.items()}
+
+    combined = copy.deepcopy(initial)
+    for state_key, secondary in copy.deepcopy(classification_data).items():
+        tg.combine_results(combined, secondary, state_key)
+    converted = tg.convert_structure(combined)
+
+    # Descriptions in the format the description prompts ask for, generated locally from the matrix
+    responder = TaxonomyResponder(tg.matrix, character_info)
+    rng = random.Random(0)
+    descriptions = [responder.describe(taxon, rng) for taxon in tg.matrix.taxa[:description_limit]]
+
+    return {
+        "matrix_content": matrix_content, "nchar": nchar, "interleave": interleave, "df": df,
+        "initial": initial, "classification_data": classification_data, "final_results": final_results,
+        "groups": tg.generate_groups_from_classification(initial), "combined": combined, "converted": converted,
+        "key": tg.replace_indices_with_descriptions_in_key(converted, character_info), "descriptions": descriptions,
+    }
+
+
+def benchmark_cases(tg, inputs):
+    """
+    Returns the benchmarked calls of a dataset.
+
+    Returns:
+        dict: Function name to (setup, call, items): setup() builds fresh arguments (untimed), call(*arguments) is
+            timed, and items is the number of taxa (or descriptions) processed per call.
+    """
+    n_taxa = len(tg.matrix.taxa)
+
+    def no_setup():
+        return ()
+
+    def extract_all_paths():
+        for data in inputs["classification_data"].values():
+            list(tg.extract_paths(data))
+
+    def combine_setup():
+        return copy.deepcopy(inputs["initial"]), copy.deepcopy(inputs["classification_data"])
+
+    def combine_all(initial, classification_data):
+        for state_key, secondary in classification_data.items():
+            tg.combine_results(initial, secondary, state_key)
+
+    def key_setup():
+        tg.step_counter = 1
+        tg.steps = []
+        return ()
+
+    def parse_descriptions():
+        for description in inputs["descriptions"]:
+            tg.parse_list_form(description)
+
+    return {
+        "parse_matrix": (no_setup, lambda: tg.parse_matrix(inputs["matrix_content"], nchar=inputs["nchar"],
+                                                           interleave=inputs["interleave"]), n_taxa),
+        "build_knowledge_graph": (no_setup, lambda: tg.build_knowledge_graph(inputs["df"]), n_taxa),
+        "extract_paths": (no_setup, extract_all_paths, n_taxa),
+        "validate_results": (no_setup, lambda: tg.validate_results(inputs["final_results"], inputs["groups"]), n_taxa),
+        "convert_structure": (no_setup, lambda: tg.convert_structure(inputs["combined"]), n_taxa),
+        "combine_results": (combine_setup, combine_all, n_taxa),
+        "replace_indices_with_descriptions_in_key": (
+            no_setup, lambda: tg.replace_indices_with_descriptions_in_key(inputs["converted"], tg.character_info),
+            n_taxa),
+        "generate_classification_key": (key_setup, lambda: tg.generate_classification_key(inputs["key"], 1), n_taxa),
+        "parse_list_form": (no_setup, parse_descriptions, len(inputs["descriptions"])),
+    }
+
+
+def measure(setup, call, repeats, memory=True):
+    """
+    Times a call and measures its peak memory.
+
+    Args:
+        setup (callable): Builds fresh arguments for each run (not timed).
+        call (callable): The call to measure.
+        repeats (int): Number of timed runs; the best is kept.
+        memory (bool): Measure the peak memory in one extra run under tracemalloc (which slows code down, so it is
+            never active during the timed runs).
+
+    Returns:
+        tuple: (best seconds, peak memory in bytes or None).
+    """
+    best = float("inf")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            arguments = setup()
+            start = time.perf_counter()
+            call(*arguments)
+            best = min(best, time.perf_counter() - start)
+
+        peak = None
+        if memory:
+            arguments = setup()
+            tracemalloc.start()
+            try:
+                call(*arguments)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    return best, peak
+
+
+def run_dataset(tg, name, matrix_content, nchar, interleave, character_info, args):
+    """
+    Benchmarks every function on one dataset.
+
+    Returns:
+        list: One result record per function.
+    """
+    inputs = prepare_dataset(tg, matrix_content, nchar, interleave, character_info, args.description_limit)
+    results = []
+    for function, (setup, call, items) in benchmark_cases(tg, inputs).items():
+        seconds, peak = measure(setup, call, args.repeats, memory=not args.no_memory)
+        record = {
+            "dataset": name,
+            "taxa": len(tg.matrix.taxa),
+            "characters": len(tg.matrix.characters),
+            "function": function,
+            "items": items,
+            "seconds": seconds,
+            "items_per_second": items / seconds if seconds > 0 else None,
+            "peak_memory_mb": peak / 2 ** 20 if peak is not None else None,
+        }
+        results.append(record)
+        print(f"{name:<24} {record['taxa']:>7} {function:<42} {seconds:>10.5f} "
+              f"{record['items_per_second'] or 0:>14,.0f} "
+              f"{record['peak_memory_mb'] if record['peak_memory_mb'] is not None else float('nan'):>10.2f}")
+    return results
+
+
+def git_revision():
+    """
+    Returns the current git commit of the repository, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline_path, threshold, min_delta=0.005):
+    """
+    Compares results with a saved baseline and prints the speed ratio of every function and dataset.
+
+    Args:
+        results (list): The new result records.
+        baseline_path (str): Path to a results file saved by an earlier run.
+        threshold (float): Ratio of new to baseline time above which a result counts as a regression.
+        min_delta (float): Slow-downs of fewer seconds are timer noise and never count as regressions.
+
+    Returns:
+        list: The (dataset, function, ratio) of every regression.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["dataset"], r["function"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    print(f"\nComparison with {baseline_path} (ratio = new time / baseline time)")
+    for record in results:
+        old = baseline.get((record["dataset"], record["function"]))
+        if old is None or not old["seconds"]:
+            continue
+        ratio = record["seconds"] / old["seconds"]
+        regressed = ratio > threshold and record["seconds"] - old["seconds"] > min_delta
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{record['dataset']:<24} {record['function']:<42} {old['seconds']:>10.5f} {record['seconds']:>10.5f} "
+              f"{ratio:>7.2f}x{flag}")
+        if regressed:
+            regressions.append((record["dataset"], record["function"], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local TaxonGPT code paths on the Trial Datasets "
+                                                 "and on synthetic matrices.")
+    parser.add_argument("--taxa", type=int, nargs="*", default=[10, 100, 1000, 10000, 100000],
+                        help="Sizes of the synthetic matrices (none to skip them)")
+    parser.add_argument("--characters", type=int, default=50, help="Characters of the synthetic matrices")
+    parser.add_argument("--no-trial", action="store_true", help="Skip the Trial Datasets")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--description-limit", type=int, default=1000,
+                        help="Maximum number of descriptions parsed per dataset by the parse_list_form benchmark")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory measurements")
+    parser.add_argument("--save", default=None,
+                        help="Results file to write (default: benchmark_results/<timestamp>_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Results file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slow-down ratio reported as a regression by --compare")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="Slow-downs of fewer seconds are not reported as regressions")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    all_results = []
+    print(f"{'dataset':<24} {'taxa':>7} {'function':<42} {'best (s)':>10} {'taxa/s':>14} {'peak (MB)':>10}")
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        taxongpt = create_taxongpt(scratch_dir)
+
+        if not args.no_trial:
+            for dataset_name, nexus_path, character_path in trial_datasets():
+                content, _ = read_nexus(nexus_path)
+                block, n_char, is_interleaved = extract_matrix(content)
+                info = {}
+                if character_path:
+                    with open(character_path, "r", encoding="utf-8") as f:
+                        info = json.load(f)
+                all_results += run_dataset(taxongpt, dataset_name, block, n_char, is_interleaved, info, args)
+
+        for n_taxa in args.taxa:
+            block = generate_matrix(n_taxa, args.characters)
+            all_results += run_dataset(taxongpt, f"synthetic {n_taxa}", block, args.characters, False,
+                                       generate_character_info(args.characters), args)
+
+    save_path = args.save or os.path.join(
+        "benchmark_results", f"{time.strftime('%Y%m%d-%H%M%S')}_{revision or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with open(save_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "revision": revision,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeats": args.repeats,
+            "results": all_results,
+        }, f, indent=2)
+    print(f"\nResults saved to {save_path}")
+
+    if args.compare:
+        found = compare_results(all_results, args.compare, args.threshold, args.min_delta)
+        if found:
+            print(f"{len(found)} regression(s) above {args.threshold}x.")
+            raise SystemExit(1)
+        print("No regressions.")
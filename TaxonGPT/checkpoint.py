@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class CheckpointStore:
+    """
+    Stores the result of every finished classification node of a process_key run in a run directory,
+    so an interrupted run can be resumed without repeating completed API calls.
+
+    Each node is saved as one JSON file named after a hash of its stage (initial/classify/correct), group state,
+    species set and the group's rows of the knowledge graph, so a changed matrix never reuses a stale result.
+    The run directory also records a fingerprint of the prompts and the classification settings of the run that
+    created it, and a run started with different ones refuses to resume from it.
+
+    Attributes:
+        run_dir (str): The run directory.
+        node_dir (str): Directory holding one file per finished node.
+        loaded (int): Number of nodes served from checkpoints in this run.
+        saved (int): Number of nodes written in this run.
+    """
+
+    RUN_FILE = "run.json"  # Fingerprint of the run that created the checkpoints
+
+    def __init__(self, run_dir):
+        """
+        Opens (or creates) a run directory.
+
+        Args:
+            run_dir (str): Path to the run directory.
+        """
+        self.run_dir = run_dir
+        self.node_dir = os.path.join(run_dir, "nodes")
+        self.loaded = 0
+        self.saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.node_dir, exist_ok=True)
+
+    def clear(self):
+        """
+        Removes all checkpoints of the run, for a fresh start.
+        """
+        shutil.rmtree(self.node_dir, ignore_errors=True)
+        os.makedirs(self.node_dir, exist_ok=True)
+
+    def start(self, fingerprint, resume=False):
+        """
+        Starts a run. A fresh run clears the checkpoints and records the fingerprint; a resumed run must have the
+        fingerprint recorded by the run it continues, so its nodes are never reused under other prompts or settings.
+
+        Args:
+            fingerprint (dict): The prompts and classification settings the node results depend on.
+            resume (bool): Reuse the checkpoints of a previous run instead of starting afresh.
+
+        Raises:
+            ValueError: If resuming a run directory created with a different fingerprint.
+        """
+        run_path = os.path.join(self.run_dir, self.RUN_FILE)
+
+        if resume:
+            try:
+                with open(run_path, "r", encoding="utf-8") as f:
+                    recorded = json.load(f)["fingerprint"]
+            except (OSError, json.JSONDecodeError, KeyError):
+                recorded = None
+
+            if recorded is None and not os.listdir(self.node_dir):
+                recorded = fingerprint  # Nothing to resume from: the run simply starts here
+            if recorded != fingerprint:
+                changed = sorted(k for k in set(fingerprint) | set(recorded or {})
+                                 if (recorded or {}).get(k) != fingerprint.get(k))
+                raise ValueError(f"Cannot resume from '{self.run_dir}': it was created with different settings "
+                                 f"({', '.join(changed)}). Start a fresh run instead.")
+        else:
+            self.clear()  # A fresh run must not reuse results from an earlier one
+
+        temporary_path = f"{run_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "started_at": time.time()}, f, ensure_ascii=False, indent=4)
+        os.replace(temporary_path, run_path)
+
+    @staticmethod
+    def node_key(stage, state, species, knowledge_graph, extra=None):
+        """
+        Computes the checkpoint key of a node.
+
+        Args:
+            stage (str): The pipeline stage ("initial", "classify" or "correct").
+            state (str): The state key of the group.
+            species (list): The species in the group.
+            knowledge_graph (dict): The knowledge graph the group is classified from.
+            extra: Any additional data the result depends on (e.g. the errors being corrected).
+
+        Returns:
+            str: SHA-256 hex digest identifying the node.
+        """
+        species_set = sorted(species)
+        payload = json.dumps({
+            "stage": stage,
+            "state": state,
+            "species": species_set,
+            "rows": [knowledge_graph.get(s) for s in species_set],
+            "extra": extra,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        """
+        Loads a finished node.
+
+        Args:
+            key (str): The node key.
+
+        Returns:
+            str: The stored result, or None if the node has not been checkpointed.
+        """
+        path = os.path.join(self.node_dir, f"{key}.json")
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None  # A partially written file from a crash is treated as missing
+
+        with self._lock:
+            self.loaded += 1
+        return record["result"]
+
+    def save(self, key, stage, state, species, result):
+        """
+        Saves a finished node. The file is written atomically so a crash never leaves a corrupt checkpoint.
+
+        Args:
+            key (str): The node key.
+            stage (str): The pipeline stage.
+            state (str): The state key of the group.
+            species (list): The species in the group.
+            result (str): The node result.
+        """
+        record = {"stage": stage, "state": state, "species": species, "result": result, "saved_at": time.time()}
+        path = os.path.join(self.node_dir, f"{key}.json")
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=4)
+        os.replace(temporary_path, path)
+
+        with self._lock:
+            self.saved += 1
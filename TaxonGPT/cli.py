@@ -0,0 +1,159 @@
+import argparse
+import os
+import runpy
+import sys
+import time
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script ("python TaxonGPT/cli.py"): import the TaxonGPT package from the repository root
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "TaxonGPT"
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DTOM_SCRIPT_PATH = os.path.join(SCRIPT_DIRECTORY, "..", "Description to Matrix (DtoM)",
+                                "DtoM (Description to Matrix).py")
+
+
+def create_taxongpt(config_path):
+    """
+    Imports TaxonGPT and creates an instance from a configuration file. The import is deferred so that
+    "--help" and the dtom subcommand do not load it.
+
+    Args:
+        config_path (str): Path to the configuration file.
+
+    Returns:
+        TaxonGPT: The instance.
+    """
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Configuration file not found: {config_path}")
+    print(f"Using the configuration file: {os.path.abspath(config_path)}")
+
+    from . import TaxonGPT
+    return TaxonGPT(config_path)
+
+
+def run_key(args):
+    """
+    Generates the taxonomic key.
+    """
+    create_taxongpt(args.config).process_key(resume=args.resume)
+
+
+def run_describe(args):
+    """
+    Generates the taxonomic descriptions (and checks them if "enable_description_check" is set).
+    """
+    create_taxongpt(args.config).process_description()
+
+
+def run_check(args):
+    """
+    Checks saved taxonomic descriptions against the matrix, without any API call.
+    """
+    create_taxongpt(args.config).process_check()
+
+
+def run_all(args):
+    """
+    Generates the taxonomic key and then the taxonomic descriptions, like running TaxonGPT.py directly.
+    """
+    taxon_gpt = create_taxongpt(args.config)
+    taxon_gpt.process_key()
+    taxon_gpt.process_description()
+
+
+def run_dtom(args):
+    """
+    Runs the Description to Matrix (DtoM) script in a working directory holding species_descriptions.txt.
+    """
+    if args.trace:
+        os.environ["DTOM_TRACE_PATH"] = os.path.abspath(args.trace)
+    if args.tile:
+        os.environ["DTOM_EXTRACTION_TILE"] = args.tile
+    if args.tile_token_budget:
+        os.environ["DTOM_TILE_TOKEN_BUDGET"] = str(args.tile_token_budget)
+    if args.workers:
+        os.environ["DTOM_MAX_WORKERS"] = str(args.workers)
+    if args.character_list:
+        os.environ["DTOM_CHARACTER_LIST"] = args.character_list
+    if args.character_chunk_tokens:
+        os.environ["DTOM_CHARACTER_CHUNK_TOKENS"] = str(args.character_chunk_tokens)
+    if args.validation:
+        os.environ["DTOM_VALIDATION"] = args.validation
+    if args.structured:
+        os.environ["DTOM_STRUCTURED_OUTPUT"] = "1"
+    os.chdir(args.workdir)
+    runpy.run_path(DTOM_SCRIPT_PATH, run_name="__main__")
+
+
+def build_parser():
+    """
+    Builds the command line parser.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(description="TaxonGPT command line: taxonomic keys and descriptions from a "
+                                                 "NEXUS matrix, and matrices from descriptions (DtoM).")
+    parser.add_argument("--timing", action="store_true", help="Print the time taken by the command")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    key_parser = subparsers.add_parser("key", help="Generate the taxonomic key")
+    key_parser.add_argument("--resume", action="store_true",
+                            help="Reuse the checkpoints of an interrupted run (needs the \"checkpoint\" section)")
+    key_parser.set_defaults(function=run_key)
+
+    describe_parser = subparsers.add_parser("describe", help="Generate the taxonomic descriptions")
+    describe_parser.set_defaults(function=run_describe)
+
+    check_parser = subparsers.add_parser("check", help="Check saved descriptions against the matrix (no API call)")
+    check_parser.set_defaults(function=run_check)
+
+    all_parser = subparsers.add_parser("all", help="Generate the taxonomic key, then the descriptions")
+    all_parser.set_defaults(function=run_all)
+
+    for subparser in (key_parser, describe_parser, check_parser, all_parser):
+        subparser.add_argument("--config", default="config.json",
+                               help="Configuration file (default: config.json in the current directory)")
+
+    dtom_parser = subparsers.add_parser("dtom", help="Build a matrix from species descriptions (DtoM)")
+    dtom_parser.add_argument("--workdir", default=".",
+                             help="Directory holding species_descriptions.txt, where the NEXUS output is written")
+    dtom_parser.add_argument("--trace", default=None, help="JSONL trace file of the run")
+    dtom_parser.add_argument("--character-list", choices=("single", "map_reduce"), default=None,
+                             help="Generate the character list in one request (default) or from chunks of species "
+                                  "merged locally")
+    dtom_parser.add_argument("--character-chunk-tokens", type=int, default=None,
+                             help="Token budget of the descriptions in a map_reduce chunk (default: 8000)")
+    dtom_parser.add_argument("--tile", choices=("cell", "species", "character", "block"), default=None,
+                             help="Cells extracted per API call (default: cell, one character of one species)")
+    dtom_parser.add_argument("--tile-token-budget", type=int, default=None,
+                             help="Token budget of a block tile (default: 8000)")
+    dtom_parser.add_argument("--workers", type=int, default=None,
+                             help="Species (or tiles) processed at once (default: 1)")
+    dtom_parser.add_argument("--validation", choices=("incremental", "full"), default=None,
+                             help="Re-validate only corrected characters (default) or the whole matrix every round")
+    dtom_parser.add_argument("--structured", action="store_true",
+                             help="Request extraction and validation results as JSON following strict schemas")
+    dtom_parser.set_defaults(function=run_dtom)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    Runs the command line.
+
+    Args:
+        argv (list): The arguments (sys.argv[1:] if None).
+    """
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    args.function(args)
+    if args.timing:
+        print(f"{args.command} finished in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .taxon_matrix import TaxonMatrix
+
+
+class DatasetCache:
+    """
+    Caches parsed datasets on disk, keyed on the SHA-256 of the NEXUS file content, so a second process working
+    on the same matrix skips parsing and knowledge graph construction.
+
+    Each entry is a JSON file with the knowledge graph, taxa, characters and the stamps of the CSV/JSON outputs
+    written from it, plus a .npy file with the bitmask matrix.
+
+    Attributes:
+        cache_dir (str): Directory holding the entries.
+        hits (int): Number of datasets loaded from the cache.
+        misses (int): Number of datasets that had to be parsed.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Opens (or creates) a cache directory.
+
+        Args:
+            cache_dir (str): Path to the cache directory.
+        """
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cache_config):
+        """
+        Creates a cache from the "dataset_cache" configuration section.
+
+        Args:
+            cache_config (dict): The configuration section, or None.
+
+        Returns:
+            DatasetCache: The cache, or None if disabled.
+        """
+        if not cache_config or not cache_config.get("enabled", False):
+            return None
+        return cls(cache_config.get("dir", "dataset_cache"))
+
+    @staticmethod
+    def file_hash(file_path):
+        """
+        Computes the SHA-256 hex digest of a file's content.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def output_stamps(paths):
+        """
+        Returns the (size, modification time) of each existing output file, used to tell whether the outputs
+        written from an entry are still in place.
+        """
+        stamps = {}
+        for path in paths:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                stamps[path] = [stat.st_size, stat.st_mtime_ns]
+        return stamps
+
+    def entry_paths(self, content_hash):
+        """
+        Returns the (JSON, array) file paths of an entry.
+        """
+        base = os.path.join(self.cache_dir, content_hash)
+        return f"{base}.json", f"{base}.npy"
+
+    def load(self, content_hash, output_paths=()):
+        """
+        Loads a parsed dataset.
+
+        Args:
+            content_hash (str): Hash of the NEXUS file content.
+            output_paths (tuple): CSV/JSON output paths that must still hold the outputs written from the entry.
+
+        Returns:
+            tuple: (knowledge_graph, matrix), or None if there is no usable entry.
+        """
+        json_path, array_path = self.entry_paths(content_hash)
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            masks = np.load(array_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Outputs removed or overwritten since the entry was saved are regenerated by a normal parse
+        stamps = self.output_stamps(output_paths)
+        if any(path not in stamps or entry["outputs"].get(path) != stamps[path] for path in output_paths):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry["knowledge_graph"], TaxonMatrix(entry["taxa"], entry["characters"], masks)
+
+    def save(self, content_hash, knowledge_graph, matrix, output_paths=()):
+        """
+        Saves a parsed dataset. Files are written atomically so a crash never leaves a corrupt entry.
+
+        Args:
+            content_hash (str): Hash of the NEXUS file content.
+            knowledge_graph (dict): The knowledge graph.
+            matrix (TaxonMatrix): The bitmask matrix.
+            output_paths (tuple): CSV/JSON output paths written from this dataset.
+        """
+        json_path, array_path = self.entry_paths(content_hash)
+        entry = {
+            "taxa": matrix.taxa,
+            "characters": matrix.characters,
+            "knowledge_graph": knowledge_graph,
+            "outputs": self.output_stamps(output_paths),
+        }
+
+        with open(f"{array_path}.tmp", "wb") as f:
+            np.save(f, matrix.masks)
+        os.replace(f"{array_path}.tmp", array_path)
+
+        with open(f"{json_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(f"{json_path}.tmp", json_path)
@@ -0,0 +1,548 @@
+import json
+import re
+from difflib import SequenceMatcher
+
+from .request_scheduler import count_tokens
+
+NEGATION_WORDS = {"no", "not", "non", "without", "absent", "lacking"}  # Words that reverse the meaning of a text
+NUMBER_WORDS = {"one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+                "eight": "8", "nine": "9", "ten": "10"}
+
+# Output format of tiled extraction requests: one line per cell, keyed by species number and character id
+TILE_LINE_PATTERN = re.compile(r"^\W*species\s*(\d+)\W+character\s*([^\s:*]+)\W*:\s*(.+?)\s*$",
+                               re.IGNORECASE | re.MULTILINE)
+
+
+def normalize_character_text(text):
+    """
+    Normalizes a character or state text for duplicate detection: lowercase words and numbers only, number words
+    as digits and plurals as singulars ("Two spurs." becomes "2 spur").
+
+    Args:
+        text (str): The character or state text.
+
+    Returns:
+        str: The normalized text.
+    """
+    words = []
+    for word in re.findall(r"[a-z0-9]+", str(text).lower()):
+        word = NUMBER_WORDS.get(word, word)
+        words.append(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word)
+    return " ".join(words)
+
+
+def find_matching_text(text, candidates, threshold=0.85):
+    """
+    Finds a near-duplicate of a character or state text. Texts with different numbers or negations
+    ("4 segments" and "five segments", "present" and "not present") never match.
+
+    Args:
+        text (str): The text to look for.
+        candidates (list): The texts already kept.
+        threshold (float): Minimum similarity ratio of the normalized texts (1.0 to only match identical ones).
+
+    Returns:
+        int: The index of the matching candidate, or None.
+    """
+    normalized = normalize_character_text(text)
+    words = set(normalized.split())
+    numbers = re.findall(r"\d+", normalized)
+    best_index, best_ratio = None, threshold
+    for index, candidate in enumerate(candidates):
+        normalized_candidate = normalize_character_text(candidate)
+        if normalized_candidate == normalized:
+            return index
+        if threshold >= 1 or re.findall(r"\d+", normalized_candidate) != numbers \
+                or set(normalized_candidate.split()) & NEGATION_WORDS != words & NEGATION_WORDS:
+            continue
+        ratio = SequenceMatcher(None, normalized, normalized_candidate).ratio()
+        if ratio >= best_ratio:
+            best_index, best_ratio = index, ratio
+    return best_index
+
+
+def state_core(state, character_words):
+    """
+    Returns the part of a state text that tells it apart from the other states of its character: the normalized
+    text without the words of the character description ("spines present" of "spines on the tibia" becomes
+    "present"). Numbers and negations are always kept, and a state made only of character words is kept whole.
+
+    Args:
+        state (str): The state text.
+        character_words (set): The normalized words of the character description.
+
+    Returns:
+        str: The normalized core of the state text.
+    """
+    normalized = normalize_character_text(state)
+    core = [word for word in normalized.split()
+            if word not in character_words or word in NEGATION_WORDS or word.isdigit()]
+    return " ".join(core) if core else normalized
+
+
+def merge_character_lists(character_lists):
+    """
+    Merges the character lists of several chunks into one list in the character_dict format. Characters with
+    near-identical descriptions become one character whose states are the union of their states. A state matches a
+    state from an earlier chunk when the parts of their texts that do not repeat the character description are
+    near-identical, so "spines present" and "present" become one state. Characters and states are renumbered from 1
+    in the order they first appear, and the first wording of each is kept.
+
+    Args:
+        character_lists (list): The character list dictionaries of the chunks.
+
+    Returns:
+        dict: The merged character list.
+    """
+    merged = []
+    for character_list in character_lists:
+        for character in character_list.values():
+            if not isinstance(character, dict) or not str(character.get("description", "")).strip():
+                continue
+            description = str(character["description"]).strip()
+            index = find_matching_text(description, [entry["description"] for entry in merged])
+            if index is None:
+                merged.append({"description": description, "states": []})
+                index = len(merged) - 1
+
+            entry = merged[index]
+            character_words = set(normalize_character_text(f"{entry['description']} {description}").split())
+            cores = [state_core(state, character_words) for state in entry["states"]]
+            unmatched = list(range(len(cores)))  # States of earlier chunks, each absorbing at most one state here
+            for state in (character.get("states") or {}).values():
+                state = str(state).strip()
+                if not state:
+                    continue
+                core = state_core(state, character_words)
+                match = find_matching_text(core, [cores[i] for i in unmatched])
+                if match is not None:
+                    del unmatched[match]
+                elif find_matching_text(core, cores, threshold=1.0) is None:
+                    # States listed together by one chunk are distinct unless identical ("narrow", "narrower")
+                    entry["states"].append(state)
+                    cores.append(core)
+
+    return {str(number): {"description": entry["description"],
+                          "states": {str(state_number): state for state_number, state in enumerate(entry["states"], 1)}}
+            for number, entry in enumerate(merged, 1)}
+
+
+def parse_tile_lines(tile_response, species_indexes, character_ids):
+    """
+    Parses the text response of a tiled extraction request, one "species{n} character{id}: state" line per cell.
+    Lines of species or characters outside the tile are ignored and only the first line of a repeated cell is
+    kept; cells without a line are left out, to be extracted again on their own.
+
+    Args:
+        tile_response (str): The response text.
+        species_indexes (set): The 0-based indexes of the species in the tile.
+        character_ids (set): The character IDs in the tile, as strings.
+
+    Returns:
+        dict: (species index, character ID) mapped to the state in the per-cell format
+            "character{character_id}: stateX (state description)".
+    """
+    states = {}
+    for species_number, character_id, state in TILE_LINE_PATTERN.findall(tile_response):
+        index = int(species_number) - 1
+        if index in species_indexes and character_id in character_ids:
+            states.setdefault((index, character_id), f"character{character_id}: {state}")
+    return states
+
+
+def plan_extraction_tiles(descriptions, character_dict, tile="species", token_budget=8000):
+    """
+    Splits the species x character cells into extraction tiles.
+
+    Args:
+        descriptions (list): The species descriptions.
+        character_dict (dict): The character list.
+        tile (str): "species" (all characters of one species), "character" (one character across all species)
+                    or "block" (species and characters packed into token_budget tokens).
+        token_budget (int): Prompt plus expected output tokens of a "block" tile.
+
+    Returns:
+        list: (species indexes, character IDs) tiles covering every cell once.
+    """
+    species_indexes = list(range(len(descriptions)))
+    character_ids = list(character_dict)
+    if tile == "species":
+        return [([index], character_ids) for index in species_indexes]
+    if tile == "character":
+        return [(species_indexes, [character_id]) for character_id in character_ids]
+
+    # Block tiles: descriptions take up to half of the budget, characters and their answers (about 30 tokens
+    # per cell) the rest
+    description_tokens = [count_tokens(description) for description in descriptions]
+    character_tokens = {character_id: count_tokens(json.dumps(character_dict[character_id])) + 10
+                        for character_id in character_ids}
+
+    species_groups, group, group_tokens = [], [], 0
+    for index in species_indexes:
+        if group and group_tokens + description_tokens[index] > token_budget // 2:
+            species_groups.append(group)
+            group, group_tokens = [], 0
+        group.append(index)
+        group_tokens += description_tokens[index]
+    if group:
+        species_groups.append(group)
+
+    tiles = []
+    for species_group in species_groups:
+        available = token_budget - sum(description_tokens[index] for index in species_group)
+        characters, used = [], 0
+        for character_id in character_ids:
+            cost = character_tokens[character_id] + 30 * len(species_group)
+            if characters and used + cost > available:
+                tiles.append((species_group, characters))
+                characters, used = [], 0
+            characters.append(character_id)
+            used += cost
+        if characters:
+            tiles.append((species_group, characters))
+    return tiles
+
+
+def parse_structured_state(entry):
+    """
+    Checks one structured extraction result ({"character_id", "states", "missing"}) and returns it with the state
+    numbers only, e.g. "state2" becomes "2".
+
+    Raises:
+        ValueError: If the entry does not follow the schema.
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get("states"), list) \
+            or not isinstance(entry.get("missing"), bool):
+        raise ValueError(f"Invalid structured character state: {entry}")
+    states = []
+    for state in entry["states"]:
+        number = re.search(r"\d+", str(state))
+        if number:
+            states.append(number.group(0))
+    return {"character_id": str(entry.get("character_id", "")), "states": states, "missing": entry["missing"]}
+
+
+def format_matrix_cell(states, missing=False):
+    """
+    Formats state numbers as a matrix cell: "2" for one state, "(1 2)" for several, "-" when missing or empty.
+    """
+    numbers = sorted({int(state) for state in states if str(state).isdigit()})
+    if missing or not numbers:
+        return "-"
+    if len(numbers) == 1:
+        return str(numbers[0])
+    return f"({' '.join(map(str, numbers))})"
+
+
+def parse_to_matrix(character_dict):
+    """
+    Parses the extracted result in dictionary format and converts it into a matrix format.
+    Adds exception handling to ensure robustness.
+    """
+    # Initialize an empty matrix row to represent the character states for the species
+    matrix_row = []
+
+    # Iterate through the dictionary of extracted results
+    for character_id, character_state in character_dict.items():
+        # Structured results already hold the state numbers
+        if isinstance(character_state, dict):
+            matrix_row.append(format_matrix_cell(character_state["states"], character_state["missing"]))
+            continue
+
+        # Handle potential None or non-string values
+        if not isinstance(character_state, str):
+            matrix_row.append('-')  # If character_state is invalid, mark it as missing
+            continue
+
+        # Prioritize matching 'stateX' and extract X
+        states = re.findall(r'state(\d+)', character_state)  # Extract the number following 'stateX'
+
+        # If no 'stateX' is found, attempt to match other valid individual state numbers
+        if not states:
+            states = re.findall(r'(?<![A-Z])\b\d+\b(?![A-Z])', character_state)  # Match other state numbers, excluding those surrounded by letters
+
+        # If multiple states are found, sort them and add parentheses
+        if len(states) > 1:
+            sorted_states = sorted(map(int, states))  # Sort the numbers
+            combined_state = f"({' '.join(map(str, sorted_states))})"
+            matrix_row.append(combined_state)
+        elif len(states) == 1:
+            # If there is only one state, do not add parentheses
+            matrix_row.append(states[0])
+        else:
+            # If no state is found, mark as missing with '-'
+            matrix_row.append('-')
+
+    # Format the matrix row into a string similar to "species: 1 (12) 1 1"
+    matrix_str = " ".join(matrix_row)
+
+    return matrix_str
+
+
+def parse_structured_tile(tile_response, species_indexes, character_ids):
+    """
+    Parses the JSON response of a structured tiled extraction request ({"cells": [...]}, following
+    character_state_tile_schema). Invalid cells and cells outside the tile are ignored, and only the first entry of
+    a repeated cell is kept; cells left out are extracted again on their own.
+
+    Args:
+        tile_response (str): The response text.
+        species_indexes (set): The 0-based indexes of the species in the tile.
+        character_ids (set): The character IDs in the tile, as strings.
+
+    Returns:
+        dict: (species index, character ID) mapped to the {"character_id", "states", "missing"} state, or an empty
+            dictionary if the response is not valid JSON.
+    """
+    try:
+        entries = json.loads(tile_response)["cells"]
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Invalid structured tile result: {e}")
+        return {}
+
+    states = {}
+    for entry in entries:
+        try:
+            state = parse_structured_state(entry)
+            index = int(entry["species"]) - 1
+        except (ValueError, KeyError, TypeError):
+            continue  # The cell is extracted again on its own
+        if index in species_indexes and state["character_id"] in character_ids:
+            states.setdefault((index, state["character_id"]), state)
+    return states
+
+
+def parse_validation_response(api_response, structured=False):
+    """
+    Parses a validation response into the parse_api_response format. Structured responses are read as JSON, with
+    the expected state numbers kept in "Expected States"; a response that is not valid JSON is parsed as text.
+
+    Args:
+        api_response (str): The raw response string from the API.
+        structured (bool): Whether the response was requested as JSON following matrix_validation_schema.
+
+    Returns:
+        dict: A dictionary containing the species name and a list of character validation reports.
+    """
+    if not structured:
+        return parse_api_response(api_response)
+
+    try:
+        result = json.loads(api_response)
+        character_reports = []
+        for entry in result["characters"]:
+            expected_states = [re.search(r"\d+", str(state)).group(0) for state in entry["expected_states"]
+                               if re.search(r"\d+", str(state))]
+            character_reports.append({
+                "Character ID": int(re.search(r"\d+", str(entry["character_id"])).group(0)),
+                "Matrix State": entry["matrix_state"],
+                "Expected State": " or ".join(expected_states) or "-",
+                "Expected States": expected_states,
+                "Result": entry["result"],
+            })
+        return {"Species": result["species"], "Character Validation Report": character_reports}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"Invalid structured validation result ({e}), parsing it as text.")
+        return parse_api_response(api_response)
+
+
+def parse_api_response(api_response: str):
+    """
+    Parses the API response to extract species name and character validation reports.
+
+    Args:
+        api_response (str): The raw response string from the API.
+
+    Returns:
+        dict: A dictionary containing the species name and a list of character validation reports.
+    """
+    # Clean the response by removing surrounding code markers and whitespace
+    api_response = api_response.strip("```").strip()
+
+    # Initialize variables to store species name and character reports
+    species_name = None
+    character_reports = []
+    current_report = {}
+
+    # Split the response into lines for processing
+    lines = api_response.split('\n')
+
+    # Iterate through each line to extract relevant information
+    for line in lines:
+        line = line.strip()
+
+        # Extract the species name
+        if line.startswith("Species:"):
+            species_name = line.split(":", 1)[1].strip()
+
+        # Handle character validation report blocks
+        elif re.match(r"^- Character \d+:", line):
+            # Save the current report if it exists and start a new one
+            if current_report:
+                character_reports.append(current_report)
+                current_report = {}
+
+            # Extract character ID and description
+            match = re.match(r"^- Character (\d+): (.+)", line)
+            if match:
+                current_report["Character ID"] = int(match.group(1))
+                current_report["Character Description"] = match.group(2).strip()
+
+        # Extract matrix state
+        elif line.startswith("Matrix State:"):
+            current_report["Matrix State"] = line.split(":", 1)[1].strip()
+
+        # Extract expected state
+        elif line.startswith("Expected State:"):
+            current_report["Expected State"] = line.split(":", 1)[1].strip()
+
+        # Extract validation result
+        elif line.startswith("Result:"):
+            current_report["Result"] = line.split(":", 1)[1].strip()
+
+        # Extract suggestions for corrections
+        elif line.startswith("Suggestion:"):
+            current_report["Suggestion"] = line.split(":", 1)[1].strip()
+
+    # Append the last report if it exists
+    if current_report:
+        character_reports.append(current_report)
+
+    # Return the parsed results as a dictionary
+    return {
+        "Species": species_name,
+        "Character Validation Report": character_reports,
+    }
+
+
+def parse_matrix(matrix):
+    """
+    Parses the matrix string into a list of individual elements or groups of elements.
+    Groups are identified by parentheses, while other elements are separated by spaces.
+    """
+    matrix = re.findall(r'\([^\)]+\)|\S+', matrix)  # Match groups in parentheses or standalone elements
+    return matrix
+
+
+def extract_state(expected_state):
+    """
+    Extracts the numeric state from an expected state string.
+
+    Args:
+        expected_state (str): The expected state string, possibly containing a number.
+
+    Returns:
+        str: The extracted numeric state, or the original state if no number is found.
+    """
+    # Search for a numeric value in the expected state string
+    match = re.search(r'\d+', expected_state.strip())
+    return match.group(0) if match else expected_state
+
+
+def expected_matrix_cell(report):
+    """
+    Gets the corrected matrix cell suggested by a character validation report.
+
+    Args:
+        report (dict): One character validation report.
+
+    Returns:
+        str: The expected state, as a matrix cell.
+    """
+    if report.get("Expected States"):
+        # Structured reports give every expected state number
+        return format_matrix_cell(report["Expected States"])
+    expected_states = report.get("Expected State", "-").split(" or ")  # Split expected states
+    return extract_state(expected_states[0])  # Use the first expected state
+
+
+def check_matrix_cell(cell, character_info):
+    """
+    Checks one matrix cell against the states of its character: the cell must be "-" (missing), a state number of
+    the character, or several state numbers in parentheses.
+
+    Args:
+        cell (str): The matrix cell.
+        character_info (dict): The description and states of the character.
+
+    Returns:
+        tuple: The cell in matrix form (invalid states dropped, "-" if nothing valid is left) and a description of
+        the problem found, or None if the cell is valid.
+    """
+    cell = cell.strip()
+    if cell in ("-", "?"):
+        return "-", None
+    if not re.fullmatch(r"\d+|\(\s*\d+(?:\s+\d+)*\s*\)", cell):
+        # Words ("Missing", "Not Applicable") or gaps mixed with states cannot be written to the matrix
+        return "-", f"unparsed cell {cell!r}"
+
+    states = re.findall(r"\d+", cell)
+    valid_states = {str(state) for state in (character_info.get("states") or {})}
+    invalid_states = [state for state in states if valid_states and state not in valid_states]
+    if invalid_states:
+        valid_cell = format_matrix_cell([state for state in states if state not in invalid_states])
+        return valid_cell, f"state {', '.join(invalid_states)} out of range"
+    return format_matrix_cell(states), None
+
+
+def check_matrix_locally(matrix, character_list):
+    """
+    Checks a matrix row against the character list: one valid cell per character.
+
+    Args:
+        matrix (str): The matrix row.
+        character_list (dict): The character list.
+
+    Returns:
+        tuple: The list of checked cells, one per character, and a {character_id: problem} dictionary.
+    """
+    cells = parse_matrix(matrix)
+    problems = {}
+    if len(cells) != len(character_list):
+        problems["matrix"] = f"{len(cells)} cells for {len(character_list)} characters"
+        cells = (cells + ["-"] * len(character_list))[:len(character_list)]
+
+    checked_cells = []
+    for cell, (character_id, character_info) in zip(cells, character_list.items()):
+        checked_cell, problem = check_matrix_cell(cell, character_info)
+        if problem:
+            problems[character_id] = problem
+        checked_cells.append(checked_cell)
+    return checked_cells, problems
+
+
+def apply_validation_corrections(reports, cells, character_list, checked_ids, tried_cells):
+    """
+    Applies the corrections of one validation round to the matrix cells. A correction is applied only to a character
+    validated in the round, at most once per character, and only if it is a valid cell of the character that has not
+    been tried before, so an out-of-range state or a cell the validator already rejected is never written back.
+
+    Args:
+        reports (list): The character validation reports of the round.
+        cells (list): The matrix cells, one per character of character_list; corrected in place.
+        character_list (dict): The character list.
+        checked_ids (list): The IDs of the characters validated in the round.
+        tried_cells (dict): For each character ID, the cells already in the matrix or rejected; updated in place.
+
+    Returns:
+        list: The IDs of the corrected characters, to be validated again.
+    """
+    character_ids = list(character_list)
+    corrected_characters = []
+    for report in reports:
+        character_id = str(report.get("Character ID"))
+        if report.get("Result") != "Error" or character_id not in checked_ids \
+                or character_id in corrected_characters:
+            continue
+
+        expected_cell, problem = check_matrix_cell(expected_matrix_cell(report), character_list[character_id])
+        if problem:
+            print(f"Rejected correction of character {character_id}: {problem}")
+            continue
+        if expected_cell in tried_cells[character_id]:
+            continue  # Already in the matrix or already rejected by the validator
+
+        tried_cells[character_id].add(expected_cell)
+        cells[character_ids.index(character_id)] = expected_cell
+        corrected_characters.append(character_id)
+    return corrected_characters
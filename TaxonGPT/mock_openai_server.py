@@ -0,0 +1,852 @@
+import argparse
+import email
+import email.policy
+import hashlib
+import itertools
+import json
+import random
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+if __name__ == "__main__" and not __package__:
+    # Run as a script ("python TaxonGPT/mock_openai_server.py"): import the TaxonGPT package from the repository root
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    __package__ = "TaxonGPT"
+
+from .nexus_parser import parse_nexus_file
+from .split_engine import SplitEngine
+from .taxon_matrix import TaxonMatrix
+
+JSON_KEY_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:')
+
+
+def echo_responder(body):
+    """
+    Default responder: answers every chat completion with a deterministic echo of the last user message.
+
+    Args:
+        body (dict): The chat completion request body.
+
+    Returns:
+        str: The assistant message content.
+    """
+    user_messages = [m["content"] for m in body.get("messages", []) if m.get("role") == "user"]
+    last_message = user_messages[-1] if user_messages else ""
+    return f"Mock response to: {last_message[:200]}"
+
+
+def request_rng(seed, *parts):
+    """
+    Returns a random generator seeded from a seed and request data, so the same request always gets the same
+    answer, whatever the order requests arrive in.
+    """
+    digest = hashlib.sha256(json.dumps([seed, *parts], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+class TaxonomyResponder:
+    """
+    Deterministic responder answering the TaxonGPT and DtoM prompts from a dataset's matrix and character_info.json,
+    so whole pipelines can be run and benchmarked offline. The kind of request is recognised from its content:
+
+    - structured classification (a "json_schema" response format): the best local split, in schema form.
+    - JSON formatting (a message holding a {"Character", "States"} result): the JSON itself.
+    - classification and correction (taxa of the matrix given as JSON keys or compact rows): the split engine's
+      classification, a single split for the whole dataset and the nested tree for smaller groups.
+    - DtoM character list, state extraction (per cell or tiled) and matrix validation requests.
+    - description (a taxon named in free text): a description ending in a "#### List Form:" section.
+    - packed description (asking for "=== END SPECIES ===" delimiters): one delimited description per taxon.
+
+    With a mistake_rate, that fraction of classification, description and extraction answers contains one wrong
+    state, chosen per request from the seed, to exercise the correction paths. Validation answers are always right.
+
+    Attributes:
+        matrix (TaxonMatrix): The dataset.
+        character_info (dict): Character number to {"description": ..., "states": {state: text}}.
+        split_engine (SplitEngine): Local split engine over the matrix.
+        mistake_rate (float): Fraction of answers containing a wrong state.
+        seed (int): Seed of the mistakes.
+    """
+
+    def __init__(self, matrix, character_info, mistake_rate=0.0, seed=0):
+        """
+        Initializes the responder.
+
+        Args:
+            matrix (TaxonMatrix): The dataset.
+            character_info (dict): The character information.
+            mistake_rate (float): Fraction of answers containing a wrong state.
+            seed (int): Seed of the mistakes.
+        """
+        self.matrix = matrix
+        self.character_info = character_info
+        self.split_engine = SplitEngine(matrix.taxa, matrix.characters, matrix.masks)
+        self.mistake_rate = mistake_rate
+        self.seed = seed
+
+        # Taxon names as they appear in free text: underscores read as spaces, and long names by their first two words
+        self.name_patterns = []
+        for taxon in matrix.taxa:
+            words = taxon.replace("_", " ").split()
+            for name in {" ".join(words), " ".join(words[:2])}:
+                self.name_patterns.append((re.compile(rf"(?<!\w){re.escape(name)}(?!\w)"), len(name), taxon))
+
+    @classmethod
+    def from_files(cls, nexus_file_path, character_file_path, mistake_rate=0.0, seed=0):
+        """
+        Creates a responder from a NEXUS file and its character_info.json.
+
+        Args:
+            nexus_file_path (str): Path to the NEXUS file.
+            character_file_path (str): Path to the character information file (generic labels if None).
+            mistake_rate (float): Fraction of answers containing a wrong state.
+            seed (int): Seed of the mistakes.
+
+        Returns:
+            TaxonomyResponder: The responder.
+        """
+        rows, _ = parse_nexus_file(nexus_file_path)
+        character_info = {}
+        if character_file_path:
+            with open(character_file_path, "r", encoding="utf-8") as f:
+                character_info = json.load(f)
+        return cls(TaxonMatrix.from_rows(rows), character_info, mistake_rate=mistake_rate, seed=seed)
+
+    def __call__(self, body):
+        """
+        Answers a chat completion request.
+
+        Args:
+            body (dict): The chat completion request body.
+
+        Returns:
+            str: The assistant message content.
+        """
+        user_messages = [m["content"] for m in body.get("messages", []) if m.get("role") == "user"]
+        text = str(user_messages[-1]) if user_messages else ""
+        rng = request_rng(self.seed, body.get("messages"))
+
+        if "=== END SPECIES ===" in text:
+            species_data = "\n".join(str(m) for m in user_messages[:-1])
+            return self.describe_packed(self.taxa_in_matrix_text(species_data), rng)
+        response_format = body.get("response_format") or {}
+        structured = response_format.get("type") == "json_schema"
+        schema_name = (response_format.get("json_schema") or {}).get("name") if structured else None
+        if "taxonomic descriptions of the species:" in text and "Possible states:" in text:
+            return self.extract_tile(text, rng, structured)
+        if "Character description:" in text and "Possible states:" in text:
+            return self.extract_state(text, rng, structured)
+        if "Character List:" in text and "Matrix:" in text:
+            return self.validate_matrix(text, structured)
+        if structured and schema_name in (None, "classification"):
+            return self.structured_classification(self.taxa_in_matrix_text(text) or self.matrix.taxa, rng)
+
+        result = self.classification_in_text(text)
+        if result is not None:
+            return json.dumps(result, ensure_ascii=False)
+
+        taxa = self.taxa_in_matrix_text(text)
+        if taxa:
+            return self.classify(taxa, rng)
+        if "character list" in text.lower():
+            return self.character_list(text)
+
+        taxon = self.find_taxon(text)
+        if taxon is not None:
+            return self.describe(taxon, rng)
+        return echo_responder(body)
+
+    def character_number(self, character):
+        """
+        Returns the number of a character ("12" for "Character12"), the key used in character_info.json.
+        """
+        return character[len("Character"):] if character.startswith("Character") else character
+
+    def character_description(self, character):
+        """
+        Returns the description of a character from character_info.json.
+        """
+        info = self.character_info.get(self.character_number(character), {})
+        return info.get("description", character)
+
+    def state_description(self, character, state):
+        """
+        Returns the description of a state, without bracketed numbers that could be read as state numbers.
+        """
+        info = self.character_info.get(self.character_number(character), {})
+        return re.sub(r"\((\d+)\)", r"\1", info.get("states", {}).get(state, f"state {state}"))
+
+    def taxa_in_matrix_text(self, text):
+        """
+        Returns the taxa of the matrix that appear as JSON keys or compact matrix rows in a prompt, in matrix order.
+        """
+        found = set()
+        for quoted in JSON_KEY_PATTERN.findall(text):
+            try:
+                found.add(json.loads(f'"{quoted}"'))
+            except ValueError:
+                continue
+        found.update(line.split("|", 1)[0].strip() for line in text.splitlines() if "|" in line)
+        return [taxon for taxon in self.matrix.taxa if taxon in found]
+
+    def find_taxon(self, text):
+        """
+        Finds the taxon a free-text prompt is about: the one named first (the longest name on ties).
+
+        Returns:
+            str: The taxon, or None if no taxon is named.
+        """
+        text = text.replace("_", " ")
+        best = None
+        for pattern, length, taxon in self.name_patterns:
+            match = pattern.search(text)
+            if match and (best is None or (match.start(), -length) < best[:2]):
+                best = (match.start(), -length, taxon)
+        return best[2] if best else None
+
+    def classification_in_text(self, text):
+        """
+        Returns the {"Character", "States"} result held in a JSON formatting request, or None.
+        """
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            result = json.loads(match.group(0))
+        except ValueError:
+            return None
+        if isinstance(result, dict) and "Character" in result and "States" in result and "InformationGain" not in result:
+            return result
+        return None
+
+    def split(self, taxa):
+        """
+        Returns the best split of a group, or the whole group under one state if no character separates it.
+        """
+        split = self.split_engine.best_split(taxa)
+        if split is None:
+            character = self.matrix.characters[0]
+            split = {"Character": character, "States": self.split_engine.partition(taxa, character)}
+        return split
+
+    def misplace(self, result, rng):
+        """
+        With probability mistake_rate, moves one species of a classification result to another state.
+        """
+        flat_states = [state for state, members in result["States"].items() if isinstance(members, list)]
+        if rng.random() >= self.mistake_rate or len(flat_states) < 2:
+            return result
+
+        source = rng.choice(flat_states)
+        target = rng.choice([state for state in flat_states if state != source])
+        species = rng.choice(result["States"][source])
+        result["States"][source] = [s for s in result["States"][source] if s != species]
+        result["States"][target] = result["States"][target] + [species]
+        if not result["States"][source]:
+            del result["States"][source]
+        return result
+
+    def classify(self, taxa, rng):
+        """
+        Answers a classification or correction request: a single split for the whole dataset (the initial request),
+        the nested classification for smaller groups.
+        """
+        if len(taxa) == len(self.matrix.taxa):
+            result = self.split(taxa)
+        else:
+            result = self.split_engine.build_classification(taxa)
+            if not isinstance(result, dict):
+                result = self.split(taxa)
+
+        result = self.misplace(result, rng)
+        return (f"The group is best divided by {result['Character']} "
+                f"({self.character_description(result['Character'])}).\n"
+                f"Result:\n```json\n{json.dumps(result, ensure_ascii=False, indent=2)}\n```")
+
+    def structured_classification(self, taxa, rng):
+        """
+        Answers a structured classification request with the best split in the CLASSIFICATION_SCHEMA form.
+        """
+        result = self.misplace(self.split(taxa), rng)
+        return json.dumps({
+            "Character": result["Character"],
+            "States": [{"State": state, "Species": members} for state, members in result["States"].items()],
+        }, ensure_ascii=False)
+
+    def describe(self, taxon, rng):
+        """
+        Answers a description request with a short description and a "List Form" section giving every state.
+        """
+        states = {character: self.matrix.state_list(taxon, character) for character in self.matrix.characters}
+
+        if rng.random() < self.mistake_rate:
+            candidates = [c for c in self.matrix.characters if all(s.isdigit() for s in states[c])
+                          and len(self.character_info.get(self.character_number(c), {}).get("states", {})) > 1]
+            if candidates:
+                character = rng.choice(candidates)
+                options = self.character_info[self.character_number(character)]["states"]
+                states[character] = [rng.choice([s for s in options if s not in states[character]] or list(options))]
+
+        sentences, list_form = [], []
+        for character in self.matrix.characters:
+            numbered = [s for s in states[character] if s.isdigit()]
+            if numbered:
+                value = " or ".join(f"{self.state_description(character, s)} ({s})" for s in numbered)
+                sentences.append(f"{self.character_description(character).rstrip('.')}: "
+                                 f"{' or '.join(self.state_description(character, s) for s in numbered)}.")
+            else:
+                value = " and ".join(states[character]) or "Missing"
+            list_form.append(f"{self.character_number(character)}. {self.character_description(character)}: {value}")
+
+        return (f"### {taxon}\n\n#### Natural Language Description:\n{' '.join(sentences)}\n\n"
+                f"#### List Form:\n" + "\n".join(list_form))
+
+    def describe_packed(self, taxa, rng):
+        """
+        Answers a packed description request with one delimited description per taxon. With a mistake_rate, that
+        fraction of answers also leaves out one taxon's section, to exercise the individual retries.
+        """
+        if len(taxa) > 1 and rng.random() < self.mistake_rate:
+            taxa = [taxon for taxon in taxa if taxon != rng.choice(taxa)]
+        return "\n\n".join(f"=== SPECIES: {taxon} ===\n{self.describe(taxon, rng)}\n=== END SPECIES ==="
+                           for taxon in taxa)
+
+    def character_list(self, text=""):
+        """
+        Answers the DtoM character list request with character_info.json. A request naming only some of the taxa
+        (a map-reduce chunk) gets the characters with a known state in those taxa, renumbered from 1.
+        """
+        named = {taxon for pattern, _, taxon in self.name_patterns if pattern.search(text.replace("_", " "))}
+        character_info = self.character_info
+        if named and len(named) < len(self.matrix.taxa):
+            observed = [info for number, info in self.character_info.items()
+                        if any(state.isdigit() for taxon in named
+                               for state in self.matrix.state_list(taxon, f"Character{number}"))]
+            character_info = {str(number): info for number, info in enumerate(observed, 1)}
+        return f"```json\n{json.dumps(character_info, indent=4, ensure_ascii=False)}\n```"
+
+    def character_for_description(self, description):
+        """
+        Returns the number of the character with a given description in character_info.json, or None.
+        """
+        return next((n for n, info in self.character_info.items()
+                     if info.get("description", "").strip() == description.strip()), None)
+
+    def cell_states(self, taxon, number, rng):
+        """
+        Returns the states of one cell for a DtoM extraction answer: state numbers, ["Missing"] or
+        ["Not Applicable"].
+        """
+        character = f"Character{number}"
+        if number is None or taxon is None or character not in self.matrix.character_index:
+            return ["Missing"]
+
+        states = self.matrix.state_list(taxon, character)
+        options = self.character_info[number].get("states", {})
+        if states and all(s.isdigit() for s in states) and len(options) > 1 and rng.random() < self.mistake_rate:
+            states = [rng.choice([s for s in options if s not in states] or list(options))]
+        return states or ["Missing"]
+
+    def cell_state(self, taxon, number, rng, structured=False):
+        """
+        Returns the DtoM answer for one cell: "stateX (state description)", "Missing (?)" or "Not Applicable (-)",
+        or a {"states", "missing"} dictionary for structured requests.
+        """
+        states = self.cell_states(taxon, number, rng)
+        if structured:
+            numbered = [s for s in states if s.isdigit()]
+            return {"states": numbered, "missing": not numbered}
+        if states == ["Missing"]:
+            return "Missing (?)"
+        if states == ["Not Applicable"]:
+            return "Not Applicable (-)"
+        return " and ".join(f"state{s} ({self.state_description(f'Character{number}', s)})"
+                            for s in states if s.isdigit())
+
+    def extract_state(self, text, rng, structured=False):
+        """
+        Answers a DtoM extraction request ("character{id}: stateX (state description)", or the character_state
+        JSON schema).
+        """
+        match = re.search(r"Character description:\s*(.*?)\s*Possible states:", text, re.DOTALL)
+        number = self.character_for_description(match.group(1) if match else "")
+        taxon = self.find_taxon(text.split("taxonomic description:", 1)[-1])
+        if structured:
+            return json.dumps({"character_id": number or "", **self.cell_state(taxon, number, rng, True)})
+        return f"character{number or ''}: {self.cell_state(taxon, number, rng)}"
+
+    def extract_tile(self, text, rng, structured=False):
+        """
+        Answers a DtoM tiled extraction request with one "species{n} character{id}: ..." line per cell, or the
+        character_state_tile JSON schema.
+        """
+        characters_text, species_text = text.split("taxonomic descriptions of the species:", 1)
+        characters = re.findall(r"^\s*Character (\S+): (.*?)\s*$\s*^\s*Possible states:", characters_text,
+                                re.MULTILINE)
+        species = re.split(r"^\s*Species (\d+):\s*$", species_text, flags=re.MULTILINE)
+
+        lines, cells = [], []
+        for species_number, description in zip(species[1::2], species[2::2]):
+            taxon = self.find_taxon(description)
+            for character_id, character_description in characters:
+                number = self.character_for_description(character_description)
+                if structured:
+                    cells.append({"species": int(species_number), "character_id": character_id,
+                                  **self.cell_state(taxon, number, rng, True)})
+                else:
+                    lines.append(f"species{species_number} character{character_id}: "
+                                 f"{self.cell_state(taxon, number, rng)}")
+        return json.dumps({"cells": cells}) if structured else "\n".join(lines)
+
+    def validate_matrix(self, text, structured=False):
+        """
+        Answers a DtoM validation request with a report comparing each matrix cell with the dataset, as text or in
+        the matrix_validation JSON schema. The characters of the request's character list are matched with the
+        dataset by description, and a matrix of labelled cells ("Character 3: 2; Character 7: (1 2)") is validated
+        for those characters only.
+        """
+        description, matrix_text = text.split("Character List:", 1)[0], text.rsplit("Matrix:", 1)[1]
+        try:
+            character_list = json.loads(text.split("Character List:", 1)[1].rsplit("Matrix:", 1)[0])
+        except ValueError:
+            character_list = self.character_info
+        labelled_cells = re.findall(r"Character (\S+): (\([^\)]+\)|[^\s;]+)", matrix_text)
+        if labelled_cells:
+            cells = dict(labelled_cells)
+        else:
+            cells = dict(zip(character_list, re.findall(r"\([^\)]+\)|\S+", matrix_text)))
+        taxon = self.find_taxon(description)
+
+        lines = [f"Species: {taxon or 'Unknown'}", "Character Validation Report:"]
+        reports = []
+        for number, info in character_list.items():
+            if labelled_cells and number not in cells:
+                continue
+            character = f"Character{self.character_for_description(info.get('description', '')) or number}"
+            cell = cells.get(number, "?")
+            expected = self.matrix.state_list(taxon, character) if taxon else []
+            numbered = [s for s in expected if s.isdigit()]
+
+            if numbered:
+                expected_state = numbered[0] if len(numbered) == 1 else f"({' '.join(numbered)})"
+                result = "Correct" if set(re.findall(r"\d+", cell)) == set(numbered) else "Error"
+            elif expected == ["Not Applicable"]:
+                expected_state, result = "-", "Not Applicable"
+            else:
+                expected_state, result = "?", "Missing"
+
+            reports.append({"character_id": number, "matrix_state": cell, "expected_states": numbered,
+                            "result": result})
+            lines += [f"- Character {number}: {info.get('description', character)}",
+                      f"  Matrix State: {cell}",
+                      f"  Expected State: {expected_state}",
+                      f"  Result: {result}"]
+        if structured:
+            return json.dumps({"species": taxon or "Unknown", "characters": reports}, ensure_ascii=False)
+        return "\n".join(lines)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the subset of the OpenAI API used by TaxonGPT (chat completions, files and batches).
+    Point the client at it with the "base_url" config entry, e.g. "http://127.0.0.1:8000/v1", or the
+    OPENAI_BASE_URL environment variable for DtoM and the simulation scripts.
+
+    Chat completions can be slowed down and made to fail, to measure client overhead and throttling behaviour:
+    every request waits "latency" seconds plus "latency_per_token" per completion token, an "error_rate" fraction
+    of requests fails with "error_status" (429 responses carry a Retry-After header), and requests beyond
+    "max_concurrency" in flight are rejected with 429. Which requests fail is decided from the seed, the request
+    body and the attempt number, so runs are reproducible.
+
+    Attributes:
+        responder (callable): Function mapping a chat completion request body to the response text.
+        batch_delay (float): Seconds a submitted batch stays "in_progress" before it completes.
+        latency (float): Seconds added to every chat completion.
+        latency_per_token (float): Seconds added per completion token.
+        error_rate (float): Fraction of chat completions answered with an error.
+        error_status (int): HTTP status of injected errors.
+        retry_after (float): Seconds advertised in the Retry-After header of 429 responses.
+        max_concurrency (int): Chat completions allowed in flight at once (no limit if None).
+        seed (int): Seed of the injected errors.
+        stats (dict): Numbers of chat completion requests, injected errors and concurrency rejections.
+        prefix_cache (set): Hashes of the message prefixes seen so far, used to emulate prompt caching.
+        files (dict): Uploaded and generated files, keyed by file id.
+        batches (dict): Submitted batches, keyed by batch id.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, responder=echo_responder, batch_delay=0.0, latency=0.0, latency_per_token=0.0,
+                 error_rate=0.0, error_status=429, retry_after=1.0, max_concurrency=None, seed=0):
+        """
+        Initializes the server.
+
+        Args:
+            address (tuple): (host, port) to listen on. Port 0 picks a free port.
+            responder (callable): Function mapping a chat completion request body to the response text.
+            batch_delay (float): Seconds a submitted batch stays "in_progress" before it completes.
+            latency (float): Seconds added to every chat completion.
+            latency_per_token (float): Seconds added per completion token.
+            error_rate (float): Fraction of chat completions answered with an error.
+            error_status (int): HTTP status of injected errors, e.g. 429, 500 or 503.
+            retry_after (float): Seconds advertised in the Retry-After header of 429 responses.
+            max_concurrency (int): Chat completions allowed in flight at once (no limit if None).
+            seed (int): Seed of the injected errors.
+        """
+        super().__init__(address, MockOpenAIHandler)
+        self.responder = responder
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency
+        self.seed = seed
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._attempts = {}  # Number of times each distinct request body has been received
+        self._in_flight = 0
+        self.prefix_cache = set()
+
+    @property
+    def base_url(self):
+        """
+        Returns:
+            str: The base URL to configure the OpenAI client with.
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def new_id(self, prefix):
+        """
+        Returns a fresh object id such as "file-3" or "batch_4".
+        """
+        return f"{prefix}{next(self._ids)}"
+
+    def complete(self, body):
+        """
+        Builds a chat completion response object for a request body.
+
+        Args:
+            body (dict): The chat completion request body.
+
+        Returns:
+            dict: The chat completion response.
+        """
+        content = self.responder(body)
+        message_tokens = [len(str(m.get("content", "")).split()) for m in body.get("messages", [])]
+        prompt_tokens = sum(message_tokens)
+        completion_tokens = len(content.split())
+        cached_tokens = self.cached_prefix_tokens(body.get("messages", []), message_tokens)
+        return {
+            "id": self.new_id("chatcmpl-"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def cached_prefix_tokens(self, messages, message_tokens):
+        """
+        Emulates the provider's prompt caching: the longest run of leading messages already seen in an earlier
+        request counts as cached, in blocks of 128 tokens, for prompts of at least 1024 tokens.
+
+        Args:
+            messages (list): The request messages.
+            message_tokens (list): The token count of each message.
+
+        Returns:
+            int: The number of cached prompt tokens.
+        """
+        digest = hashlib.sha256()
+        prefix_hashes = []
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            prefix_hashes.append(digest.copy().hexdigest())
+
+        cached_tokens = 0
+        with self.lock:
+            for i, prefix_hash in enumerate(prefix_hashes):
+                if prefix_hash not in self.prefix_cache:
+                    break
+                cached_tokens = sum(message_tokens[:i + 1])
+            self.prefix_cache.update(prefix_hashes)
+
+        if sum(message_tokens) < 1024:
+            return 0
+        return cached_tokens // 128 * 128
+
+    def error_response(self, status, message):
+        """
+        Builds an error response in the OpenAI format.
+
+        Returns:
+            tuple: (status, payload, headers).
+        """
+        headers = {}
+        if status == 429:
+            headers = {"retry-after": str(max(1, round(self.retry_after))),
+                       "retry-after-ms": str(int(self.retry_after * 1000))}
+        error_type = "requests" if status == 429 else "server_error" if status >= 500 else "invalid_request_error"
+        return status, {"error": {"message": message, "type": error_type, "param": None,
+                                  "code": "rate_limit_exceeded" if status == 429 else None}}, headers
+
+    def chat_completion(self, body):
+        """
+        Answers a chat completion request, applying the configured latency and error injection.
+
+        Args:
+            body (dict): The chat completion request body.
+
+        Returns:
+            tuple: (status, payload, headers).
+        """
+        key = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            self.stats["requests"] += 1
+            attempt = self._attempts[key] = self._attempts.get(key, 0) + 1
+            if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+                self.stats["throttled"] += 1
+                return self.error_response(429, "Rate limit reached: too many requests in flight.")
+            self._in_flight += 1
+
+        try:
+            if self.error_rate and request_rng(self.seed, key, attempt).random() < self.error_rate:
+                with self.lock:
+                    self.stats["errors"] += 1
+                return self.error_response(self.error_status, f"Injected error (attempt {attempt}).")
+
+            response = self.complete(body)
+            time.sleep(self.latency + self.latency_per_token * response["usage"]["completion_tokens"])
+            return 200, response, {}
+        finally:
+            with self.lock:
+                self._in_flight -= 1
+
+    def store_file(self, filename, content, purpose):
+        """
+        Stores a file and returns its file object.
+        """
+        file_id = self.new_id("file-")
+        file_object = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = (file_object, content)
+        return file_object
+
+    def run_batch(self, batch_id):
+        """
+        Executes every request of a batch and attaches the output (and error) file to it.
+        """
+        with self.lock:
+            batch = self.batches[batch_id]
+            _, input_content = self.files[batch["input_file_id"]]
+
+        time.sleep(self.batch_delay)
+        output_lines, error_lines = [], []
+
+        for line in input_content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            try:
+                response_body = self.complete(request["body"])
+                output_lines.append(json.dumps({
+                    "id": self.new_id("batch_req_"),
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "request_id": self.new_id("req_"), "body": response_body},
+                    "error": None,
+                }))
+            except Exception as e:
+                error_lines.append(json.dumps({
+                    "id": self.new_id("batch_req_"),
+                    "custom_id": request.get("custom_id"),
+                    "response": None,
+                    "error": {"code": "mock_error", "message": str(e)},
+                }))
+
+        output_file = self.store_file(f"{batch_id}_output.jsonl", "\n".join(output_lines).encode("utf-8"),
+                                      "batch_output")
+        error_file = None
+        if error_lines:
+            error_file = self.store_file(f"{batch_id}_error.jsonl", "\n".join(error_lines).encode("utf-8"),
+                                         "batch_output")
+
+        with self.lock:
+            batch.update({
+                "status": "completed",
+                "completed_at": int(time.time()),
+                "output_file_id": output_file["id"],
+                "error_file_id": error_file["id"] if error_file else None,
+                "request_counts": {"total": len(output_lines) + len(error_lines),
+                                   "completed": len(output_lines), "failed": len(error_lines)},
+            })
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler implementing the OpenAI endpoints served by MockOpenAIServer.
+    """
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet during runs
+
+    def send_json(self, payload, status=200, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_not_found(self):
+        self.send_json({"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}}, 404)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+
+        if path.endswith("/chat/completions"):
+            status, payload, headers = self.server.chat_completion(json.loads(self.read_body()))
+            self.send_json(payload, status, headers)
+
+        elif path.endswith("/files"):
+            # Parse the multipart upload with the email package (the cgi module is deprecated)
+            raw = self.read_body()
+            header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8")
+            message = email.message_from_bytes(header + raw, policy=email.policy.HTTP)
+            filename, content, purpose = "upload.jsonl", b"", "batch"
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if name == "file":
+                    filename = part.get_filename() or filename
+                    content = part.get_payload(decode=True)
+                elif name == "purpose":
+                    purpose = part.get_payload(decode=True).decode("utf-8")
+            self.send_json(self.server.store_file(filename, content, purpose))
+
+        elif path.endswith("/batches"):
+            request = json.loads(self.read_body())
+            if request.get("input_file_id") not in self.server.files:
+                self.send_json({"error": {"message": "Unknown input file", "type": "invalid_request_error"}}, 400)
+                return
+            batch = {
+                "id": self.server.new_id("batch_"),
+                "object": "batch",
+                "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": request["input_file_id"],
+                "completion_window": request.get("completion_window", "24h"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "metadata": request.get("metadata"),
+            }
+            with self.server.lock:
+                self.server.batches[batch["id"]] = batch
+            threading.Thread(target=self.server.run_batch, args=(batch["id"],), daemon=True).start()
+            self.send_json(batch)
+
+        else:
+            self.send_not_found()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+
+        batch_match = re.search(r"/batches/([^/]+)$", path)
+        content_match = re.search(r"/files/([^/]+)/content$", path)
+
+        if batch_match and batch_match.group(1) in self.server.batches:
+            with self.server.lock:
+                batch = dict(self.server.batches[batch_match.group(1)])
+            self.send_json(batch)
+        elif content_match and content_match.group(1) in self.server.files:
+            _, content = self.server.files[content_match.group(1)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_not_found()
+
+
+def start_server(host="127.0.0.1", port=0, responder=echo_responder, batch_delay=0.0, **options):
+    """
+    Starts a mock server on a background thread.
+
+    Args:
+        host (str): Host to listen on.
+        port (int): Port to listen on (0 picks a free port).
+        responder (callable): Function mapping a chat completion request body to the response text.
+        batch_delay (float): Seconds a submitted batch stays "in_progress" before it completes.
+        **options: Latency and error injection settings of MockOpenAIServer (latency, error_rate, ...).
+
+    Returns:
+        MockOpenAIServer: The running server. Call shutdown() to stop it.
+    """
+    server = MockOpenAIServer((host, port), responder=responder, batch_delay=batch_delay, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat, files and batches API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-delay", type=float, default=0.0)
+    parser.add_argument("--nexus", help="NEXUS file to answer TaxonGPT and DtoM prompts from (echo mode if omitted)")
+    parser.add_argument("--characters", help="character_info.json of the dataset, if there is one")
+    parser.add_argument("--mistake-rate", type=float, default=0.0, help="Fraction of answers with one wrong state")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every chat completion")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="Seconds added per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of chat completions that fail")
+    parser.add_argument("--error-status", type=int, default=429, help="HTTP status of injected errors")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds of 429 responses")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Requests in flight before 429s")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.nexus:
+        mock_responder = TaxonomyResponder.from_files(args.nexus, args.characters, mistake_rate=args.mistake_rate,
+                                                      seed=args.seed)
+    else:
+        mock_responder = echo_responder
+
+    mock_server = MockOpenAIServer((args.host, args.port), responder=mock_responder, batch_delay=args.batch_delay,
+                                   latency=args.latency, latency_per_token=args.latency_per_token,
+                                   error_rate=args.error_rate, error_status=args.error_status,
+                                   retry_after=args.retry_after, max_concurrency=args.max_concurrency, seed=args.seed)
+    print(f"Mock OpenAI server listening on {mock_server.base_url}")
+    mock_server.serve_forever()
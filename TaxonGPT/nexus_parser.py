@@ -0,0 +1,193 @@
+import re
+
+ENCODINGS = ("utf-8", "gbk", "latin1")  # Tried in order when decoding a NEXUS file
+
+QUOTED_NAME_PATTERN = re.compile(r"\s*'((?:[^']|'')*)'")
+COMMENT_PATTERN = re.compile(r"\[[^\]]*\]")
+BRACE_TABLE = str.maketrans("{}", "()")  # {12} polymorphisms are read like (12)
+MATRIX_PATTERN = re.compile(r'MATRIX\s*(.*?)\s*;', re.DOTALL | re.IGNORECASE)
+NCHAR_PATTERN = re.compile(r'NCHAR\s*=\s*(\d+)', re.IGNORECASE)
+INTERLEAVE_PATTERN = re.compile(r'FORMAT[^;]*\bINTERLEAVE\b(?!\s*=\s*NO)', re.IGNORECASE)
+
+
+class _StateTable(dict):
+    """
+    Lookup table from matrix cells to knowledge graph states. Polymorphic cells such as "(12)" are translated
+    on first use and memoized; unknown symbols map to themselves.
+    """
+
+    def __missing__(self, cell):
+        if cell[0] in '({':
+            symbols = cell[1:-1].replace(' ', '').replace(',', '').replace('/', '')
+            state = ','.join(self[symbol] for symbol in symbols)
+            self[cell] = state
+            return state
+        return cell
+
+
+def _build_state_table():
+    """
+    Builds the lookup table from matrix symbols to knowledge graph states: digits map to themselves,
+    letters to 10, 11, ... (A = 10), '?' to Missing and '-' to Not Applicable.
+    """
+    table = _StateTable({str(digit): str(digit) for digit in range(10)})
+    for offset in range(26):
+        table[chr(ord('A') + offset)] = str(10 + offset)
+        table[chr(ord('a') + offset)] = str(10 + offset)
+    table['?'] = 'Missing'
+    table['-'] = 'Not Applicable'
+    return table
+
+
+STATE_TABLE = _build_state_table()
+
+
+def read_nexus(file_path):
+    """
+    Reads a NEXUS file once and decodes it, trying each supported encoding on the bytes in memory.
+
+    Args:
+        file_path (str): Path to the NEXUS file.
+
+    Returns:
+        tuple: (content, encoding) of the decoded file.
+    """
+    with open(file_path, 'rb') as file:
+        raw = file.read()
+
+    for encoding in ENCODINGS:
+        try:
+            return raw.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+
+    raise ValueError("Failed to read file with all attempted encodings.")
+
+
+def extract_matrix(content):
+    """
+    Extracts the MATRIX block and the relevant DIMENSIONS/FORMAT settings from NEXUS content.
+
+    Args:
+        content (str): The NEXUS file content.
+
+    Returns:
+        tuple: (matrix_content, nchar, interleave). nchar is None if DIMENSIONS does not declare it.
+    """
+    matrix_match = MATRIX_PATTERN.search(content)
+    if not matrix_match:
+        raise ValueError("No MATRIX block found in the NEXUS content.")
+
+    header = content[:matrix_match.start()]
+    nchar_match = NCHAR_PATTERN.search(header)
+    nchar = int(nchar_match.group(1)) if nchar_match else None
+    interleave = bool(INTERLEAVE_PATTERN.search(header))
+    return matrix_match.group(1).strip(), nchar, interleave
+
+
+def tokenize_matrix(matrix_content, nchar=None, interleave=False):
+    """
+    Parses the content of a MATRIX block in a single pass.
+
+    Handles taxon names and states on alternating lines or on the same line, interleaved blocks (a taxon
+    appearing again continues its row), whitespace between states, [comments], and polymorphisms written
+    as (12) or {12}.
+
+    Args:
+        matrix_content (str): The content of the MATRIX block.
+        nchar (int): Number of characters per taxon, if known. Needed to tell unquoted taxon names
+            from state sequences when the states of a taxon span several lines. Without it, a line holding
+            only an unquoted name is followed by one line of states, as in the legacy parser.
+        interleave (bool): Whether the matrix is interleaved.
+
+    Returns:
+        list: Rows as [taxon, state, state, ...], in order of first appearance. States use the knowledge
+            graph notation ('1', 'Missing', 'Not Applicable', '1,2' for polymorphisms).
+
+    Raises:
+        ValueError: If states come before any taxon name, or a taxon appears twice in a matrix that is not
+            interleaved.
+    """
+    rows = {}
+    current = None
+    after_name_line = False  # The previous line held only an unquoted name, so this one holds its states
+    quoted_names = "'" in matrix_content  # If names are quoted, bare words are always states
+    lookup = STATE_TABLE.__getitem__  # Cells are mapped through a dict, in C
+
+    if '[' in matrix_content:
+        matrix_content = COMMENT_PATTERN.sub('', matrix_content)
+
+    for line in matrix_content.split('\n'):
+        if quoted_names and current is not None and "'" not in line:
+            _append_cells(current, line, lookup)  # Fast path: a line holding only states
+            continue
+
+        rest = line
+        while rest and not rest.isspace():
+            # A leading name starts (or, when interleaved, continues) a row
+            name_match = QUOTED_NAME_PATTERN.match(rest) if quoted_names else None
+            if name_match:
+                name = name_match.group(1).replace("''", "'").strip()
+                current = _start_row(rows, name, interleave)
+                rest = rest[name_match.end():]
+            elif not quoted_names and rest is line and not after_name_line \
+                    and (current is None or interleave or nchar is None or len(current) > nchar):
+                parts = rest.split(None, 1)
+                current = _start_row(rows, parts[0], interleave)
+                rest = parts[1] if len(parts) > 1 else ''
+                after_name_line = not rest or rest.isspace()
+                continue
+            elif current is None:
+                raise ValueError("State found before any taxon name.")
+
+            # The states run up to the next quoted name on the same line, if any
+            next_quote = rest.find("'") if quoted_names else -1
+            states, rest = (rest, '') if next_quote == -1 else (rest[:next_quote], rest[next_quote:])
+            _append_cells(current, states, lookup)
+            after_name_line = False
+
+    return list(rows.values())  # Each row already starts with its taxon name
+
+
+def _start_row(rows, name, interleave):
+    """
+    Returns the row of a taxon, creating it on first appearance. Only interleaved matrices may repeat a name.
+    """
+    row = rows.get(name)
+    if row is None:
+        row = rows[name] = [name]
+    elif not interleave:
+        raise ValueError(f"Taxon '{name}' appears more than once in a matrix that is not interleaved.")
+    return row
+
+
+def _append_cells(row, states, lookup):
+    """
+    Appends the translated cells of a state sequence to a row. Runs of single symbols are mapped in bulk
+    between polymorphisms, so the per-cell work stays in C.
+    """
+    states = ''.join(states.split())  # Whitespace between (and inside) cells carries no meaning
+    if '{' in states:
+        states = states.translate(BRACE_TABLE)
+
+    parts = states.split('(')
+    row.extend(map(lookup, parts[0]))
+    for part in parts[1:]:
+        polymorphism, _, plain = part.partition(')')
+        row.append(lookup('(' + polymorphism + ')'))
+        row.extend(map(lookup, plain))
+
+
+def parse_nexus_file(file_path):
+    """
+    Reads and parses the MATRIX block of a NEXUS file.
+
+    Args:
+        file_path (str): Path to the NEXUS file.
+
+    Returns:
+        tuple: (rows, encoding), where rows is the output of tokenize_matrix.
+    """
+    content, encoding = read_nexus(file_path)
+    matrix_content, nchar, interleave = extract_matrix(content)
+    return tokenize_matrix(matrix_content, nchar=nchar, interleave=interleave), encoding
@@ -0,0 +1,403 @@
+import json
+import os
+import random
+import threading
+import time
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERRORS = ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError")
+
+_encodings = {}
+
+
+def token_encoding(model):
+    """
+    Returns the tiktoken encoding of a model, or None if tiktoken (or its encoding files) is unavailable.
+    """
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encodings[model] = None  # Not installed or the encoding could not be downloaded
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    Counts the tokens of a text with tiktoken, or estimates them as one token per four characters.
+    """
+    encoding = token_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model="gpt-4o"):
+    """
+    Counts the prompt tokens of a list of chat messages, including the per-message overhead.
+
+    Args:
+        messages (list): The chat messages.
+        model (str): The model.
+
+    Returns:
+        int: The number of prompt tokens.
+    """
+    prompt_tokens = 3  # Every reply is primed with <|start|>assistant<|message|>
+    for message in messages:
+        prompt_tokens += 4  # Role and message delimiters
+        content = message.get("content") or ""
+        prompt_tokens += count_tokens(content if isinstance(content, str) else json.dumps(content), model)
+    return prompt_tokens
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: holds up to capacity tokens and refills continuously at capacity per period.
+
+    Attributes:
+        capacity (float): Maximum number of tokens.
+        rate (float): Tokens added per second.
+    """
+
+    def __init__(self, capacity, period=60.0):
+        """
+        Initializes a full bucket.
+
+        Args:
+            capacity (float): Maximum number of tokens (e.g. requests or tokens per minute).
+            period (float): Seconds needed to refill an empty bucket.
+        """
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1.0):
+        """
+        Takes tokens from the bucket, waiting until enough are available. Requests larger than the bucket
+        wait for a full bucket.
+
+        Args:
+            amount (float): Number of tokens to take.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """
+        Empties the bucket, e.g. after the server reported the limit as exhausted.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = 0.0
+
+
+class RequestScheduler:
+    """
+    Paces and retries chat completion requests so concurrent callers stay within the OpenAI rate limits.
+
+    Every request estimates its tokens, takes from the requests-per-minute and tokens-per-minute buckets and
+    waits for a concurrency slot before it is sent. Rate-limited and transient failures are retried with
+    exponential backoff and jitter, honouring Retry-After. The number of concurrent requests adapts by AIMD: it
+    grows by one per window of successful requests and halves when the server throttles.
+
+    One instance can be shared by TaxonGPT, DtoM and the simulation scripts in a process (see shared()).
+
+    Attributes:
+        rpm (int): Requests per minute, or None for no request pacing.
+        tpm (int): Tokens per minute, or None for no token pacing.
+        concurrency (float): The current concurrency limit.
+        min_concurrency (int): Lower bound of the concurrency limit.
+        max_concurrency (int): Upper bound of the concurrency limit.
+        max_retries (int): Retries per request before the error is raised.
+        base_delay (float): Backoff delay of the first retry, in seconds.
+        max_delay (float): Upper bound of a backoff delay, in seconds.
+        default_completion_tokens (int): Completion tokens reserved when a request sets no max_tokens.
+        stats (dict): Counters of requests, retries, throttles and time spent waiting.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=8, min_concurrency=1, initial_concurrency=None,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, default_completion_tokens=1000):
+        """
+        Initializes the scheduler.
+
+        Args:
+            rpm (int): Requests per minute, or None for no request pacing.
+            tpm (int): Tokens per minute, or None for no token pacing.
+            max_concurrency (int): Upper bound of the concurrency limit.
+            min_concurrency (int): Lower bound of the concurrency limit.
+            initial_concurrency (int): Starting concurrency limit (max_concurrency if None).
+            max_retries (int): Retries per request before the error is raised.
+            base_delay (float): Backoff delay of the first retry, in seconds.
+            max_delay (float): Upper bound of a backoff delay, in seconds.
+            default_completion_tokens (int): Completion tokens reserved when a request sets no max_tokens.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.concurrency = float(initial_concurrency or self.max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_completion_tokens = default_completion_tokens
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failed": 0, "wait_seconds": 0.0}
+
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+
+    @classmethod
+    def shared(cls, **settings):
+        """
+        Returns the process-wide scheduler for the given settings, creating it on first use, so every caller
+        configured with the same limits draws from the same buckets.
+
+        Args:
+            **settings: Arguments of RequestScheduler().
+
+        Returns:
+            RequestScheduler: The shared scheduler.
+        """
+        key = json.dumps(settings, sort_keys=True)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(**settings)
+            return cls._shared[key]
+
+    @classmethod
+    def from_config(cls, rate_limit_config):
+        """
+        Returns the shared scheduler for the "rate_limit" configuration section.
+
+        Args:
+            rate_limit_config (dict): The configuration section, or None.
+
+        Returns:
+            RequestScheduler: The scheduler, or None if disabled.
+        """
+        if not rate_limit_config or not rate_limit_config.get("enabled", False):
+            return None
+        settings = {k: v for k, v in rate_limit_config.items() if k != "enabled"}
+        return cls.shared(**settings)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Returns the shared scheduler configured by the OPENAI_RPM, OPENAI_TPM and OPENAI_MAX_CONCURRENCY
+        environment variables, for the scripts without a configuration file. Unset limits are not paced;
+        retries and adaptive concurrency always apply.
+
+        Returns:
+            RequestScheduler: The shared scheduler.
+        """
+        settings = {}
+        for variable, setting in (("OPENAI_RPM", "rpm"), ("OPENAI_TPM", "tpm"),
+                                  ("OPENAI_MAX_CONCURRENCY", "max_concurrency")):
+            if os.getenv(variable):
+                settings[setting] = int(os.getenv(variable))
+        return cls.shared(**settings)
+
+    def count_tokens(self, text, model="gpt-4o"):
+        """
+        Counts the tokens of a text with tiktoken, or estimates them as one token per four characters.
+        """
+        return count_tokens(text, model)
+
+    def estimate_tokens(self, messages, model="gpt-4o", max_tokens=None):
+        """
+        Estimates the tokens a request counts against the TPM limit: the prompt plus the completion reserve.
+
+        Args:
+            messages (list): The chat messages.
+            model (str): The model.
+            max_tokens (int): The request's max_tokens (default_completion_tokens if None).
+
+        Returns:
+            int: The estimated number of tokens.
+        """
+        return count_message_tokens(messages, model) + (max_tokens or self.default_completion_tokens)
+
+    def estimate_request(self, request):
+        """
+        Estimates the tokens of a chat completion request given as keyword arguments.
+        """
+        return self.estimate_tokens(request.get("messages", []), request.get("model", "gpt-4o"),
+                                    request.get("max_tokens"))
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self._in_flight >= int(self.concurrency):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _on_success(self):
+        # Additive increase: one more slot after a window of successful requests
+        with self._condition:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._condition.notify_all()
+
+    def _on_throttle(self, sent_at):
+        # Multiplicative decrease, once per window: requests sent before the last decrease saw the old limit
+        with self._condition:
+            if sent_at > self._last_decrease:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                self._last_decrease = time.monotonic()
+        if self.request_bucket is not None:
+            self.request_bucket.drain()
+
+    @staticmethod
+    def retry_after(error):
+        """
+        Reads the server's Retry-After (or retry-after-ms) header from an API error.
+
+        Returns:
+            float: Seconds to wait, or None if the error carries no such header.
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after") is not None:
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass  # An HTTP date instead of seconds; fall back to backoff
+        return None
+
+    @staticmethod
+    def is_retryable(error):
+        """
+        Checks whether an API error is transient (rate limit, timeout, connection or server error).
+        """
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None:
+            return status_code in RETRYABLE_STATUS_CODES
+        return type(error).__name__ in RETRYABLE_ERRORS
+
+    def backoff_delay(self, attempt, error=None):
+        """
+        Returns the delay before a retry: the server's Retry-After if given, otherwise exponential backoff
+        with jitter.
+
+        Args:
+            attempt (int): The retry number, starting at 0.
+            error (Exception): The error being retried.
+
+        Returns:
+            float: Seconds to wait.
+        """
+        retry_after = self.retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.1 * retry_after + 0.05)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay / 2, delay)  # Equal jitter keeps retries from synchronising
+
+    def execute(self, function, estimated_tokens=0):
+        """
+        Runs one API request under the rate limits, retrying transient failures.
+
+        Args:
+            function (callable): Sends the request and returns the response.
+            estimated_tokens (int): The tokens the request counts against the TPM limit.
+
+        Returns:
+            tuple: (response, retries).
+        """
+        retries = 0
+        while True:
+            waited = 0.0
+            if self.request_bucket is not None:
+                waited += self.request_bucket.acquire(1)
+            if self.token_bucket is not None:
+                waited += self.token_bucket.acquire(estimated_tokens)
+
+            self._acquire_slot()
+            sent_at = time.monotonic()
+            try:
+                response = function()
+            except Exception as e:
+                if not self.is_retryable(e) or retries >= self.max_retries:
+                    with self._condition:
+                        self.stats["failed"] += 1
+                    raise
+
+                throttled = getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+                if throttled:
+                    self._on_throttle(sent_at)
+                delay = self.backoff_delay(retries, e)
+                with self._condition:
+                    self.stats["retries"] += 1
+                    self.stats["throttled"] += int(throttled)
+                    self.stats["wait_seconds"] += waited + delay
+                print(f"Request failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                      f"(attempt {retries + 1} of {self.max_retries}).")
+            else:
+                self._on_success()
+                with self._condition:
+                    self.stats["requests"] += 1
+                    self.stats["wait_seconds"] += waited
+                return response, retries
+            finally:
+                self._release_slot()
+
+            time.sleep(delay)
+            retries += 1
+
+    def create(self, client, **request):
+        """
+        Sends a chat completion request through the scheduler. The client's own retries are disabled so
+        throttling is seen, and handled, here.
+
+        Args:
+            client (OpenAI): The client.
+            **request: The request parameters (model, messages, ...).
+
+        Returns:
+            The chat completion response.
+        """
+        completions = self.completions(client)
+        response, _ = self.execute(lambda: completions.create(**request), self.estimate_request(request))
+        return response
+
+    @staticmethod
+    def completions(client):
+        """
+        Returns the chat completions resource of a client with the client's built-in retries turned off.
+        """
+        with_options = getattr(client, "with_options", None)
+        if with_options is not None:
+            client = with_options(max_retries=0)
+        return client.chat.completions
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    A disk-backed (SQLite) cache of chat completion responses, keyed on a hash of the request.
+
+    Attributes:
+        path (str): Path to the SQLite database file.
+        policy (str): Cache policy, one of "read_write", "read_only", "write_only" or "off".
+        max_entries (int): Maximum number of cached responses kept on disk (None for unlimited).
+        max_size_bytes (int): Maximum total size of the cached responses (None for unlimited).
+        max_age_seconds (float): Maximum age of a cached response (None for unlimited).
+        hits (int): Number of requests served from the cache.
+        misses (int): Number of requests that were not found in the cache.
+        writes (int): Number of responses written to the cache.
+    """
+
+    POLICIES = ("read_write", "read_only", "write_only", "off")
+    EVICTION_TARGET = 0.9  # Over a limit, the least recently used responses are removed down to 90% of it
+    EXPIRY_INTERVAL = 1000  # Writes between two removals of expired responses
+
+    def __init__(self, path, policy="read_write", max_entries=None, max_size_mb=None, max_age_days=None):
+        """
+        Opens (or creates) the cache database.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            policy (str): "read_write" serves hits and stores misses, "read_only" never stores,
+                "write_only" always calls the API and refreshes the cache, "off" bypasses the cache.
+            max_entries (int): Maximum number of cached responses.
+            max_size_mb (float): Maximum total size of the cached responses in megabytes.
+            max_age_days (float): Maximum age of a cached response in days.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}', expected one of {self.POLICIES}")
+
+        self.path = path
+        self.policy = policy
+        self.max_entries = max_entries
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._entries = 0  # Entries and total size on disk, kept up to date so writes need no full scan
+        self._size = 0
+        self._writes_since_eviction = 0
+        self._lock = threading.Lock()  # The connection is shared between worker threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                last_access REAL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+        self._connection.commit()
+        self.evict()  # Drop anything that expired since the last run
+
+    @classmethod
+    def from_config(cls, cache_config):
+        """
+        Creates a cache from the "cache" section of the configuration file.
+
+        Args:
+            cache_config (dict): Cache settings, or None when caching is not configured.
+
+        Returns:
+            ResponseCache: The cache, or None unless "enabled" is true.
+        """
+        if not cache_config or not cache_config.get("enabled", False):
+            return None
+
+        return cls(
+            cache_config.get("path", "response_cache.sqlite"),
+            policy=cache_config.get("policy", "read_write"),
+            max_entries=cache_config.get("max_entries"),
+            max_size_mb=cache_config.get("max_size_mb"),
+            max_age_days=cache_config.get("max_age_days"),
+        )
+
+    @staticmethod
+    def make_key(model, messages, params):
+        """
+        Computes the content-addressed key of a request.
+
+        Args:
+            model (str): The model name.
+            messages (list): The chat messages sent to the model.
+            params (dict): Sampling parameters (temperature, max_tokens, ...).
+
+        Returns:
+            str: SHA-256 hex digest of the canonical JSON form of the request.
+        """
+        payload = json.dumps({"model": model, "messages": messages, "params": params},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached response.
+
+        Args:
+            key (str): The request key.
+
+        Returns:
+            str: The cached response text, or None on a miss (or if the policy does not read).
+        """
+        if self.policy not in ("read_write", "read_only"):
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.max_age_seconds and now - row[1] > self.max_age_seconds:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                self._entries -= 1
+                self._size -= row[2]
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        """
+        Stores a response in the cache.
+
+        Args:
+            key (str): The request key.
+            model (str): The model name, kept for inspection.
+            response (str): The response text.
+        """
+        if self.policy not in ("read_write", "write_only"):
+            return
+
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            self._connection.commit()
+            self.writes += 1
+            self._writes_since_eviction += 1
+            if previous is None:
+                self._entries += 1
+                self._size += size
+            else:
+                self._size += size - previous[0]
+
+            # Eviction only runs once a limit is exceeded, or every EXPIRY_INTERVAL writes to remove expired entries
+            needs_eviction = (self.max_entries and self._entries > self.max_entries) \
+                or (self.max_size_bytes and self._size > self.max_size_bytes) \
+                or (self.max_age_seconds and self._writes_since_eviction >= self.EXPIRY_INTERVAL)
+        if needs_eviction:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes expired responses and, if the cache is over one of its size limits, the least recently used ones
+        until it is back to EVICTION_TARGET of that limit.
+        """
+        with self._lock:
+            self._writes_since_eviction = 0
+            if self.max_age_seconds:
+                self._connection.execute("DELETE FROM responses WHERE created_at < ?",
+                                         (time.time() - self.max_age_seconds,))
+
+            # Recount once per eviction, which also picks up writes from other processes sharing the file
+            self._entries, self._size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+            target_entries = int(self.max_entries * self.EVICTION_TARGET) if self.max_entries else None
+            target_size = int(self.max_size_bytes * self.EVICTION_TARGET) if self.max_size_bytes else None
+            if (target_entries is not None and self._entries > self.max_entries) \
+                    or (target_size is not None and self._size > self.max_size_bytes):
+                # Oldest first, read lazily through the last_access index
+                stale_keys = []
+                entries, size = self._entries, self._size
+                rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access")
+                for key, entry_size in rows:
+                    if (target_entries is None or entries <= target_entries) \
+                            and (target_size is None or size <= target_size):
+                        break
+                    stale_keys.append((key,))
+                    entries -= 1
+                    size -= entry_size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+                self._entries, self._size = entries, size
+
+            self._connection.commit()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Hits, misses, writes, hit rate and the number of entries on disk.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self._lock:
+            self._connection.close()
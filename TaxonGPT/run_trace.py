@@ -0,0 +1,374 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+# USD per million tokens: (input, cached input, output). Batch API requests are billed at half price.
+DEFAULT_PRICING = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-2024-08-06": (2.50, 1.25, 10.00),
+    "gpt-4o-2024-05-13": (5.00, 5.00, 15.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+BATCH_DISCOUNT = 0.5
+
+
+def usage_tokens(usage):
+    """
+    Reads the token counts from the usage object (or dict) of a chat completion response.
+
+    Args:
+        usage: The "usage" field of the response, or None.
+
+    Returns:
+        tuple: (prompt_tokens, completion_tokens, cached_tokens), zeros when the usage is unavailable.
+    """
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        return (usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0,
+                details.get("cached_tokens") or 0)
+
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0,
+            getattr(details, "cached_tokens", 0) or 0)
+
+
+class RunTrace:
+    """
+    Writes a JSONL performance and cost trace of a run. Record types:
+
+    - "run": dataset information (tool, dataset, species and character numbers).
+    - "call": one LLM call with its stage, tree depth, group size, tokens, latency, retries and cost.
+    - "stage": the wall-clock time of one pipeline stage.
+    - "summary": per-stage totals, written by write_summary.
+
+    Every record carries the "run_id" of its run, so repeated runs appending to the same file (e.g. the
+    reproducibility re-runs of one configuration) are read back as separate runs by load_trace. A run starts when
+    the trace is opened and again at each start_run().
+
+    Call records take their stage/depth/group size from the fields set with context(), which are kept per
+    thread so concurrent workers can be traced independently. Every record is flushed immediately, so the trace
+    of an interrupted run is still readable.
+
+    Attributes:
+        path (str): The trace file.
+        pricing (dict): Model name to (input, cached input, output) USD per million tokens.
+        run_id (str): Identifier of the current run.
+    """
+
+    def __init__(self, path, pricing=None):
+        """
+        Opens a trace file for appending.
+
+        Args:
+            path (str): Path to the JSONL trace file.
+            pricing (dict): Overrides of DEFAULT_PRICING.
+        """
+        self.path = path
+        self.pricing = dict(DEFAULT_PRICING)
+        for model, prices in (pricing or {}).items():
+            self.pricing[model] = tuple(prices)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._current_stage = None
+        self._stage_started = None
+        self._totals = {}
+        self.run_id = None
+        self.start_run()
+
+    @classmethod
+    def from_config(cls, trace_config):
+        """
+        Creates a trace from the "trace" configuration section.
+
+        Args:
+            trace_config (dict): The configuration section, or None.
+
+        Returns:
+            RunTrace: The trace, or None if disabled.
+        """
+        if not trace_config or not trace_config.get("enabled", False):
+            return None
+        return cls(trace_config.get("path", "run_trace.jsonl"), pricing=trace_config.get("pricing"))
+
+    def start_run(self):
+        """
+        Starts a new run: the following records get a new run_id and the stage totals start from zero. The file is
+        reopened if the previous run closed it.
+        """
+        self.end_stage()
+        with self._lock:
+            if self._file.closed:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            self._totals = {}
+
+    def write(self, record):
+        """
+        Appends one record to the trace, tagged with the current run_id.
+        """
+        line = json.dumps({"type": record["type"], "run_id": self.run_id, **record}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file.closed:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def run_info(self, **fields):
+        """
+        Writes a "run" record, e.g. run_info(tool="TaxonGPT", process="key", dataset=path, species=12, characters=29).
+        """
+        self.write({"type": "run", "time": time.time(), **fields})
+
+    @contextlib.contextmanager
+    def context(self, **fields):
+        """
+        Sets fields (stage, depth, group_size, ...) attached to the call records of the current thread.
+        Contexts nest; inner fields override outer ones.
+        """
+        previous = getattr(self._local, "fields", {})
+        self._local.fields = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self._local.fields = previous
+
+    def context_fields(self):
+        """
+        Returns the context fields of the current thread.
+        """
+        return dict(getattr(self._local, "fields", {}))
+
+    def price(self, model):
+        """
+        Returns the (input, cached input, output) prices of a model, matching dated snapshots such as
+        "gpt-4o-2024-11-20" by their longest known prefix.
+        """
+        if model in self.pricing:
+            return self.pricing[model]
+        prefixes = [name for name in self.pricing if model.startswith(name)]
+        return self.pricing[max(prefixes, key=len)] if prefixes else (0.0, 0.0, 0.0)
+
+    def cost(self, model, prompt_tokens, completion_tokens, cached_tokens=0, batch=False):
+        """
+        Computes the cost of a call in USD.
+        """
+        input_price, cached_price, output_price = self.price(model)
+        cost = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                + completion_tokens * output_price) / 1_000_000
+        return cost * BATCH_DISCOUNT if batch else cost
+
+    def record_call(self, model, usage=None, latency=0.0, retries=0, cache_hit=False, batch=False, **fields):
+        """
+        Writes a "call" record and adds it to the stage totals.
+
+        Args:
+            model (str): The model used.
+            usage: The usage of the response (object or dict), or None.
+            latency (float): Seconds spent on the call, including retries.
+            retries (int): Number of retried attempts.
+            cache_hit (bool): Whether the response was served from the response cache (no tokens are billed).
+            batch (bool): Whether the call was made through the Batch API.
+            **fields: Additional fields, overriding the context fields.
+
+        Returns:
+            dict: The record.
+        """
+        prompt_tokens, completion_tokens, cached_tokens = (0, 0, 0) if cache_hit else usage_tokens(usage)
+        record = {"type": "call", "time": time.time(), "stage": None, "depth": None, "group_size": None}
+        record.update(self.context_fields())
+        record.update(fields)
+        record.update({
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latency": round(latency, 4),
+            "retries": retries,
+            "cache_hit": cache_hit,
+            "batch": batch,
+            "cost": self.cost(model, prompt_tokens, completion_tokens, cached_tokens, batch),
+        })
+
+        with self._lock:
+            totals = self._stage_totals(record["stage"])
+            totals["calls"] += 1
+            totals["cache_hits"] += int(cache_hit)
+            totals["retries"] += retries
+            for field in ("prompt_tokens", "completion_tokens", "cached_tokens", "latency", "cost"):
+                totals[field] += record[field]
+
+        self.write(record)
+        return record
+
+    def create(self, client, stage=None, scheduler=None, **request):
+        """
+        Sends a chat completion request through an OpenAI client and records it.
+
+        Args:
+            client (OpenAI): The client.
+            stage (str): The stage of the call (overrides the context).
+            scheduler (RequestScheduler): Sends the request under the shared rate limits, if given.
+            **request: The request parameters (model, messages, ...).
+
+        Returns:
+            The chat completion response.
+        """
+        start = time.perf_counter()
+        retries = 0
+        if scheduler is not None:
+            completions = scheduler.completions(client)
+            response, retries = scheduler.execute(lambda: completions.create(**request),
+                                                  scheduler.estimate_request(request))
+        else:
+            response = client.chat.completions.create(**request)
+        fields = {"stage": stage} if stage is not None else {}
+        self.record_call(request.get("model", ""), getattr(response, "usage", None),
+                         time.perf_counter() - start, retries=retries, **fields)
+        return response
+
+    def _stage_totals(self, stage):
+        return self._totals.setdefault(stage, {
+            "calls": 0, "cache_hits": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "cached_tokens": 0, "latency": 0.0, "cost": 0.0, "wall_clock": 0.0})
+
+    def begin_stage(self, stage):
+        """
+        Starts timing a pipeline stage, ending the stage currently being timed (if any).
+        """
+        self.end_stage()
+        self._current_stage = stage
+        self._stage_started = time.perf_counter()
+
+    def end_stage(self):
+        """
+        Ends the stage being timed and writes its "stage" record.
+        """
+        if self._current_stage is None:
+            return
+
+        wall_clock = time.perf_counter() - self._stage_started
+        with self._lock:
+            self._stage_totals(self._current_stage)["wall_clock"] += wall_clock
+        self.write({"type": "stage", "time": time.time(), "stage": self._current_stage,
+                    "wall_clock": round(wall_clock, 4)})
+        self._current_stage = None
+
+    def summary(self):
+        """
+        Returns the per-stage totals recorded so far, plus a "total" entry.
+        """
+        with self._lock:
+            stages = {stage: dict(totals) for stage, totals in self._totals.items()}
+
+        total = {field: 0 for field in ("calls", "cache_hits", "retries", "prompt_tokens", "completion_tokens",
+                                        "cached_tokens", "latency", "cost", "wall_clock")}
+        for totals in stages.values():
+            for field in total:
+                total[field] += totals[field]
+        stages["total"] = total
+        return stages
+
+    def write_summary(self):
+        """
+        Ends the current stage and writes a "summary" record with the per-stage totals.
+
+        Returns:
+            dict: The per-stage totals.
+        """
+        self.end_stage()
+        stages = self.summary()
+        self.write({"type": "summary", "time": time.time(), "stages": stages})
+        return stages
+
+    def close(self):
+        """
+        Ends the current stage and closes the trace file. A later start_run() or write() reopens it.
+        """
+        self.end_stage()
+        with self._lock:
+            self._file.close()
+
+
+def load_trace(path):
+    """
+    Reads a trace file, splitting it into runs. Records are grouped by their "run_id"; in traces written before
+    run ids existed, each "run" record starts a new run.
+
+    Args:
+        path (str): Path to the JSONL trace file.
+
+    Returns:
+        list: One {"run_id", "run": merged run records, "calls": call records,
+            "stages": {stage: wall-clock seconds}} dictionary per run, in the order the runs started.
+    """
+    runs = {}
+    untagged_run, untagged_has_info = 0, False
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            run_id = record.get("run_id")
+            if run_id is None:
+                if record["type"] == "run":
+                    if untagged_has_info:
+                        untagged_run += 1
+                    untagged_has_info = True
+                run_id = f"{os.path.basename(path)}#{untagged_run + 1}"
+
+            run = runs.setdefault(run_id, {"run_id": run_id, "run": {}, "calls": [], "stages": {}})
+            if record["type"] == "run":
+                run["run"].update({k: v for k, v in record.items() if k not in ("type", "time", "run_id")})
+            elif record["type"] == "call":
+                run["calls"].append(record)
+            elif record["type"] == "stage":
+                run["stages"][record["stage"]] = run["stages"].get(record["stage"], 0.0) + record["wall_clock"]
+    return list(runs.values())
+
+
+def summarize_traces(paths):
+    """
+    Summarizes trace files as a table with one row per run, in the shape used by the runtime and API fee figures.
+
+    Args:
+        paths (list): Paths to trace files.
+
+    Returns:
+        pd.DataFrame: Columns "trace", "run", "tool", "process", "dataset", "species number", "character number",
+            "runtime (s)", "calls", "prompt tokens", "cached tokens", "completion tokens", "API fee ($)", plus one
+            "<stage> (s)" column per stage.
+    """
+    import pandas as pd
+
+    rows = []
+    for path in paths:
+        for trace in load_trace(path):
+            calls = trace["calls"]
+            row = {
+                "trace": os.path.basename(path),
+                "run": trace["run_id"],
+                "tool": trace["run"].get("tool"),
+                "process": trace["run"].get("process"),
+                "dataset": trace["run"].get("dataset"),
+                "species number": trace["run"].get("species"),
+                "character number": trace["run"].get("characters"),
+                "runtime (s)": sum(trace["stages"].values()),
+                "calls": len(calls),
+                "prompt tokens": sum(c["prompt_tokens"] for c in calls),
+                "cached tokens": sum(c.get("cached_tokens", 0) for c in calls),
+                "completion tokens": sum(c["completion_tokens"] for c in calls),
+                "API fee ($)": sum(c["cost"] for c in calls),
+            }
+            row.update({f"{stage} (s)": seconds for stage, seconds in trace["stages"].items()})
+            rows.append(row)
+
+    return pd.DataFrame(rows)
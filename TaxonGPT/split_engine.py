@@ -0,0 +1,204 @@
+import numpy as np
+
+from .taxon_matrix import bit_to_state, state_to_mask
+
+
+class SplitEngine:
+    """
+    Scores characters for splitting a group of species by information gain, computed exactly from the
+    knowledge graph, and builds classification trees without any API calls.
+
+    Polymorphic taxa ("1 and 2") contribute fractionally to the gain of each of their states and are placed in
+    every matching branch; "Missing" and "Not Applicable" are treated as separate branches so the resulting
+    paths agree with validate_results.
+
+    Attributes:
+        species (list): Species names, in knowledge graph order.
+        characters (list): Character names, in knowledge graph order.
+        masks (np.ndarray): species x characters array of uint64 state bitmasks.
+    """
+
+    SCORE_CHUNK = 8192  # Species scored at once by score_characters
+
+    def __init__(self, species, characters, masks):
+        """
+        Initializes the engine from already encoded data.
+
+        Args:
+            species (list): Species names.
+            characters (list): Character names.
+            masks (np.ndarray): species x characters array of uint64 state bitmasks.
+        """
+        self.species = list(species)
+        self.characters = list(characters)
+        self.masks = masks
+        self.species_index = {name: i for i, name in enumerate(self.species)}
+        present = int(np.bitwise_or.reduce(masks, axis=None)) if masks.size else 0
+        self.bits = np.array([b for b in range(64) if present >> b & 1], dtype=np.uint64)  # Bits in use
+
+    @classmethod
+    def from_knowledge_graph(cls, knowledge_graph):
+        """
+        Encodes a knowledge graph.
+
+        Args:
+            knowledge_graph (dict): The knowledge graph ({species: {"Characteristics": {character: state}}}).
+
+        Returns:
+            SplitEngine: The engine.
+        """
+        species = list(knowledge_graph.keys())
+        characters = []
+        for data in knowledge_graph.values():
+            for character in data["Characteristics"]:
+                if character not in characters:
+                    characters.append(character)
+
+        masks = np.zeros((len(species), len(characters)), dtype=np.uint64)
+        for i, name in enumerate(species):
+            characteristics = knowledge_graph[name]["Characteristics"]
+            for j, character in enumerate(characters):
+                masks[i, j] = state_to_mask(characteristics.get(character, "Missing"))
+
+        return cls(species, characters, masks)
+
+    def score_characters(self, group_species):
+        """
+        Computes the information gain of splitting the group on every character.
+
+        Args:
+            group_species (list): The species in the group.
+
+        Returns:
+            tuple: (gains, usable), arrays of length len(characters). A character is usable when it yields at
+                least two branches that are each smaller than the group.
+        """
+        indexes = np.array([self.species_index[s] for s in group_species], dtype=np.intp)
+        n = len(group_species)
+        n_characters = self.masks.shape[1]
+        bit_values = np.uint64(1) << self.bits
+
+        # Branch sizes (counting polymorphic species in every branch) and fractional branch weights, bits x chars.
+        # Species are processed in chunks so the temporaries stay chunk x chars whatever the number of taxa and
+        # states; only polymorphic cells, which are rare, need per-cell weights.
+        sizes = np.zeros((len(bit_values), n_characters), dtype=np.int64)
+        weights = np.zeros((len(bit_values), n_characters), dtype=np.float64)
+        for start in range(0, n, self.SCORE_CHUNK):
+            rows = self.masks[indexes[start:start + self.SCORE_CHUNK]]
+            state_counts = np.zeros(rows.shape, dtype=np.uint8)  # Number of states per cell
+            for value in bit_values:
+                state_counts += (rows & value) != 0
+
+            polymorphic_rows, polymorphic_columns = np.nonzero(state_counts > 1)
+            polymorphic_masks = rows[polymorphic_rows, polymorphic_columns]
+            polymorphic_weights = 1.0 / state_counts[polymorphic_rows, polymorphic_columns]
+            for k, value in enumerate(bit_values):
+                chunk_sizes = np.count_nonzero(rows & value, axis=0)
+                sizes[k] += chunk_sizes
+                weights[k] += chunk_sizes
+                if polymorphic_columns.size:
+                    in_state = (polymorphic_masks & value) != 0
+                    columns = polymorphic_columns[in_state]
+                    weights[k] += np.bincount(columns, weights=polymorphic_weights[in_state], minlength=n_characters) \
+                        - np.bincount(columns, minlength=n_characters)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            remaining = np.where(sizes > 0, weights / n * np.log2(sizes), 0.0).sum(axis=0)
+        gains = np.log2(n) - remaining
+
+        usable = ((sizes > 0).sum(axis=0) >= 2) & (sizes.max(axis=0) < n)
+        return gains, usable
+
+    def partition(self, group_species, character):
+        """
+        Splits a group on one character.
+
+        Args:
+            group_species (list): The species in the group.
+            character (str): The character to split on.
+
+        Returns:
+            dict: State labels mapped to the species lists of each branch.
+        """
+        j = self.characters.index(character)
+        states = {}
+        for species in group_species:
+            mask = int(self.masks[self.species_index[species], j])
+            for bit in range(64):
+                if mask >> bit & 1:
+                    states.setdefault(bit_to_state(bit), []).append(species)
+
+        # Numbered states first in numeric order, then Missing / Not Applicable
+        return dict(sorted(states.items(), key=lambda item: (not item[0].isdigit(),
+                                                             int(item[0]) if item[0].isdigit() else 0)))
+
+    def rank_characters(self, group_species, top_n=None):
+        """
+        Ranks the usable characters for a group by information gain.
+
+        Args:
+            group_species (list): The species in the group.
+            top_n (int): Return only the best top_n candidates (all if None).
+
+        Returns:
+            list: Candidates as {"Character", "InformationGain", "States"} dictionaries, best first.
+        """
+        if len(group_species) < 2:
+            return []
+
+        gains, usable = self.score_characters(group_species)
+        # Rounding removes floating point noise, so tied characters keep their knowledge graph order
+        order = [j for j in np.argsort(-np.round(gains, 12), kind="stable") if usable[j]]
+        if top_n is not None:
+            order = order[:top_n]
+
+        return [{
+            "Character": self.characters[j],
+            "InformationGain": round(float(gains[j]), 4),
+            "States": self.partition(group_species, self.characters[j])
+        } for j in order]
+
+    def best_split(self, group_species):
+        """
+        Returns the best split of a group in the classification result format.
+
+        Args:
+            group_species (list): The species in the group.
+
+        Returns:
+            dict: {"Character": ..., "States": {...}}, or None if no character separates the group.
+        """
+        candidates = self.rank_characters(group_species, top_n=1)
+        if not candidates:
+            return None
+        return {"Character": candidates[0]["Character"], "States": candidates[0]["States"]}
+
+    def build_classification(self, group_species=None, depth=0, max_depth=None):
+        """
+        Builds a complete nested classification locally, without API calls.
+
+        Args:
+            group_species (list): The species to classify (all species if None).
+            depth (int): The current depth.
+            max_depth (int): Stop splitting below this depth (no limit if None).
+
+        Returns:
+            dict: Nested {"Character": ..., "States": {state: [species] or nested classification}}, or the
+                species list itself if the group cannot be split.
+        """
+        if group_species is None:
+            group_species = self.species
+
+        if len(group_species) < 2 or (max_depth is not None and depth >= max_depth):
+            return list(group_species)
+
+        split = self.best_split(group_species)
+        if split is None:
+            return list(group_species)
+
+        for state, species_list in split["States"].items():
+            if len(species_list) > 1:
+                subtree = self.build_classification(species_list, depth + 1, max_depth)
+                if isinstance(subtree, dict):
+                    split["States"][state] = subtree
+        return split
@@ -0,0 +1,333 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+MISSING_BIT = 62  # Bit used for "Missing" states
+NOT_APPLICABLE_BIT = 63  # Bit used for "Not Applicable" states
+MISSING_MASK = np.uint64(1 << MISSING_BIT)
+NOT_APPLICABLE_MASK = np.uint64(1 << NOT_APPLICABLE_BIT)
+
+
+def state_to_mask(state):
+    """
+    Encodes a knowledge graph state string as a bitmask.
+
+    Args:
+        state (str): A state such as "2", "1 and 2", "Missing" or "Not Applicable".
+
+    Returns:
+        int: Bitmask with bit k set for state k (and the Missing/Not Applicable bits for those values).
+    """
+    state = str(state).strip()
+
+    if state == "Missing":
+        return 1 << MISSING_BIT
+    if state == "Not Applicable":
+        return 1 << NOT_APPLICABLE_BIT
+
+    mask = 0
+    for sub_state in state.replace(",", " and ").split(" and "):
+        sub_state = sub_state.strip()
+        if sub_state.isdigit() and int(sub_state) < MISSING_BIT:
+            mask |= 1 << int(sub_state)
+    return mask if mask else 1 << MISSING_BIT  # Unreadable states are treated as missing
+
+
+def bit_to_state(bit):
+    """
+    Converts a bit index back to its knowledge graph state label.
+
+    Args:
+        bit (int): The bit index.
+
+    Returns:
+        str: The state label.
+    """
+    if bit == MISSING_BIT:
+        return "Missing"
+    if bit == NOT_APPLICABLE_BIT:
+        return "Not Applicable"
+    return str(bit)
+
+
+def parse_state(state):
+    """
+    Encodes a state as written in a classification result, e.g. "2", "1 and 2", "1,2" or "Missing".
+    Unlike state_to_mask, unreadable states are not treated as missing.
+
+    Args:
+        state (str): The state to encode.
+
+    Returns:
+        int: The state bitmask, or 0 if the state cannot be read.
+    """
+    state = str(state).strip()
+    if state in ("Missing", "Not Applicable"):
+        return state_to_mask(state)
+
+    sub_states = [s.strip() for s in state.replace(",", " and ").split(" and ")]
+    if not all(s.isdigit() and int(s) < MISSING_BIT for s in sub_states):
+        return 0
+    return state_to_mask(state)
+
+
+def mask_to_bits(mask):
+    """
+    Returns the state bits set in a bitmask, in ascending order.
+    """
+    mask = int(mask)
+    return [bit for bit in range(64) if mask >> bit & 1]
+
+
+def mask_to_state(mask):
+    """
+    Converts a bitmask back to the knowledge graph notation, e.g. "2", "1 and 2", "Missing".
+    """
+    return " and ".join(bit_to_state(bit) for bit in mask_to_bits(mask))
+
+
+class TaxonMatrix:
+    """
+    The character matrix as a taxa x characters array of uint64 state bitmasks: bit k is set for state k,
+    and the Missing and Not Applicable flags use bits 62 and 63. Polymorphic cells simply set several bits,
+    so state comparisons are bitwise operations instead of string splitting.
+
+    Taxon and character names are interned once; the knowledge graph dictionary is produced on demand through
+    knowledge_graph_view or to_knowledge_graph.
+
+    Attributes:
+        taxa (list): Taxon names, in matrix order.
+        characters (list): Character names, in matrix order.
+        masks (np.ndarray): taxa x characters array of uint64 state bitmasks.
+        taxon_index (dict): Taxon name to row index.
+        character_index (dict): Character name to column index.
+    """
+
+    def __init__(self, taxa, characters, masks):
+        """
+        Initializes the matrix from already encoded data.
+
+        Args:
+            taxa (list): Taxon names.
+            characters (list): Character names.
+            masks (np.ndarray): taxa x characters array of uint64 state bitmasks.
+        """
+        self.taxa = list(taxa)
+        self.characters = list(characters)
+        self.masks = np.asarray(masks, dtype=np.uint64)
+        self.taxon_index = {name: i for i, name in enumerate(self.taxa)}
+        self.character_index = {name: j for j, name in enumerate(self.characters)}
+
+    @classmethod
+    def from_rows(cls, rows, characters=None):
+        """
+        Encodes rows as produced by nexus_parser.tokenize_matrix ([taxon, '1', '1,2', 'Missing', ...]).
+
+        Args:
+            rows (list): The matrix rows.
+            characters (list): Character names (Character1, Character2, ... if None).
+
+        Returns:
+            TaxonMatrix: The matrix.
+        """
+        n_characters = max((len(row) - 1 for row in rows), default=0)
+        if characters is None:
+            characters = [f"Character{j + 1}" for j in range(n_characters)]
+
+        cache = {}  # Each distinct cell string is encoded only once
+        masks = np.full((len(rows), len(characters)), MISSING_MASK, dtype=np.uint64)
+        for i, row in enumerate(rows):
+            cells = row[1:len(characters) + 1]
+            masks[i, :len(cells)] = [cache[c] if c in cache else cache.setdefault(c, state_to_mask(c))
+                                     for c in cells]
+
+        return cls([row[0] for row in rows], characters, masks)
+
+    @classmethod
+    def from_dataframe(cls, matrix):
+        """
+        Encodes the DataFrame produced by parse_matrix (a taxa column followed by one column per character).
+
+        Args:
+            matrix (pd.DataFrame): The parsed matrix.
+
+        Returns:
+            TaxonMatrix: The matrix.
+        """
+        rows = matrix.astype(str).values.tolist()
+        return cls.from_rows(rows, characters=list(matrix.columns[1:]))
+
+    @classmethod
+    def from_knowledge_graph(cls, knowledge_graph):
+        """
+        Encodes a knowledge graph ({taxon: {"Characteristics": {character: state}}}).
+
+        Args:
+            knowledge_graph (dict): The knowledge graph.
+
+        Returns:
+            TaxonMatrix: The matrix.
+        """
+        characters = []
+        seen = set()
+        for data in knowledge_graph.values():
+            for character in data["Characteristics"]:
+                if character not in seen:
+                    seen.add(character)
+                    characters.append(character)
+
+        rows = [[taxon] + [data["Characteristics"].get(c, "Missing") for c in characters]
+                for taxon, data in knowledge_graph.items()]
+        return cls.from_rows(rows, characters=characters)
+
+    @property
+    def shape(self):
+        """
+        Returns:
+            tuple: (number of taxa, number of characters).
+        """
+        return self.masks.shape
+
+    @property
+    def nbytes(self):
+        """
+        Returns:
+            int: Memory used by the state array, in bytes.
+        """
+        return self.masks.nbytes
+
+    @property
+    def missing(self):
+        """
+        Returns:
+            np.ndarray: Boolean taxa x characters array, True where the state is Missing.
+        """
+        return (self.masks & MISSING_MASK) != 0
+
+    @property
+    def not_applicable(self):
+        """
+        Returns:
+            np.ndarray: Boolean taxa x characters array, True where the state is Not Applicable.
+        """
+        return (self.masks & NOT_APPLICABLE_MASK) != 0
+
+    @property
+    def polymorphic(self):
+        """
+        Returns:
+            np.ndarray: Boolean taxa x characters array, True where more than one state is set.
+        """
+        return (self.masks & (self.masks - np.uint64(1))) != 0
+
+    def mask(self, taxon, character):
+        """
+        Returns the state bitmask of a cell, or None if the taxon or character is unknown.
+        """
+        i = self.taxon_index.get(taxon)
+        j = self.character_index.get(character)
+        if i is None or j is None:
+            return None
+        return int(self.masks[i, j])
+
+    def state(self, taxon, character):
+        """
+        Returns the state of a cell in the knowledge graph notation ("2", "1 and 2", "Missing", ...),
+        or None if the taxon or character is unknown.
+        """
+        mask = self.mask(taxon, character)
+        return None if mask is None else mask_to_state(mask)
+
+    def state_list(self, taxon, character):
+        """
+        Returns the individual states of a cell, e.g. ["1", "2"] for a polymorphic cell.
+        """
+        mask = self.mask(taxon, character)
+        return [] if mask is None else [bit_to_state(bit) for bit in mask_to_bits(mask)]
+
+    def state_matches(self, taxon, character, state):
+        """
+        Checks a state against the matrix. A state matches when all of its states are recorded for the taxon,
+        so "1" matches a polymorphic "1 and 2" but "1 and 2" does not match a plain "1".
+
+        Args:
+            taxon (str): The taxon name.
+            character (str): The character name.
+            state (str): The state to check.
+
+        Returns:
+            bool: True if the state matches.
+        """
+        correct = self.mask(taxon, character)
+        submitted = parse_state(state)
+        return bool(correct is not None and submitted and submitted & ~correct == 0)
+
+    def taxa_with_state(self, character, state, taxa=None):
+        """
+        Returns the taxa whose recorded states include all of the given states.
+
+        Args:
+            character (str): The character name.
+            state (str): The state, e.g. "2" or "1 and 2".
+            taxa (list): Restrict the search to these taxa (all taxa if None).
+
+        Returns:
+            list: The matching taxon names.
+        """
+        submitted = np.uint64(parse_state(state))
+        names = self.taxa if taxa is None else list(taxa)
+        if not submitted or character not in self.character_index:
+            return []
+
+        rows = self.masks[[self.taxon_index[name] for name in names], self.character_index[character]]
+        return [names[i] for i in np.flatnonzero((rows & submitted) == submitted)]
+
+    def characteristics(self, taxon):
+        """
+        Returns the knowledge graph entry of a taxon ({character: state}).
+        """
+        i = self.taxon_index[taxon]
+        return {character: mask_to_state(mask) for character, mask in zip(self.characters, self.masks[i].tolist())}
+
+    def knowledge_graph_view(self):
+        """
+        Returns a read-only mapping that behaves like the knowledge graph dictionary but builds each
+        taxon's entry only when it is accessed.
+        """
+        return KnowledgeGraphView(self)
+
+    def to_knowledge_graph(self):
+        """
+        Returns the full knowledge graph dictionary ({taxon: {"Characteristics": {character: state}}}).
+        """
+        labels = {}  # Distinct bitmasks are converted only once
+        knowledge_graph = {}
+        for taxon, row in zip(self.taxa, self.masks.tolist()):
+            knowledge_graph[taxon] = {"Characteristics": {
+                character: labels[mask] if mask in labels else labels.setdefault(mask, mask_to_state(mask))
+                for character, mask in zip(self.characters, row)
+            }}
+        return knowledge_graph
+
+
+class KnowledgeGraphView(Mapping):
+    """
+    Lazy knowledge graph view of a TaxonMatrix: view[taxon] returns {"Characteristics": {character: state}}.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __getitem__(self, taxon):
+        if taxon not in self.matrix.taxon_index:
+            raise KeyError(taxon)
+        return {"Characteristics": self.matrix.characteristics(taxon)}
+
+    def __iter__(self):
+        return iter(self.matrix.taxa)
+
+    def __len__(self):
+        return len(self.matrix.taxa)
+
+    def __contains__(self, taxon):
+        return taxon in self.matrix.taxon_index
@@ -0,0 +1,234 @@
+import json
+
+import pytest
+
+from TaxonGPT.dtom_parsing import (apply_validation_corrections, check_matrix_cell, check_matrix_locally,
+                                   expected_matrix_cell, find_matching_text, format_matrix_cell, merge_character_lists,
+                                   normalize_character_text, parse_structured_state, parse_structured_tile,
+                                   parse_tile_lines, parse_to_matrix, parse_validation_response, plan_extraction_tiles)
+
+CHARACTERS = {str(number): {"description": f"Character {number}", "states": {"1": "small", "2": "large"}}
+              for number in range(1, 13)}
+MANY_STATES = {"description": "Number of segments",
+               "states": {str(state): f"{state} segments" for state in range(1, 12)}}
+
+
+def test_normalize_character_text():
+    assert normalize_character_text("Two spurs.") == "2 spur"
+    assert normalize_character_text("Glass-like, (3) LOBES") == "glass like 3 lobe"
+
+
+def test_find_matching_text_guards_numbers_and_negations():
+    assert find_matching_text("Hind wings present", ["Fore wings absent", "hind-wing present."]) == 1
+    assert find_matching_text("4 segments", ["five segments"]) is None
+    assert find_matching_text("present", ["not present"]) is None
+    assert find_matching_text("Hind wing present", ["Hind wings presnt"]) == 0
+    assert find_matching_text("Hind wing present", ["Hind wings presnt"], threshold=1.0) is None
+
+
+def test_merge_matches_characters_and_renumbers():
+    chunks = [
+        {"1": {"description": "Number of tails", "states": {"1": "two tails", "2": "three tails"}}},
+        {"1": {"description": "Hind wings", "states": {"1": "present", "2": "absent"}},
+         "2": {"description": "number of tails.", "states": {"1": "2 tails", "2": "four tails"}}},
+    ]
+    assert merge_character_lists(chunks) == {
+        "1": {"description": "Number of tails", "states": {"1": "two tails", "2": "three tails", "3": "four tails"}},
+        "2": {"description": "Hind wings", "states": {"1": "present", "2": "absent"}},
+    }
+
+
+def test_merge_matches_states_phrased_with_the_character():
+    chunks = [
+        {"1": {"description": "Spines on the hind tibia", "states": {"1": "spines present", "2": "spines absent"}}},
+        {"1": {"description": "Spines on hind tibiae", "states": {"1": "absent", "2": "present", "3": "numerous"}}},
+    ]
+    assert merge_character_lists(chunks)["1"]["states"] == {"1": "spines present", "2": "spines absent",
+                                                            "3": "numerous"}
+
+
+def test_merge_keeps_distinct_states_of_one_chunk():
+    chunks = [
+        {"1": {"description": "Wing shape", "states": {"1": "narrow", "2": "narrower", "3": "Narrow."}}},
+        {"1": {"description": "Wing shape", "states": {"1": "narrow", "2": "narrower", "3": "broad"}}},
+    ]
+    assert merge_character_lists(chunks)["1"]["states"] == {"1": "narrow", "2": "narrower", "3": "broad"}
+
+
+def test_merge_skips_malformed_characters():
+    chunks = [{"1": "not a character", "2": {"description": " "}, "3": {"description": "Eyes", "states": None}}]
+    assert merge_character_lists(chunks) == {"1": {"description": "Eyes", "states": {}}}
+
+
+def test_tile_lines():
+    response = """Here are the results:
+    species1 character1: state2 (long)
+    **Species 1, Character 12**: state10 (x) and state11 (y)
+    species 2 character 3: Missing (?)
+    - species2 character12: state12 (z)
+    """
+    assert parse_tile_lines(response, {0, 1}, {"1", "3", "12"}) == {
+        (0, "1"): "character1: state2 (long)",
+        (0, "12"): "character12: state10 (x) and state11 (y)",
+        (1, "3"): "character3: Missing (?)",
+        (1, "12"): "character12: state12 (z)",
+    }
+
+
+def test_tile_lines_with_missing_cells():
+    response = "species1 character1: state1 (small)\nspecies2 character2: state2 (large)"
+    assert set(parse_tile_lines(response, {0, 1}, {"1", "2"})) == {(0, "1"), (1, "2")}
+    assert parse_tile_lines("I could not find these characters.", {0}, {"1"}) == {}
+
+
+def test_tile_lines_with_extra_cells():
+    response = "\n".join(["species1 character1: state1 (small)",
+                          "species1 character1: state2 (large)",  # Repeated cell: the first line is kept
+                          "species3 character1: state1 (small)",  # Species outside the tile
+                          "species1 character9: state1 (small)"])  # Character outside the tile
+    assert parse_tile_lines(response, {0, 1}, {"1", "2"}) == {(0, "1"): "character1: state1 (small)"}
+
+
+@pytest.mark.parametrize("tile", ["species", "character", "block"])
+def test_extraction_tiles_cover_every_cell_once(tile):
+    descriptions = [f"Species {number} " + "description words " * 20 * number for number in range(1, 8)]
+    tiles = plan_extraction_tiles(descriptions, CHARACTERS, tile, token_budget=600)
+
+    cells = [(index, character_id) for indexes, character_ids in tiles
+             for index in indexes for character_id in character_ids]
+    assert sorted(cells) == sorted((index, character_id) for index in range(7) for character_id in CHARACTERS)
+    if tile == "block":
+        assert len(tiles) > 1 and all(indexes and character_ids for indexes, character_ids in tiles)
+
+
+def test_block_tiles_give_long_descriptions_their_own_species_group():
+    descriptions = ["short", "long " * 2000, "short"]
+    tiles = plan_extraction_tiles(descriptions, CHARACTERS, "block", token_budget=1000)
+    assert {tuple(indexes) for indexes, _ in tiles} == {(0,), (1,), (2,)}
+
+
+def test_format_matrix_cell():
+    assert format_matrix_cell(["2"]) == "2"
+    assert format_matrix_cell(["11", "2", "10", "2"]) == "(2 10 11)"
+    assert format_matrix_cell(["1"], missing=True) == format_matrix_cell([]) == format_matrix_cell(["x"]) == "-"
+
+
+def test_parse_structured_state():
+    assert parse_structured_state({"character_id": 3, "states": ["state12", "2"], "missing": False}) == \
+        {"character_id": "3", "states": ["12", "2"], "missing": False}
+    with pytest.raises(ValueError):
+        parse_structured_state({"character_id": "3", "states": "2", "missing": False})
+
+
+def test_parse_to_matrix():
+    states = {
+        "1": "character1: state2 (long)",
+        "2": "character2: state10 (x) and state2 (y)",
+        "3": "character3: Missing (?)",
+        "4": {"character_id": "4", "states": ["12"], "missing": False},
+        "5": {"character_id": "5", "states": ["1"], "missing": True},
+        "6": None,
+    }
+    assert parse_to_matrix(states) == "2 (2 10) - 12 - -"
+
+
+def test_structured_tile():
+    response = json.dumps({"cells": [
+        {"species": 1, "character_id": "1", "states": ["state10"], "missing": False},
+        {"species": 1, "character_id": "1", "states": ["2"], "missing": False},  # Repeated cell
+        {"species": 2, "character_id": "2", "states": [], "missing": True},
+        {"species": 3, "character_id": "1", "states": ["1"], "missing": False},  # Species outside the tile
+        {"species": 2, "character_id": "1", "states": "1", "missing": False},  # Invalid cell
+    ]})
+    assert parse_structured_tile(response, {0, 1}, {"1", "2"}) == {
+        (0, "1"): {"character_id": "1", "states": ["10"], "missing": False},
+        (1, "2"): {"character_id": "2", "states": [], "missing": True},
+    }
+    assert parse_structured_tile("species1 character1: state1", {0}, {"1"}) == {}
+
+
+def test_structured_validation_response():
+    response = json.dumps({"species": "Ameletus", "characters": [
+        {"character_id": "Character 12", "matrix_state": "2", "expected_states": ["state10", "11"], "result": "Error"},
+        {"character_id": 3, "matrix_state": "1", "expected_states": [], "result": "Correct"},
+    ]})
+    assert parse_validation_response(response, structured=True) == {
+        "Species": "Ameletus",
+        "Character Validation Report": [
+            {"Character ID": 12, "Matrix State": "2", "Expected State": "10 or 11", "Expected States": ["10", "11"],
+             "Result": "Error"},
+            {"Character ID": 3, "Matrix State": "1", "Expected State": "-", "Expected States": [], "Result": "Correct"},
+        ],
+    }
+
+
+def test_text_validation_response():
+    response = """```
+    Species: Ameletus
+    Character Validation Report:
+    - Character 12: Number of tails
+      Matrix State: 2
+      Expected State: 10 (three tails)
+      Result: Error
+    - Character 3: Hind wings
+      Matrix State: 1
+      Expected State: 1
+      Result: Correct
+    ```"""
+    expected = {"Species": "Ameletus", "Character Validation Report": [
+        {"Character ID": 12, "Character Description": "Number of tails", "Matrix State": "2",
+         "Expected State": "10 (three tails)", "Result": "Error"},
+        {"Character ID": 3, "Character Description": "Hind wings", "Matrix State": "1", "Expected State": "1",
+         "Result": "Correct"},
+    ]}
+    assert parse_validation_response(response) == expected
+    assert parse_validation_response(response, structured=True) == expected  # Invalid JSON is parsed as text
+
+
+@pytest.mark.parametrize("cell, expected", [
+    ("2", ("2", None)),
+    (" (11 10) ", ("(10 11)", None)),
+    ("-", ("-", None)),
+    ("?", ("-", None)),
+    ("12", ("-", "state 12 out of range")),
+    ("(2 15)", ("2", "state 15 out of range")),
+    ("(2 15 16)", ("2", "state 15, 16 out of range")),
+    ("Missing", ("-", "unparsed cell 'Missing'")),
+    ("(1 -)", ("-", "unparsed cell '(1 -)'")),
+])
+def test_check_matrix_cell(cell, expected):
+    assert check_matrix_cell(cell, MANY_STATES) == expected
+
+
+def test_check_matrix_locally():
+    character_list = {"1": MANY_STATES, "2": CHARACTERS["2"], "3": CHARACTERS["3"]}
+    assert check_matrix_locally("(10 11) 2 -", character_list) == (["(10 11)", "2", "-"], {})
+    assert check_matrix_locally("12 (1 2)", character_list) == (
+        ["-", "(1 2)", "-"], {"matrix": "2 cells for 3 characters", "1": "state 12 out of range"})
+
+
+def test_expected_matrix_cell():
+    assert expected_matrix_cell({"Expected State": "10 (ten segments) or 2"}) == "10"
+    assert expected_matrix_cell({"Expected State": "10 or 11", "Expected States": ["11", "10"]}) == "(10 11)"
+    assert expected_matrix_cell({}) == "-"
+
+
+def test_validation_corrections():
+    character_list = {"1": MANY_STATES, "2": CHARACTERS["2"], "3": CHARACTERS["3"], "4": CHARACTERS["4"]}
+    cells = ["1", "1", "1", "1"]
+    tried_cells = {character_id: {cell} for character_id, cell in zip(character_list, cells)}
+    tried_cells["3"].add("2")
+    reports = [
+        {"Character ID": 1, "Result": "Error", "Expected State": "10 (ten segments)"},
+        {"Character ID": 1, "Result": "Error", "Expected State": "11"},  # Second correction of a character
+        {"Character ID": 2, "Result": "Error", "Expected State": "12 (huge)"},  # Out of range
+        {"Character ID": 3, "Result": "Error", "Expected State": "2"},  # Already rejected
+        {"Character ID": 4, "Result": "Error", "Expected State": "2"},  # Not validated in this round
+        {"Character ID": 4, "Result": "Correct", "Expected State": "1"},
+    ]
+
+    corrected = apply_validation_corrections(reports, cells, character_list, ["1", "2", "3"], tried_cells)
+
+    assert corrected == ["1"]
+    assert cells == ["10", "1", "1", "1"]
+    assert tried_cells["1"] == {"1", "10"} and tried_cells["2"] == {"1"}
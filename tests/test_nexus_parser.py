@@ -0,0 +1,103 @@
+import glob
+import os
+
+import pytest
+
+from TaxonGPT.benchmark_nexus_parser import generate_matrix, legacy_parse_rows
+from TaxonGPT.nexus_parser import extract_matrix, parse_nexus_file, read_nexus, tokenize_matrix
+
+DATASETS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                         "Taxonomic Material", "Trial Datasets", "*", "nexdata")))
+
+
+def test_matches_legacy_parser_on_synthetic_matrix():
+    content = generate_matrix(200, 30, seed=3)
+    assert tokenize_matrix(content) == legacy_parse_rows(content)
+
+
+@pytest.mark.parametrize("path", DATASETS, ids=lambda path: os.path.basename(os.path.dirname(path)))
+def test_matches_legacy_parser_on_trial_datasets(path):
+    rows, _ = parse_nexus_file(path)
+    matrix_content, _, _ = extract_matrix(read_nexus(path)[0])
+    legacy_rows = legacy_parse_rows(matrix_content)
+
+    assert [row[0] for row in rows] == [row[0] for row in legacy_rows]
+    for row, legacy_row in zip(rows, legacy_rows):
+        assert len(row) == len(legacy_row)
+        for cell, legacy_cell in zip(row, legacy_row):
+            # The legacy parser split multi-digit letter states inside polymorphisms into single digits
+            assert cell == legacy_cell or legacy_cell == ",".join(cell.replace(",", ""))
+
+
+def test_letter_polymorphism():
+    rows = tokenize_matrix("'a'\n(49ABF)(ab)C")
+    assert rows == [["a", "4,9,10,11,15", "10,11", "12"]]
+
+
+def test_polymorphism_notations():
+    rows = tokenize_matrix("'a'\n(12){12}(1 2)(1,2)(1/2)?-")
+    assert rows == [["a"] + ["1,2"] * 5 + ["Missing", "Not Applicable"]]
+
+
+def test_comments_and_whitespace():
+    rows = tokenize_matrix("[taxa follow]\n'a' [first] 0 1\t(12) [note [x]\n'b' 1 0 ?", nchar=3)
+    assert rows == [["a", "0", "1", "1,2"], ["b", "1", "0", "Missing"]]
+
+
+def test_quoted_names_with_spaces_and_quotes():
+    rows = tokenize_matrix("'Genus species' 01\n'O''Brien''s moth'\n10")
+    assert rows == [["Genus species", "0", "1"], ["O'Brien's moth", "1", "0"]]
+
+
+def test_unquoted_names_on_same_or_separate_lines():
+    same_line = tokenize_matrix("taxon_a 0 1 2\ntaxon_b 101", nchar=3)
+    separate_lines = tokenize_matrix("taxon_a\n01\n2\ntaxon_b\n101", nchar=3)
+    assert same_line == separate_lines == [["taxon_a", "0", "1", "2"], ["taxon_b", "1", "0", "1"]]
+
+
+def test_unquoted_names_without_nchar_alternate_with_state_lines():
+    content = "taxon_a\n012\ntaxon_b\n101"
+    expected = [["taxon_a", "0", "1", "2"], ["taxon_b", "1", "0", "1"]]
+    assert tokenize_matrix(content) == legacy_parse_rows(content) == expected
+    assert tokenize_matrix("taxon_a 012\ntaxon_b\n1 0 1") == expected
+
+
+def test_repeated_taxon_requires_interleave():
+    with pytest.raises(ValueError):
+        tokenize_matrix("a 01\nb 10\na 11")
+    with pytest.raises(ValueError):
+        tokenize_matrix("'a' 01\n'b' 10\n'a' 11")
+    assert tokenize_matrix("a 01\nb 10\na 11", interleave=True) == [["a", "0", "1", "1", "1"], ["b", "1", "0"]]
+
+
+def test_interleaved_blocks_continue_rows():
+    content = "'a' 01\n'b' 10\n\n'a' (49ABF)[c]1\n'b' -?"
+    assert tokenize_matrix(content, interleave=True) == [["a", "0", "1", "4,9,10,11,15", "1"],
+                                                         ["b", "1", "0", "Not Applicable", "Missing"]]
+
+    unquoted = "a 01\nb 10\n\na 21\nb 0?"
+    assert tokenize_matrix(unquoted, nchar=4, interleave=True) == [["a", "0", "1", "2", "1"],
+                                                                   ["b", "1", "0", "0", "Missing"]]
+    assert tokenize_matrix("a\n01\nb\n10\n\na\n21\nb\n0?", interleave=True) == \
+        tokenize_matrix(unquoted, interleave=True)
+
+
+def test_state_before_name():
+    with pytest.raises(ValueError):
+        tokenize_matrix("01\n'a' 01")
+
+
+def test_extract_matrix_settings():
+    header = "#NEXUS\nBEGIN DATA;\nDIMENSIONS NTAX=2 NCHAR=3;\n"
+    assert extract_matrix(header + "FORMAT SYMBOLS=\"012\" INTERLEAVE;\nMATRIX\na 012\nb 210\n;\nEND;") == \
+        ("a 012\nb 210", 3, True)
+    assert extract_matrix(header + "FORMAT INTERLEAVE=NO;\nMATRIX\na 012\n;") == ("a 012", 3, False)
+    with pytest.raises(ValueError):
+        extract_matrix(header + "END;")
+
+
+def test_read_nexus_falls_back_to_latin1(tmp_path):
+    path = tmp_path / "nexdata"
+    path.write_bytes("MATRIX\n'Café' 01\n;".encode("latin1"))
+    content, encoding = read_nexus(str(path))
+    assert (content, encoding) == ("MATRIX\n'Café' 01\n;", "latin1")
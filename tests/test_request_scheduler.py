@@ -0,0 +1,115 @@
+import types
+
+import pytest
+from openai import OpenAI
+
+from TaxonGPT.mock_openai_server import start_server
+from TaxonGPT.request_scheduler import RequestScheduler
+
+MESSAGES = [{"role": "user", "content": "Classify the group."}]
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(**options):
+        server = start_server(**options)
+        servers.append(server)
+        return server, OpenAI(api_key="test", base_url=server.base_url)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def header_error(headers, status_code=429):
+    return types.SimpleNamespace(status_code=status_code, response=types.SimpleNamespace(headers=headers))
+
+
+def test_retries_injected_errors_until_success(mock_server):
+    server, client = mock_server(error_rate=0.3, error_status=429, retry_after=0.01, seed=1)
+    scheduler = RequestScheduler(max_retries=10)
+
+    for i in range(20):
+        response = scheduler.create(client, model="gpt-4o", messages=[{"role": "user", "content": f"Request {i}"}])
+        assert response.choices[0].message.content
+
+    assert server.stats["errors"] > 0
+    assert scheduler.stats["retries"] == scheduler.stats["throttled"] == server.stats["errors"]
+    assert scheduler.stats["requests"] == 20
+    assert scheduler.stats["failed"] == 0
+
+
+def test_server_errors_are_retried_without_throttling(mock_server):
+    server, client = mock_server(error_rate=0.5, error_status=503, seed=2)
+    scheduler = RequestScheduler(max_retries=10, base_delay=0.001)
+
+    for i in range(5):
+        scheduler.create(client, model="gpt-4o", messages=[{"role": "user", "content": f"Request {i}"}])
+
+    assert scheduler.stats["retries"] == server.stats["errors"] > 0
+    assert scheduler.stats["throttled"] == 0
+    assert scheduler.concurrency == scheduler.max_concurrency
+
+
+def test_gives_up_after_max_retries(mock_server):
+    server, client = mock_server(error_rate=1.0, error_status=500)
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.001)
+
+    with pytest.raises(Exception) as error:
+        scheduler.create(client, model="gpt-4o", messages=MESSAGES)
+
+    assert error.value.status_code == 500
+    assert server.stats["requests"] == 3
+    assert scheduler.stats["retries"] == 2 and scheduler.stats["failed"] == 1
+
+
+def test_client_errors_are_not_retried(mock_server):
+    server, client = mock_server(error_rate=1.0, error_status=400)
+    scheduler = RequestScheduler(max_retries=5, base_delay=0.001)
+
+    with pytest.raises(Exception) as error:
+        scheduler.create(client, model="gpt-4o", messages=MESSAGES)
+
+    assert error.value.status_code == 400
+    assert server.stats["requests"] == 1
+    assert scheduler.stats["retries"] == 0 and scheduler.stats["failed"] == 1
+
+
+def test_reads_retry_after_from_rate_limit_error(mock_server):
+    _, client = mock_server(error_rate=1.0, error_status=429, retry_after=2.5)
+
+    with pytest.raises(Exception) as error:
+        client.with_options(max_retries=0).chat.completions.create(model="gpt-4o", messages=MESSAGES)
+
+    assert RequestScheduler.retry_after(error.value) == 2.5  # retry-after-ms takes precedence over whole seconds
+    delay = RequestScheduler(base_delay=100.0).backoff_delay(0, error.value)
+    assert 2.5 <= delay <= 2.5 * 1.1 + 0.05  # Retry-After replaces the exponential backoff, plus a little jitter
+
+
+def test_retry_after_headers():
+    assert RequestScheduler.retry_after(header_error({"retry-after": "3"})) == 3.0
+    assert RequestScheduler.retry_after(header_error({"retry-after-ms": "250", "retry-after": "1"})) == 0.25
+    assert RequestScheduler.retry_after(header_error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+    assert RequestScheduler.retry_after(header_error({})) is None
+    assert RequestScheduler.retry_after(ValueError("no response")) is None
+
+
+def test_backoff_without_retry_after_is_exponential_and_capped():
+    scheduler = RequestScheduler(base_delay=1.0, max_delay=10.0)
+    for attempt, delay in enumerate((1.0, 2.0, 4.0, 8.0, 10.0, 10.0)):
+        assert delay / 2 <= scheduler.backoff_delay(attempt, header_error({})) <= delay
+
+
+def test_throttling_halves_concurrency(mock_server):
+    server, client = mock_server(error_rate=1.0, error_status=429, retry_after=0.01)
+    scheduler = RequestScheduler(max_concurrency=8, max_retries=1)
+
+    with pytest.raises(Exception):
+        scheduler.create(client, model="gpt-4o", messages=MESSAGES)
+
+    # Only the retried 429 lowers the limit; the final one is raised to the caller
+    assert scheduler.concurrency == 4
+    assert scheduler.stats["throttled"] == 1 and server.stats["requests"] == 2
@@ -0,0 +1,161 @@
+import json
+import types
+
+import pytest
+
+import TaxonGPT.response_cache as response_cache
+from TaxonGPT import TaxonGPT
+from TaxonGPT.response_cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A controllable clock for the cache, so access order and ages do not depend on timer resolution.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(response_cache, "time", types.SimpleNamespace(time=lambda: now[0]))
+
+    def advance(seconds=1.0):
+        now[0] += seconds
+
+    return advance
+
+
+def open_cache(tmp_path, **settings):
+    return ResponseCache(str(tmp_path / "cache.sqlite"), **settings)
+
+
+def fill(cache, keys, clock, response="x" * 100):
+    for key in keys:
+        cache.put(key, "gpt-4o", response)
+        clock()
+
+
+def cached_keys(cache):
+    return {key for key, in cache._connection.execute("SELECT key FROM responses")}
+
+
+def test_from_config_is_disabled_by_default(tmp_path):
+    assert ResponseCache.from_config(None) is None
+    assert ResponseCache.from_config({"path": str(tmp_path / "cache.sqlite")}) is None
+    cache = ResponseCache.from_config({"enabled": True, "path": str(tmp_path / "cache.sqlite"), "max_entries": 5})
+    assert cache.policy == "read_write" and cache.max_entries == 5
+
+
+def test_unknown_policy(tmp_path):
+    with pytest.raises(ValueError):
+        open_cache(tmp_path, policy="sometimes")
+
+
+@pytest.mark.parametrize("policy, stores, serves", [
+    ("read_write", True, True),
+    ("read_only", False, True),
+    ("write_only", True, False),
+    ("off", False, False),
+])
+def test_policies(tmp_path, policy, stores, serves):
+    seeded = open_cache(tmp_path)
+    seeded.put("seeded", "gpt-4o", "old answer")
+    seeded.close()
+
+    cache = open_cache(tmp_path, policy=policy)
+    cache.put("new", "gpt-4o", "new answer")
+    assert ("new" in cached_keys(cache)) == stores
+    assert cache.get("seeded") == ("old answer" if serves else None)
+
+    cache.put("seeded", "gpt-4o", "refreshed answer")
+    assert ResponseCache(cache.path).get("seeded") == ("refreshed answer" if stores else "old answer")
+
+
+def test_make_key_depends_on_the_whole_request():
+    messages = [{"role": "user", "content": "Classify"}]
+    key = ResponseCache.make_key("gpt-4o", messages, {"temperature": 0, "max_tokens": 100})
+    assert key == ResponseCache.make_key("gpt-4o", messages, {"max_tokens": 100, "temperature": 0})
+    assert key != ResponseCache.make_key("gpt-4o-mini", messages, {"temperature": 0, "max_tokens": 100})
+    assert key != ResponseCache.make_key("gpt-4o", messages, {"temperature": 1, "max_tokens": 100})
+
+
+def test_evicts_least_recently_used_only_when_entry_limit_is_exceeded(tmp_path, clock):
+    cache = open_cache(tmp_path, max_entries=10)
+    evictions = []
+    evict = cache.evict
+    cache.evict = lambda: evictions.append(1) or evict()
+
+    fill(cache, [f"key{i}" for i in range(10)], clock)
+    fill(cache, ["key0"], clock)  # Replacing an entry does not grow the cache
+    assert evictions == [] and len(cached_keys(cache)) == 10
+
+    cache.get("key1")  # Reading an entry makes it recently used
+    clock()
+    fill(cache, ["key10"], clock)
+
+    # Over the limit: the oldest entries are removed down to 90% of it
+    assert evictions == [1]
+    assert cached_keys(cache) == {"key0", "key1"} | {f"key{i}" for i in range(4, 11)}
+    assert cache.stats()["entries"] == cache._entries == 9
+
+
+def test_evicts_down_to_size_limit(tmp_path, clock):
+    cache = open_cache(tmp_path, max_size_mb=1000 / (1024 * 1024))  # 1000 bytes
+
+    fill(cache, [f"key{i}" for i in range(10)], clock)  # 100 bytes each
+    assert len(cached_keys(cache)) == 10
+
+    fill(cache, ["large"], clock, response="y" * 300)
+    assert cached_keys(cache) == {"large"} | {f"key{i}" for i in range(4, 10)}  # 900 bytes, 90% of the limit
+    assert cache._size == 900
+
+
+def test_expired_entries_are_not_served(tmp_path, clock):
+    cache = open_cache(tmp_path, max_age_days=1)
+    fill(cache, ["old"], clock)
+    clock(86400)
+    fill(cache, ["new"], clock)
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "x" * 100
+    assert cached_keys(cache) == {"new"} and cache._entries == 1
+
+
+def test_expired_entries_are_removed_periodically_and_on_open(tmp_path, clock):
+    cache = open_cache(tmp_path, max_age_days=1)
+    cache.EXPIRY_INTERVAL = 3
+    fill(cache, ["a", "b"], clock)
+    clock(86400)
+
+    fill(cache, ["c"], clock)  # The third write removes the expired entries
+    assert cached_keys(cache) == {"c"}
+
+    fill(cache, ["d"], clock)
+    cache.close()
+    clock(86400)
+    assert cached_keys(open_cache(tmp_path, max_age_days=1)) == set()
+
+
+def test_chat_completion_use_cache_bypasses_reads(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"api_key": "test", "paths": {},
+                                       "cache": {"enabled": True, "path": str(tmp_path / "cache.sqlite")}}))
+    taxon_gpt = TaxonGPT(str(config_path))
+
+    answers = iter(["first answer", "corrected answer"])
+    calls = []
+
+    def create(**request):
+        calls.append(request)
+        message = types.SimpleNamespace(content=next(answers))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+    completions = types.SimpleNamespace(create=create)
+    taxon_gpt.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+    messages = [{"role": "user", "content": "Classify"}]
+
+    assert taxon_gpt.chat_completion(messages, temperature=0) == "first answer"
+    assert taxon_gpt.chat_completion(messages, temperature=0) == "first answer"  # Served from the cache
+    assert len(calls) == 1
+
+    # A correction repeats the request: the API is called and its answer replaces the cached one
+    assert taxon_gpt.chat_completion(messages, use_cache=False, temperature=0) == "corrected answer"
+    assert len(calls) == 2
+    assert taxon_gpt.chat_completion(messages, temperature=0) == "corrected answer"